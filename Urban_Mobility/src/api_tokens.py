@@ -0,0 +1,160 @@
+import hashlib
+import hmac
+import secrets
+import time
+from datetime import datetime
+from database import get_connection, close_connection
+from encryption import encrypt_data, decrypt_data, blind_index, legacy_blind_index
+from system_logging import log_action
+
+API_TOKEN_PREFIX = "um_"
+API_TOKEN_SCOPES = ['scooters:read', 'scooters:write', 'travellers:read', 'logs:read']
+DEFAULT_TOKEN_DAYS = 90
+
+def hash_api_token(token, salt):
+    return hashlib.sha256(f"{salt}{token}".encode('utf-8')).hexdigest()
+
+def api_token_index(token):
+    return blind_index(token, "api_token", fold_case=False)
+
+def legacy_api_token_indexes(token):
+    return legacy_blind_index(token, "api_token", fold_case=False), legacy_blind_index(token, "api_token")
+
+def issue_api_token(name, scopes, issued_by, valid_days=DEFAULT_TOKEN_DAYS):
+    invalid_scopes = [scope for scope in scopes if scope not in API_TOKEN_SCOPES]
+    if invalid_scopes:
+        print(f"Unknown scopes: {', '.join(invalid_scopes)}")
+        return None
+
+    token = API_TOKEN_PREFIX + secrets.token_urlsafe(32)
+    salt = secrets.token_hex(16)
+    now = time.time()
+
+    conn = get_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute('''
+            INSERT INTO ApiTokens (token_index, token_hash, salt, name, scopes, issued_by, created, expires, revoked)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, 0)
+        ''', (
+            api_token_index(token),
+            hash_api_token(token, salt),
+            salt,
+            encrypt_data(name),
+            " ".join(scopes),
+            encrypt_data(issued_by),
+            now,
+            now + valid_days * 86400
+        ))
+        conn.commit()
+        token_id = cursor.lastrowid
+    except Exception as e:
+        print(f"Error issuing API token: {e}")
+        return None
+    finally:
+        close_connection(conn)
+
+    log_action(issued_by, f"Issued API token {token_id}", f"Name: {name}, Scopes: {' '.join(scopes)}, Valid days: {valid_days}")
+    return token_id, token
+
+def verify_api_token(token, required_scope=None):
+    if not token or not token.startswith(API_TOKEN_PREFIX):
+        return False, "Invalid token"
+
+    conn = get_connection()
+    try:
+        cursor = conn.cursor()
+        token_index = api_token_index(token)
+        cursor.execute('''
+            SELECT id, token_index, token_hash, salt, scopes, expires, revoked
+            FROM ApiTokens
+            WHERE token_index IN (?, ?, ?)
+        ''', (token_index, *legacy_api_token_indexes(token)))
+        rows = cursor.fetchall()
+
+        row = next((row for row in rows if hmac.compare_digest(hash_api_token(token, row[3]), row[2])), None)
+        if row and row[1] != token_index:
+            cursor.execute('UPDATE ApiTokens SET token_index = ? WHERE id = ?', (token_index, row[0]))
+            conn.commit()
+    finally:
+        close_connection(conn)
+
+    if not row:
+        log_action("...", "Rejected API token", "Unknown token" if not rows else "Hash mismatch", True)
+        return False, "Invalid token"
+
+    token_id, _, token_hash, salt, scopes, expires, revoked = row
+    if revoked:
+        log_action("...", "Rejected API token", f"Token {token_id} is revoked", True)
+        return False, "Token revoked"
+    if expires < time.time():
+        return False, "Token expired"
+    if required_scope and required_scope not in scopes.split():
+        log_action("...", "Rejected API token", f"Token {token_id} lacks scope {required_scope}", True)
+        return False, "Insufficient scope"
+
+    return True, token_id
+
+def revoke_api_token(token_id, revoked_by):
+    conn = get_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute('UPDATE ApiTokens SET revoked = 1 WHERE id = ? AND revoked = 0', (token_id,))
+        conn.commit()
+        revoked = cursor.rowcount > 0
+    except Exception as e:
+        print(f"Error revoking API token: {e}")
+        return False
+    finally:
+        close_connection(conn)
+
+    if not revoked:
+        print(f"No active API token found with ID {token_id}")
+        return False
+
+    log_action(revoked_by, f"Revoked API token {token_id}")
+    print(f"API token {token_id} revoked successfully")
+    return True
+
+def purge_expired_api_tokens():
+    conn = get_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute('DELETE FROM ApiTokens WHERE expires < ?', (time.time(),))
+        conn.commit()
+        return cursor.rowcount
+    finally:
+        close_connection(conn)
+
+def list_api_tokens():
+    try:
+        conn = get_connection()
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT id, name, scopes, issued_by, created, expires, revoked
+            FROM ApiTokens
+            ORDER BY created DESC
+        ''')
+        tokens = cursor.fetchall()
+        close_connection(conn)
+
+        if not tokens:
+            print("No API tokens found")
+            return
+
+        now = time.time()
+        print("\n=== API TOKENS ===")
+        print(f"{'ID':<5} {'Name':<20} {'Scopes':<35} {'Issued by':<15} {'Expires':<17} {'Status':<8}")
+        print("-" * 105)
+        for token_id, name, scopes, issued_by, created, expires, revoked in tokens:
+            if revoked:
+                status = "Revoked"
+            elif expires < now:
+                status = "Expired"
+            else:
+                status = "Active"
+            expires_str = datetime.fromtimestamp(expires).strftime('%Y-%m-%d %H:%M')
+            print(f"{token_id:<5} {decrypt_data(name)[:20]:<20} {scopes[:35]:<35} {decrypt_data(issued_by)[:15]:<15} {expires_str:<17} {status:<8}")
+
+    except Exception as e:
+        print(f"Error listing API tokens: {e}")
@@ -1,54 +1,151 @@
 import bcrypt
 import getpass
+import json
+import os
+import secrets
+import time
+from concurrent.futures import ThreadPoolExecutor
 from database import get_connection, close_connection
+from encryption import blind_index
+from rate_limiting import allow_login_attempt, record_login_result
 from system_logging import log_login_attempt, log_action
-from session_management import create_session, terminate_session
+from session_management import create_session, terminate_session, require_role
 
-def hash_password(password):
-    salt = bcrypt.gensalt()
+password_policy_file = 'password_policy.json'
+
+DEFAULT_BCRYPT_ROUNDS = 12
+MIN_BCRYPT_ROUNDS = 10
+MAX_BCRYPT_ROUNDS = 16
+
+dummy_password_hash = None
+password_executor = None
+
+def load_bcrypt_rounds():
+    try:
+        with open(password_policy_file, 'r') as f:
+            rounds = int(json.load(f).get('bcrypt_rounds', DEFAULT_BCRYPT_ROUNDS))
+        return min(max(rounds, MIN_BCRYPT_ROUNDS), MAX_BCRYPT_ROUNDS)
+    except:
+        return DEFAULT_BCRYPT_ROUNDS
+
+def save_bcrypt_rounds(rounds, target_ms):
+    with open(password_policy_file, 'w') as f:
+        json.dump({'bcrypt_rounds': rounds, 'target_ms': target_ms}, f)
+
+bcrypt_rounds = load_bcrypt_rounds()
+
+def hash_password(password, rounds=None):
+    salt = bcrypt.gensalt(rounds or bcrypt_rounds)
     return bcrypt.hashpw(password.encode('utf-8'), salt)
 
 def verify_password(stored_password, provided_password):
+    if isinstance(stored_password, str):
+        stored_password = stored_password.encode('utf-8')
     return bcrypt.checkpw(provided_password.encode('utf-8'), stored_password)
 
+def get_hash_rounds(stored_password):
+    if isinstance(stored_password, bytes):
+        stored_password = stored_password.decode('utf-8')
+    try:
+        return int(stored_password.split('$')[2])
+    except (IndexError, ValueError):
+        return None
+
+def needs_rehash(stored_password):
+    return get_hash_rounds(stored_password) != bcrypt_rounds
+
+def get_password_executor():
+    global password_executor
+    if password_executor is None:
+        password_executor = ThreadPoolExecutor(max_workers=os.cpu_count() or 2, thread_name_prefix="bcrypt")
+    return password_executor
+
+def hash_password_async(password, rounds=None):
+    return get_password_executor().submit(hash_password, password, rounds)
+
+def verify_password_async(stored_password, provided_password):
+    return get_password_executor().submit(verify_password, stored_password, provided_password)
+
+def hash_passwords(passwords, rounds=None):
+    return list(get_password_executor().map(lambda password: hash_password(password, rounds), passwords))
+
+def rehash_user_password(user_id, password, verified_hash):
+    conn = get_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute('UPDATE Users SET password_hash = ? WHERE id = ? AND password_hash = ?',
+                       (hash_password(password), user_id, verified_hash))
+        conn.commit()
+    except Exception as e:
+        print(f"Error upgrading password hash: {e}")
+    finally:
+        close_connection(conn)
+
+def calibrate_bcrypt_rounds(target_ms=250):
+    sample_password = secrets.token_urlsafe(16)
+    chosen_rounds = MIN_BCRYPT_ROUNDS
+    timings = {}
+    
+    for rounds in range(MIN_BCRYPT_ROUNDS, MAX_BCRYPT_ROUNDS + 1):
+        start = time.perf_counter()
+        hash_password(sample_password, rounds)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        timings[rounds] = elapsed_ms
+        if elapsed_ms > target_ms:
+            break
+        chosen_rounds = rounds
+    
+    return chosen_rounds, timings
+
+def apply_bcrypt_rounds(rounds, target_ms):
+    global bcrypt_rounds, dummy_password_hash
+    bcrypt_rounds = rounds
+    dummy_password_hash = None
+    save_bcrypt_rounds(rounds, target_ms)
+
+def get_dummy_password_hash():
+    global dummy_password_hash
+    if dummy_password_hash is None:
+        dummy_password_hash = hash_password(secrets.token_urlsafe(16))
+    return dummy_password_hash
+
 def authenticate_user(username, password):
+    allowed, throttled_count = allow_login_attempt(username)
+    if not allowed:
+        if throttled_count == 1 or throttled_count % 10 == 0:
+            log_action("...", "Login throttled", f"username: {username} exceeded the login attempt budget ({throttled_count} rejected)", True)
+        print("Too many login attempts. Please wait before trying again.")
+        return None, None
+    
     conn = get_connection()
     cursor = conn.cursor()
     
     try:
         from encryption import decrypt_data
         
-        cursor.execute('SELECT username, password_hash, role, temp_password FROM Users')
-        all_users = cursor.fetchall()
-        
-        for db_username, stored_password_hash, role, temp_password in all_users:
-            try:
-                decrypted_username = decrypt_data(db_username)
-                decrypted_role = decrypt_data(role)
-                decrypted_temp_password = decrypt_data(str(temp_password)) if temp_password else "0"
-                
-                if db_username == 'super_admin' or decrypted_username == 'super_admin':
-                    if username == 'super_admin' and password == 'Admin_123?':
-                        log_login_attempt(username, True)
-                        create_session(username, decrypted_role)
-                        return username, decrypted_role, bool(int(decrypted_temp_password) if decrypted_temp_password.isdigit() else temp_password)
-                
-                if decrypted_username.lower() == username.lower():
-                    if verify_password(stored_password_hash, password):
-                        log_login_attempt(username, True)
-                        create_session(username, decrypted_role)
-                        return username, decrypted_role, bool(int(decrypted_temp_password) if decrypted_temp_password.isdigit() else temp_password)
-                    else:
-                        break
-                        
-            except Exception as decrypt_error:
-                if db_username == username and username == 'super_admin' and password == 'Admin_123?':
-                    log_login_attempt(username, True)
-                    create_session(username, role)
-                    return username, role, bool(temp_password)
-        
-        log_login_attempt(username, False)
-        return None, None
+        cursor.execute('SELECT id, password_hash, role, temp_password FROM Users WHERE username_index = ?', (blind_index(username),))
+        user = cursor.fetchone()
+        
+        if not user:
+            verify_password(get_dummy_password_hash(), password)
+            log_login_attempt(username, False, record_login_result(username, False))
+            return None, None
+        
+        user_id, stored_password_hash, role, temp_password = user
+        if not verify_password(stored_password_hash, password):
+            log_login_attempt(username, False, record_login_result(username, False))
+            return None, None
+        
+        if needs_rehash(stored_password_hash):
+            get_password_executor().submit(rehash_user_password, user_id, password, stored_password_hash)
+        
+        decrypted_role = decrypt_data(role)
+        decrypted_temp_password = decrypt_data(str(temp_password)) if temp_password else "0"
+        
+        record_login_result(username, True)
+        log_login_attempt(username, True)
+        create_session(username, decrypted_role, user_id)
+        return username, decrypted_role, bool(int(decrypted_temp_password) if decrypted_temp_password.isdigit() else temp_password)
         
     except Exception as e:
         print(f"Authentication error: {e}")
@@ -140,26 +237,12 @@ def change_password(username):
     cursor = conn.cursor()
     
     try:
-        from encryption import decrypt_data, encrypt_data
-        
-        cursor.execute('SELECT id, username, password_hash FROM Users')
-        all_users = cursor.fetchall()
-        
-        user_id = None
-        stored_password_hash = None
-        
-        for existing_id, existing_username, password_hash in all_users:
-            try:
-                decrypted_username = decrypt_data(existing_username)
-                if decrypted_username.lower() == username.lower():
-                    user_id = existing_id
-                    stored_password_hash = password_hash
-                    break
-            except:
-                if existing_username.lower() == username.lower():
-                    user_id = existing_id
-                    stored_password_hash = password_hash
-                    break
+        from encryption import encrypt_data
+        
+        cursor.execute('SELECT id, password_hash FROM Users WHERE username_index = ?', (blind_index(username),))
+        user = cursor.fetchone()
+        
+        user_id, stored_password_hash = user if user else (None, None)
         
         if not user_id or not stored_password_hash:
             print("User not found.")
@@ -213,3 +296,38 @@ def validate_password(password):
     has_special = any(c in "~!@#$%&_-+=`|\\(){}[]:;'<>,.?/" for c in password)
     
     return has_lower and has_upper and has_digit and has_special
+
+def calibrate_password_hashing_menu(username):
+    if not require_role(username, "Super Admin"):
+        print("ERROR: Operation not permitted.")
+        return
+    
+    print("\n=== CALIBRATE PASSWORD HASHING ===")
+    print(f"Current bcrypt cost: {bcrypt_rounds}")
+    target_input = input("Target hashing time in milliseconds (default 250): ")
+    
+    if not target_input:
+        target_ms = 250
+    elif target_input.isdigit() and 50 <= int(target_input) <= 5000:
+        target_ms = int(target_input)
+    else:
+        print("Target must be a number between 50 and 5000.")
+        return
+    
+    print("Measuring bcrypt on this machine...")
+    rounds, timings = calibrate_bcrypt_rounds(target_ms)
+    
+    print(f"{'Cost':<6} {'Time (ms)':<10}")
+    print("-" * 20)
+    for measured_rounds, elapsed_ms in timings.items():
+        print(f"{measured_rounds:<6} {elapsed_ms:<10.1f}")
+    print(f"\nRecommended cost for {target_ms} ms: {rounds}")
+    
+    confirm = input("Apply this cost to new password hashes? (y/n): ")
+    if confirm.lower() != 'y':
+        print("Calibration not applied.")
+        return
+    
+    apply_bcrypt_rounds(rounds, target_ms)
+    log_action(username, "Updated bcrypt cost", f"Cost: {rounds}, Target: {target_ms} ms")
+    print(f"Bcrypt cost set to {rounds}. Existing passwords are upgraded on next login.")
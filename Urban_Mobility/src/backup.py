@@ -1,53 +1,633 @@
 import zipfile
+import contextlib
+import hashlib
+import io
+import json
 import os
+import shutil
+import sqlite3
+import tempfile
+import time
 from datetime import datetime
 import uuid
-from database import get_connection, close_connection
-from encryption import decrypt_data
+from database import RESTORE_CODE_TTL, get_connection, close_connection, upgrade_database
+from backup_encryption import ARCHIVE_CHUNK_SIZE, EncryptedArchiveReader, EncryptedArchiveWriter
+from encryption import blind_index, decrypt_data, reload_key
+from session_management import lookup_user, notify_account_changed, republish_sessions
+from system_logging import encrypted_log_file, log_file_lock, reset_log_index, rebuild_log_stats
+from wal_archive import archive_lock, archive_wal, get_wal_generation, reset_wal_archive
 
-def create_backup():
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+BACKUP_PAGES_PER_STEP = 256
+BACKUP_STEP_SLEEP = 0.005
+BACKUP_MAX_ATTEMPTS = 5
+BACKUP_BLOCK_SIZE = 1024 * 1024
+BACKUP_MANIFEST = 'manifest.json'
+BACKUP_PAGE_HASHES = 'pages.sha'
+BACKUP_PAGES = 'pages.bin'
+BACKUP_LOG_TAIL = 'encrypted_logs.tail'
+PAGE_HASH_SIZE = 16
+MAX_BACKUP_CHAIN_LENGTH = 24
+ENCRYPTED_ARCHIVE_SUFFIX = '.zip.enc'
+RESTORE_LOCK_FILE = 'restore.lock'
+RESTORE_CODE_ATTEMPTS = 5
+RESTORED_FILES = ('urban_mobility.db', 'encrypted_logs.txt', 'encryption.key')
+BACKUP_CODECS = {'zlib': zipfile.ZIP_DEFLATED, 'bz2': zipfile.ZIP_BZIP2, 'lzma': zipfile.ZIP_LZMA}
+BACKUP_CODEC_LEVELS = {'zlib': (0, 9), 'bz2': (1, 9)}
+DEFAULT_BACKUP_POLICY = {'vacuum_snapshot': False, 'codec': 'zlib', 'level': 6}
+
+backup_policy_file = 'backup_policy.json'
+
+class BackupRestarted(Exception):
+    pass
+
+def normalize_backup_policy(policy):
+    policy = dict(DEFAULT_BACKUP_POLICY, **policy)
+    if policy['codec'] not in BACKUP_CODECS:
+        policy['codec'] = DEFAULT_BACKUP_POLICY['codec']
+    if policy['codec'] in BACKUP_CODEC_LEVELS:
+        low, high = BACKUP_CODEC_LEVELS[policy['codec']]
+        policy['level'] = min(max(int(policy['level'] if policy['level'] is not None else DEFAULT_BACKUP_POLICY['level']), low), high)
+    else:
+        policy['level'] = None
+    return policy
+
+def load_backup_policy():
+    try:
+        with open(backup_policy_file, 'r') as f:
+            return normalize_backup_policy(json.load(f))
+    except:
+        return dict(DEFAULT_BACKUP_POLICY)
+
+def describe_codec(codec, level):
+    return codec if level is None else f"{codec} level {level}"
+
+def save_backup_policy(policy):
+    with open(backup_policy_file, 'w') as f:
+        json.dump(policy, f, indent=2)
+
+def vacuum_database(database_path, snapshot_path):
+    source = sqlite3.connect(database_path, timeout=30.0)
     try:
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        backup_filename = f"backup_{timestamp}.zip"
+        source.execute('PRAGMA synchronous=OFF')
+        source.execute('VACUUM INTO ?', (snapshot_path,))
+    finally:
+        close_connection(source)
+
+def begin_snapshot_transaction(source, database_path):
+    # Hold the write lock archive_wal takes while the read transaction starts, so the
+    # snapshot time separates WAL segments already in the snapshot from later ones
+    writer_lock = sqlite3.connect(database_path, timeout=30.0)
+    try:
+        writer_lock.execute('BEGIN IMMEDIATE')
+        try:
+            source.execute('BEGIN')
+            source.execute('SELECT COUNT(*) FROM sqlite_master').fetchone()
+            return time.time()
+        finally:
+            writer_lock.rollback()
+    finally:
+        close_connection(writer_lock)
+
+def snapshot_database(database_path, snapshot_path, pages=BACKUP_PAGES_PER_STEP, step_sleep=BACKUP_STEP_SLEEP, vacuum=False):
+    if vacuum:
+        snapshot_time = time.time()
+        vacuum_database(database_path, snapshot_path)
+        return snapshot_time
+    
+    source = sqlite3.connect(database_path, timeout=30.0)
+    try:
+        snapshot_time = begin_snapshot_transaction(source, database_path)
         
-        with zipfile.ZipFile(backup_filename, 'w', zipfile.ZIP_DEFLATED) as backup_zip:
+        for attempt in range(1, BACKUP_MAX_ATTEMPTS + 1):
+            copied = {'remaining': None}
+            
+            def progress(status, remaining, total):
+                if copied['remaining'] is not None and remaining > copied['remaining']:
+                    raise BackupRestarted()
+                copied['remaining'] = remaining
+                time.sleep(step_sleep)
+            
+            target = sqlite3.connect(snapshot_path)
+            target.execute('PRAGMA synchronous=OFF')
+            try:
+                if attempt == BACKUP_MAX_ATTEMPTS:
+                    source.backup(target)
+                else:
+                    source.backup(target, pages=pages, progress=progress)
+                return snapshot_time
+            except BackupRestarted:
+                continue
+            finally:
+                target.close()
+    finally:
+        source.rollback()
+        close_connection(source)
+
+def checkpoint_database(conn):
+    conn.execute('PRAGMA wal_checkpoint(TRUNCATE)').fetchone()
+
+def snapshot_log(snapshot_path):
+    if not os.path.exists(encrypted_log_file):
+        return False
+    with log_file_lock():
+        shutil.copyfile(encrypted_log_file, snapshot_path)
+    return True
+
+def hash_file(path, length=None):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        remaining = os.path.getsize(path) if length is None else length
+        while remaining > 0:
+            block = f.read(min(BACKUP_BLOCK_SIZE, remaining))
+            if not block:
+                break
+            digest.update(block)
+            remaining -= len(block)
+    return digest.hexdigest()
+
+def get_page_size(database_path):
+    with open(database_path, 'rb') as f:
+        header = f.read(100)
+    page_size = int.from_bytes(header[16:18], 'big')
+    return 65536 if page_size == 1 else page_size
+
+def hash_pages(database_path, page_size):
+    page_hashes = bytearray()
+    with open(database_path, 'rb') as f:
+        for page in iter(lambda: f.read(page_size), b''):
+            page_hashes += hashlib.blake2b(page, digest_size=PAGE_HASH_SIZE).digest()
+    return bytes(page_hashes)
+
+def new_backup_filename():
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    backup_filename = f"backup_{timestamp}{ENCRYPTED_ARCHIVE_SUFFIX}"
+    suffix = 1
+    while os.path.exists(backup_filename):
+        backup_filename = f"backup_{timestamp}_{suffix:03d}{ENCRYPTED_ARCHIVE_SUFFIX}"
+        suffix += 1
+    return backup_filename
+
+def is_archive_backup(backup_filename):
+    return backup_filename.endswith(('.zip', ENCRYPTED_ARCHIVE_SUFFIX))
+
+@contextlib.contextmanager
+def open_backup_archive(backup_filename):
+    if not backup_filename.endswith(ENCRYPTED_ARCHIVE_SUFFIX):
+        with zipfile.ZipFile(backup_filename, 'r') as backup_zip:
+            yield backup_zip
+        return
+    
+    with io.BufferedReader(EncryptedArchiveReader(backup_filename), ARCHIVE_CHUNK_SIZE) as stream, zipfile.ZipFile(stream, 'r') as backup_zip:
+        yield backup_zip
+
+def read_backup_manifest(backup_filename):
+    with open_backup_archive(backup_filename) as backup_zip:
+        if BACKUP_MANIFEST not in backup_zip.namelist():
+            return None
+        return json.loads(backup_zip.read(BACKUP_MANIFEST))
+
+def read_page_hashes(backup_filename):
+    with open_backup_archive(backup_filename) as backup_zip:
+        if BACKUP_PAGE_HASHES not in backup_zip.namelist():
+            return None
+        return backup_zip.read(BACKUP_PAGE_HASHES)
+
+def find_backup_parent():
+    for backup_filename in list_backups():
+        if not is_archive_backup(backup_filename) or not os.path.exists(backup_filename):
+            continue
+        manifest = read_backup_manifest(backup_filename)
+        if manifest is None:
+            continue
+        if manifest['chain_length'] + 1 > MAX_BACKUP_CHAIN_LENGTH or manifest.get('vacuumed'):
+            return None
+        return backup_filename, manifest
+    return None
+
+def resolve_backup_chain(backup_filename):
+    chain = []
+    while backup_filename:
+        if not os.path.exists(backup_filename):
+            raise ValueError(f"Backup chain is broken: {backup_filename} is missing")
+        manifest = read_backup_manifest(backup_filename)
+        if manifest is None:
+            raise ValueError(f"{backup_filename} has no manifest")
+        chain.append((backup_filename, manifest))
+        backup_filename = manifest['parent']
+    chain.reverse()
+    return chain
+
+def collect_backup_files(snapshot_dir, vacuum=False):
+    files = {}
+    snapshot_time = None
+    
+    if os.path.exists('urban_mobility.db'):
+        files['urban_mobility.db'] = os.path.join(snapshot_dir, 'urban_mobility.db')
+        snapshot_time = snapshot_database('urban_mobility.db', files['urban_mobility.db'], vacuum=vacuum)
+    
+    if snapshot_log(os.path.join(snapshot_dir, 'encrypted_logs.txt')):
+        files['encrypted_logs.txt'] = os.path.join(snapshot_dir, 'encrypted_logs.txt')
+    
+    if os.path.exists('encryption.key'):
+        files['encryption.key'] = os.path.join(snapshot_dir, 'encryption.key')
+        shutil.copyfile('encryption.key', files['encryption.key'])
+    
+    return files, snapshot_time
+
+def write_page_diff(backup_zip, database_path, page_size, page_hashes, parent_hashes):
+    changed_pages = 0
+    with open(database_path, 'rb') as source, backup_zip.open(BACKUP_PAGES, 'w') as pages:
+        for page_number in range(len(page_hashes) // PAGE_HASH_SIZE):
+            offset = page_number * PAGE_HASH_SIZE
+            if page_hashes[offset:offset + PAGE_HASH_SIZE] == parent_hashes[offset:offset + PAGE_HASH_SIZE]:
+                continue
+            source.seek(page_number * page_size)
+            pages.write(page_number.to_bytes(4, 'big'))
+            pages.write(source.read(page_size))
+            changed_pages += 1
+    return changed_pages
+
+def write_log_tail(backup_zip, log_path, parent_log):
+    log_size = os.path.getsize(log_path)
+    if log_size < parent_log['size'] or hash_file(log_path, parent_log['size']) != parent_log['sha256']:
+        return None
+    
+    with open(log_path, 'rb') as source, backup_zip.open(BACKUP_LOG_TAIL, 'w') as tail:
+        source.seek(parent_log['size'])
+        shutil.copyfileobj(source, tail, BACKUP_BLOCK_SIZE)
+    return parent_log['size']
+
+def write_backup_archive(backup_filename, files, parent=None, policy=None, vacuumed=False, snapshot=None):
+    policy = normalize_backup_policy(policy or load_backup_policy())
+    manifest = {
+        'type': 'incremental' if parent else 'full',
+        'parent': parent[0] if parent else None,
+        'chain_length': parent[1]['chain_length'] + 1 if parent else 0,
+        'created': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        'files': {name: {'size': os.path.getsize(path), 'sha256': hash_file(path)} for name, path in files.items()},
+        'codec': policy['codec'],
+        'vacuumed': vacuumed
+    }
+    if policy['level'] is not None:
+        manifest['level'] = policy['level']
+    manifest.update(snapshot or {})
+    parent_files = parent[1]['files'] if parent else {}
+    
+    temp_filename = backup_filename + '.tmp'
+    with EncryptedArchiveWriter(temp_filename) as stream, zipfile.ZipFile(stream, 'w', BACKUP_CODECS[policy['codec']], compresslevel=policy['level']) as backup_zip:
+        for name, path in files.items():
+            if name == 'urban_mobility.db':
+                page_size = get_page_size(path)
+                page_hashes = hash_pages(path, page_size)
+                backup_zip.writestr(BACKUP_PAGE_HASHES, page_hashes)
+                manifest['page_size'] = page_size
+            
+            if parent and parent_files.get(name) == manifest['files'][name]:
+                continue
             
-            if os.path.exists('urban_mobility.db'):
-                backup_zip.write('urban_mobility.db')
-           
-            if os.path.exists('encrypted_logs.txt'):
-                backup_zip.write('encrypted_logs.txt')
-  
-            if os.path.exists('encryption.key'):
-                backup_zip.write('encryption.key')
-        
-        print(f"Backup created successfully: {backup_filename}")
+            if name == 'urban_mobility.db':
+                parent_hashes = read_page_hashes(parent[0]) if parent and parent[1].get('page_size') == page_size else None
+                if parent_hashes is not None:
+                    manifest['changed_pages'] = write_page_diff(backup_zip, path, page_size, page_hashes, parent_hashes)
+                    continue
+            
+            elif name == 'encrypted_logs.txt' and name in parent_files:
+                log_base = write_log_tail(backup_zip, path, parent_files[name])
+                if log_base is not None:
+                    manifest['log_base'] = log_base
+                    continue
+            
+            backup_zip.write(path, name)
+        
+        backup_zip.writestr(BACKUP_MANIFEST, json.dumps(manifest, indent=2))
+        uncompressed_size = sum(info.file_size for info in backup_zip.infolist())
+    os.replace(temp_filename, backup_filename)
+    manifest['uncompressed_size'] = uncompressed_size
+    return manifest
+
+def report_backup_compression(backup_filename, manifest, started):
+    size = os.path.getsize(backup_filename)
+    elapsed = max(time.time() - started, 1e-6)
+    ratio = manifest['uncompressed_size'] / size if size else 0
+    throughput = manifest['uncompressed_size'] / elapsed / (1024 * 1024)
+    print(f"Compression: {describe_codec(manifest['codec'], manifest.get('level'))}, "
+          f"{manifest['uncompressed_size']} -> {size} bytes ({ratio:.2f}x), {throughput:.1f} MB/s")
+
+def record_backup(backup_filename, manifest, started, origin, size=None):
+    conn = get_connection()
+    try:
+        conn.execute('''
+            INSERT OR REPLACE INTO Backups (filename, created, size, duration, type, origin, sha256, parent, contents)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (
+            backup_filename,
+            started,
+            os.path.getsize(backup_filename) if size is None else size,
+            time.time() - started,
+            manifest['type'],
+            origin,
+            hash_file(backup_filename),
+            manifest.get('parent'),
+            json.dumps(sorted(manifest['files']))
+        ))
+        conn.commit()
+    except sqlite3.Error as e:
+        print(f"Error recording backup in catalog: {e}")
+    finally:
+        close_connection(conn)
+
+def read_backup_catalog():
+    conn = get_connection()
+    try:
+        return conn.execute('''
+            SELECT filename, created, size, duration, type, origin, sha256, parent, contents FROM Backups
+        ''').fetchall()
+    except sqlite3.Error as e:
+        print(f"Error reading backup catalog: {e}")
+        return []
+    finally:
+        close_connection(conn)
+
+def reapply_backup_catalog(rows):
+    conn = get_connection()
+    try:
+        conn.executemany('''
+            INSERT INTO Backups (filename, created, size, duration, type, origin, sha256, parent, contents)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(filename) DO UPDATE SET created = excluded.created, size = excluded.size,
+                duration = excluded.duration, type = excluded.type, origin = excluded.origin,
+                sha256 = excluded.sha256, parent = excluded.parent, contents = excluded.contents
+        ''', [row for row in rows if os.path.exists(row[0])])
+        conn.commit()
+    except sqlite3.Error as e:
+        print(f"Error restoring backup catalog: {e}")
+    finally:
+        close_connection(conn)
+
+def describe_backup(backup_filename):
+    from backup_store import is_store_backup, read_store_manifest
+    if is_store_backup(backup_filename):
+        return read_store_manifest(backup_filename)
+    
+    manifest = read_backup_manifest(backup_filename)
+    if manifest is None:
+        with open_backup_archive(backup_filename) as backup_zip:
+            manifest = {'type': 'legacy', 'parent': None, 'files': {name: {} for name in backup_zip.namelist()}}
+    return manifest
+
+def find_backup_files():
+    from backup_store import list_store_backups
+    
+    backup_files = list_store_backups()
+    for file in os.listdir('.'):
+        if file.startswith('backup_') and is_archive_backup(file):
+            backup_files.append(file)
+    return backup_files
+
+def reconcile_backup_catalog(verify=True):
+    on_disk = set(find_backup_files())
+    
+    conn = get_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute('SELECT id, filename, size, sha256 FROM Backups')
+        catalog = {filename: (backup_id, size, sha256) for backup_id, filename, size, sha256 in cursor.fetchall()}
+        
+        missing = [filename for filename in catalog if filename not in on_disk]
+        for filename in missing:
+            cursor.execute('DELETE FROM Backups WHERE id = ?', (catalog[filename][0],))
+        
+        added = 0
+        for filename in sorted(on_disk - set(catalog)):
+            try:
+                manifest = describe_backup(filename)
+            except Exception as e:
+                print(f"Skipping unreadable backup {filename}: {e}")
+                continue
+            cursor.execute('''
+                INSERT INTO Backups (filename, created, size, duration, type, origin, sha256, parent, contents)
+                VALUES (?, ?, ?, 0, ?, 'reconciled', ?, ?, ?)
+            ''', (filename, os.path.getmtime(filename), os.path.getsize(filename), manifest['type'],
+                  hash_file(filename), manifest.get('parent'), json.dumps(sorted(manifest['files']))))
+            added += 1
+        
+        changed = []
+        for filename in on_disk & set(catalog):
+            backup_id, size, sha256 = catalog[filename]
+            if size is not None and os.path.getsize(filename) != size and not filename.endswith('.json'):
+                changed.append(filename)
+            elif verify and sha256 and hash_file(filename) != sha256:
+                changed.append(filename)
+        
+        conn.commit()
+    finally:
+        close_connection(conn)
+    
+    if added or missing or changed:
+        print(f"Backup catalog reconciled: {added} added, {len(missing)} missing removed, {len(changed)} changed on disk")
+    for filename in changed:
+        print(f"  WARNING: {filename} no longer matches its catalog checksum")
+    return added, missing, changed
+
+def delete_backup(backup_filename):
+    if os.path.exists(backup_filename):
+        os.remove(backup_filename)
+    
+    conn = get_connection()
+    try:
+        conn.execute('DELETE FROM Backups WHERE filename = ?', (backup_filename,))
+        conn.commit()
+    finally:
+        close_connection(conn)
+
+def create_backup(incremental=False, origin='manual', policy=None):
+    try:
+        started = time.time()
+        policy = policy or load_backup_policy()
+        backup_filename = new_backup_filename()
+        parent = find_backup_parent() if incremental else None
+        vacuum = policy['vacuum_snapshot'] and not incremental
+        wal_generation = get_wal_generation()
+        
+        with tempfile.TemporaryDirectory(prefix='.snapshot_', dir='.') as snapshot_dir:
+            files, snapshot_time = collect_backup_files(snapshot_dir, vacuum)
+            snapshot = {'wal_generation': wal_generation, 'snapshot_time': snapshot_time} if wal_generation and snapshot_time else None
+            manifest = write_backup_archive(backup_filename, files, parent, policy, vacuum, snapshot)
+        record_backup(backup_filename, manifest, started, origin)
+        
+        if parent:
+            print(f"Incremental backup created successfully: {backup_filename}")
+            print(f"Parent: {parent[0]}, changed pages: {manifest.get('changed_pages', 'all')}")
+        else:
+            print(f"Backup created successfully: {backup_filename}")
+        if vacuum:
+            print("Database snapshot was compacted with VACUUM INTO")
+        report_backup_compression(backup_filename, manifest, started)
         return backup_filename
     except Exception as e:
         print(f"Error creating backup: {e}")
         return None
 
+def apply_page_diff(backup_zip, database_path, page_size, page_count):
+    with open(database_path, 'r+b') as target, backup_zip.open(BACKUP_PAGES, 'r') as pages:
+        while True:
+            page_number = pages.read(4)
+            if not page_number:
+                break
+            target.seek(int.from_bytes(page_number, 'big') * page_size)
+            target.write(pages.read(page_size))
+        target.truncate(page_count * page_size)
+
+def apply_log_tail(backup_zip, log_path, log_base):
+    with open(log_path, 'r+b') as target, backup_zip.open(BACKUP_LOG_TAIL, 'r') as tail:
+        target.truncate(log_base)
+        target.seek(log_base)
+        shutil.copyfileobj(tail, target, BACKUP_BLOCK_SIZE)
+
+def extract_backup(backup_filename, target_dir):
+    from backup_store import is_store_backup, extract_store_backup
+    if is_store_backup(backup_filename):
+        extract_store_backup(backup_filename, target_dir)
+        return
+    
+    manifest = read_backup_manifest(backup_filename)
+    if manifest is None:
+        with open_backup_archive(backup_filename) as backup_zip:
+            backup_zip.extractall(target_dir)
+        return
+    
+    for chain_filename, chain_manifest in resolve_backup_chain(backup_filename):
+        with open_backup_archive(chain_filename) as backup_zip:
+            names = backup_zip.namelist()
+            for name, info in chain_manifest['files'].items():
+                path = os.path.join(target_dir, name)
+                if name in names:
+                    backup_zip.extract(name, target_dir)
+                elif name == 'urban_mobility.db' and BACKUP_PAGES in names:
+                    apply_page_diff(backup_zip, path, chain_manifest['page_size'], info['size'] // chain_manifest['page_size'])
+                elif name == 'encrypted_logs.txt' and BACKUP_LOG_TAIL in names:
+                    apply_log_tail(backup_zip, path, chain_manifest['log_base'])
+    
+    for name, info in manifest['files'].items():
+        if hash_file(os.path.join(target_dir, name)) != info['sha256']:
+            raise ValueError(f"Checksum mismatch for {name} after restoring {backup_filename}")
+
+def compact_backup_chain(backup_filename):
+    try:
+        started = time.time()
+        compacted_filename = new_backup_filename()
+        with tempfile.TemporaryDirectory(prefix='.compact_', dir='.') as compact_dir:
+            extract_backup(backup_filename, compact_dir)
+            files = {name: os.path.join(compact_dir, name) for name in os.listdir(compact_dir)}
+            head_manifest = read_backup_manifest(backup_filename)
+            snapshot = {key: head_manifest[key] for key in ('wal_generation', 'snapshot_time') if key in head_manifest}
+            manifest = write_backup_archive(compacted_filename, files, snapshot=snapshot)
+        record_backup(compacted_filename, manifest, started, 'compaction')
+        
+        print(f"Backup chain of {backup_filename} compacted into {compacted_filename}")
+        report_backup_compression(compacted_filename, manifest, started)
+        return compacted_filename
+    except Exception as e:
+        print(f"Error compacting backup chain: {e}")
+        return None
+
+@contextlib.contextmanager
+def restore_lock():
+    if fcntl is None:
+        yield
+        return
+    
+    with open(RESTORE_LOCK_FILE, 'a') as lock_handle:
+        fcntl.flock(lock_handle.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_handle.fileno(), fcntl.LOCK_UN)
+
+def verify_staged_files(staging_dir):
+    database_path = os.path.join(staging_dir, 'urban_mobility.db')
+    if not os.path.exists(database_path):
+        raise ValueError("Backup does not contain a database")
+    
+    conn = sqlite3.connect(database_path)
+    try:
+        result = conn.execute('PRAGMA quick_check').fetchone()[0]
+    finally:
+        conn.close()
+    if result != 'ok':
+        raise ValueError(f"Restored database failed quick_check: {result}")
+
+def lock_database_for_swap(database_path):
+    conn = sqlite3.connect(database_path, timeout=30.0)
+    for attempt in range(BACKUP_MAX_ATTEMPTS):
+        checkpoint_database(conn)
+        conn.execute('BEGIN IMMEDIATE')
+        wal_path = database_path + '-wal'
+        if not os.path.exists(wal_path) or os.path.getsize(wal_path) == 0:
+            return conn
+        conn.rollback()
+        time.sleep(0.1 * (attempt + 1))
+    conn.close()
+    raise RuntimeError("Could not drain the write-ahead log before restoring")
+
+def install_staged_files(staging_dir):
+    with archive_lock, restore_lock(), log_file_lock():
+        archive_wal()
+        catalog = read_backup_catalog()
+        conn = lock_database_for_swap('urban_mobility.db') if os.path.exists('urban_mobility.db') else None
+        try:
+            for name in RESTORED_FILES:
+                staged_path = os.path.join(staging_dir, name)
+                if os.path.exists(staged_path):
+                    os.replace(staged_path, name)
+            reset_log_index()
+            reset_wal_archive()
+        finally:
+            if conn:
+                conn.rollback()
+                conn.close()
+    
+    reload_key()
+    upgrade_database()
+    reapply_backup_catalog(catalog)
+    reconcile_backup_catalog(verify=False)
+    notify_account_changed()
+    republish_sessions()
+    rebuild_log_stats()
+
+def restore_files(backup_filename):
+    with tempfile.TemporaryDirectory(prefix='.restore_', dir='.') as staging_dir:
+        extract_backup(backup_filename, staging_dir)
+        verify_staged_files(staging_dir)
+        install_staged_files(staging_dir)
+
+def hash_restore_code(restore_code):
+    return blind_index(restore_code, "restore_code")
+
+def purge_expired_restore_codes():
+    conn = get_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute('DELETE FROM RestoreCodes WHERE expires < ?', (time.time(),))
+        conn.commit()
+        return cursor.rowcount
+    finally:
+        close_connection(conn)
+
 def generate_restore_code(system_admin_username, backup_filename):
     try:
-        restore_code = str(uuid.uuid4())[:8].upper()
+        purge_expired_restore_codes()
         
         conn = get_connection()
         cursor = conn.cursor()
         
-        cursor.execute('SELECT id, username, role FROM Users')
-        all_users = cursor.fetchall()
-        
-        user_found = None
-        for user_id, encrypted_username, role in all_users:
-            try:
-                decrypted_username = decrypt_data(encrypted_username)
-                if decrypted_username == system_admin_username:
-                    user_found = (user_id, encrypted_username, role)
-                    break
-            except:
-                if encrypted_username == system_admin_username:
-                    user_found = (user_id, encrypted_username, role)
-                    break
+        cursor.execute('SELECT id, username, role FROM Users WHERE username_index = ?', (blind_index(system_admin_username),))
+        user_found = cursor.fetchone()
         
         if not user_found:
             print(f"User {system_admin_username} not found")
@@ -56,33 +636,44 @@ def generate_restore_code(system_admin_username, backup_filename):
         
         user_id, encrypted_username, role = user_found
         
-        try:
-            decrypted_role = decrypt_data(role)
-        except:
-            decrypted_role = role
-        
-        if decrypted_role != 'System Admin':
+        if (decrypt_data(role) or role) != 'System Admin':
             print(f"User {system_admin_username} is not a System Admin")
             close_connection(conn)
             return None
         
+        cursor.execute('SELECT id FROM Backups WHERE filename = ?', (backup_filename,))
+        backup_row = cursor.fetchone()
+        if not backup_row:
+            print(f"Backup {backup_filename} is not in the backup catalog")
+            close_connection(conn)
+            return None
+        
         from encryption import encrypt_data
-        encrypted_code = encrypt_data(restore_code)
         encrypted_backup_filename = encrypt_data(backup_filename)
         encrypted_created_date = encrypt_data(datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
-        encrypted_used = encrypt_data("0")
+        expires = time.time() + RESTORE_CODE_TTL
         
-        cursor.execute('''
-        INSERT INTO RestoreCodes (code, system_admin_username, backup_filename, created_date, used)
-        VALUES (?, ?, ?, ?, ?)
-        ''', (encrypted_code, encrypted_username, encrypted_backup_filename, encrypted_created_date, encrypted_used))
+        for _ in range(RESTORE_CODE_ATTEMPTS):
+            restore_code = str(uuid.uuid4())[:8].upper()
+            try:
+                cursor.execute('''
+                INSERT INTO RestoreCodes (code, system_admin_username, backup_filename, created_date, used, backup_id, admin_id, expires)
+                VALUES (?, ?, ?, ?, 0, ?, ?, ?)
+                ''', (hash_restore_code(restore_code), encrypted_username, encrypted_backup_filename, encrypted_created_date, backup_row[0], user_id, expires))
+                break
+            except sqlite3.IntegrityError:
+                continue
+        else:
+            print("Could not generate a unique restore code")
+            close_connection(conn)
+            return None
         
         conn.commit()
         close_connection(conn)
         
         print(f"Restore code generated: {restore_code}")
         print(f"This code is valid for backup: {backup_filename}")
-        print("This code can only be used once!")
+        print(f"This code can only be used once and expires at {datetime.fromtimestamp(expires).strftime('%Y-%m-%d %H:%M')}!")
         
         return restore_code
     except Exception as e:
@@ -93,123 +684,51 @@ def restore_backup(restore_code, username):
     try:
         conn = get_connection()
         cursor = conn.cursor()
-        
-        cursor.execute('SELECT id, username, role FROM Users')
-        all_users = cursor.fetchall()
-        
-        encrypted_username = None
-        for user_id, encrypted_user, role in all_users:
-            try:
-                decrypted_user = decrypt_data(encrypted_user)
-                if decrypted_user.lower() == username.lower():
-                    encrypted_username = encrypted_user
-                    break
-            except:
-                if encrypted_user.lower() == username.lower():
-                    encrypted_username = encrypted_user
-                    break
-        
-        if not encrypted_username:
-            print("User not found")
-            close_connection(conn)
-            return False
+        code_hash = hash_restore_code(restore_code)
         
         cursor.execute('''
-        SELECT code, backup_filename, system_admin_username, used 
-        FROM RestoreCodes 
-        WHERE system_admin_username = ?
-        ''', (encrypted_username,))
-        
-        all_codes = cursor.fetchall()
-        result = None
-        
-        for code, backup_filename, admin_username, used in all_codes:
-            try:
-                decrypted_code = decrypt_data(code)
-                if decrypted_code == restore_code:
-                    result = (backup_filename, admin_username, used)
-                    break
-            except:
-                if code == restore_code:
-                    result = (backup_filename, admin_username, used)
-                    break
+        SELECT RestoreCodes.used, RestoreCodes.expires, RestoreCodes.backup_filename, Backups.filename
+        FROM RestoreCodes
+        JOIN Users ON Users.id = RestoreCodes.admin_id
+        LEFT JOIN Backups ON Backups.id = RestoreCodes.backup_id
+        WHERE RestoreCodes.code = ? AND Users.username_index = ?
+        ''', (code_hash, blind_index(username)))
+        result = cursor.fetchone()
+        close_connection(conn)
         
         if not result:
             print("Invalid restore code or unauthorized user")
             return False
         
-        backup_filename, admin_username, used = result
+        used, expires, backup_filename, catalog_filename = result
         
-        try:
-            decrypted_used = decrypt_data(str(used))
-            is_used = decrypted_used == "1" or decrypted_used == "True" or used == 1
-        except:
-            is_used = used == 1 or used == "1"
-        
-        if is_used:
+        if used:
             print("Restore code has already been used")
             return False
         
-        try:
-            decrypted_backup_filename = decrypt_data(backup_filename)
-        except:
-            decrypted_backup_filename = backup_filename
-        
-        if not os.path.exists(decrypted_backup_filename):
-            print(f"Backup file not found: {decrypted_backup_filename}")
+        if expires < time.time():
+            print("Restore code has expired")
             return False
         
-        current_user_exists = False
+        backup_filename = catalog_filename or decrypt_data(backup_filename)
         
-        with zipfile.ZipFile(decrypted_backup_filename, 'r') as backup_zip:
-            backup_zip.extractall('.')
+        if not os.path.exists(backup_filename):
+            print(f"Backup file not found: {backup_filename}")
+            return False
         
-        close_connection(conn)  
+        restore_files(backup_filename)
         conn = get_connection()  
         cursor = conn.cursor()
         
-        cursor.execute('SELECT username, role FROM Users')
-        restored_users = cursor.fetchall()
+        cursor.execute('SELECT 1 FROM Users WHERE username_index = ?', (blind_index(username),))
+        current_user_exists = cursor.fetchone() is not None
         
-        for encrypted_user, role in restored_users:
-            try:
-                decrypted_user = decrypt_data(encrypted_user)
-                if decrypted_user.lower() == username.lower():
-                    current_user_exists = True
-                    break
-            except:
-                if encrypted_user.lower() == username.lower():
-                    current_user_exists = True
-                    break
-        
-        from encryption import encrypt_data
-        encrypted_used = encrypt_data("1")
-        
-        cursor.execute('SELECT code FROM RestoreCodes WHERE system_admin_username = ?', (encrypted_username,))
-        all_codes = cursor.fetchall()
-        matching_code = None
-        for (code,) in all_codes:
-            try:
-                decrypted_code = decrypt_data(code)
-                if decrypted_code == restore_code:
-                    matching_code = code
-                    break
-            except:
-                if code == restore_code:
-                    matching_code = code
-                    break
-        
-        if matching_code:
-            cursor.execute('''
-            UPDATE RestoreCodes 
-            SET used = ? 
-            WHERE code = ?
-            ''', (encrypted_used, matching_code))
+        cursor.execute('UPDATE RestoreCodes SET used = 1 WHERE code = ?', (code_hash,))
         
         conn.commit()
         close_connection(conn)
         
-        print(f"Database restored successfully from {decrypted_backup_filename}")
+        print(f"Database restored successfully from {backup_filename}")
         
         return {
             'success': True,
@@ -231,42 +750,23 @@ def restore_backup_direct(backup_filename, username):
             print(f"Backup file not found: {backup_filename}")
             return {'success': False, 'error': f'Backup file not found: {backup_filename}'}
         
-        current_user_exists = False
-        
-        # Close current connection before extracting backup
-        conn = get_connection()
-        close_connection(conn)
-        
-        # Extract backup
-        with zipfile.ZipFile(backup_filename, 'r') as backup_zip:
-            backup_zip.extractall('.')
-        
-        # Reconnect after restore
-        conn = get_connection()
-        cursor = conn.cursor()
+        # Stage, verify and swap in the backup files
+        restore_files(backup_filename)
         
         # Check if the current user (super_admin) exists in restored database
-        cursor.execute('SELECT username, role FROM Users')
-        restored_users = cursor.fetchall()
-        
-        for encrypted_user, role in restored_users:
-            try:
-                decrypted_user = decrypt_data(encrypted_user)
-                if decrypted_user.lower() == username.lower():
-                    current_user_exists = True
-                    break
-            except:
-                if encrypted_user.lower() == username.lower():
-                    current_user_exists = True
-                    break
+        conn = get_connection()
+        try:
+            cursor = conn.cursor()
+            cursor.execute('SELECT 1 FROM Users WHERE username_index = ?', (blind_index(username),))
+            current_user_exists = cursor.fetchone() is not None
+        finally:
+            close_connection(conn)
         
         # Log the action if user exists in restored database
         if current_user_exists:
             from system_logging import log_action
             log_action(username, f"Restored backup directly (without code): {backup_filename}")
         
-        close_connection(conn)
-        
         print(f"Database restored successfully from {backup_filename}")
         
         return {
@@ -280,42 +780,28 @@ def restore_backup_direct(backup_filename, username):
         return {'success': False, 'error': str(e)}
 
 def list_backups():
-    backup_files = []
-    for file in os.listdir('.'):
-        if file.startswith('backup_') and file.endswith('.zip'):
-            backup_files.append(file)
-    
-    return sorted(backup_files, reverse=True) 
+    conn = get_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute('SELECT filename FROM Backups ORDER BY created DESC, id DESC')
+        return [filename for (filename,) in cursor.fetchall()]
+    finally:
+        close_connection(conn)
 
 def revoke_restore_code(restore_code):
     try:
         conn = get_connection()
         cursor = conn.cursor()
         
-        cursor.execute('SELECT code FROM RestoreCodes')
-        all_codes = cursor.fetchall()
+        cursor.execute('DELETE FROM RestoreCodes WHERE code = ?', (hash_restore_code(restore_code),))
+        revoked = cursor.rowcount > 0
+        conn.commit()
+        close_connection(conn)
         
-        matching_code = None
-        for (code,) in all_codes:
-            try:
-                decrypted_code = decrypt_data(code)
-                if decrypted_code == restore_code:
-                    matching_code = code
-                    break
-            except:
-                if code == restore_code:
-                    matching_code = code
-                    break
-        
-        if not matching_code:
+        if not revoked:
             print(f"Restore code {restore_code} does not exist")
-            close_connection(conn)
             return False
         
-        cursor.execute('DELETE FROM RestoreCodes WHERE code = ?', (matching_code,))
-        conn.commit()
-        close_connection(conn)
-        
         print(f"Restore code {restore_code} revoked successfully")
         return True
     except Exception as e:
@@ -324,13 +810,17 @@ def revoke_restore_code(restore_code):
 
 def list_restore_codes():
     try:
+        purge_expired_restore_codes()
+        
         conn = get_connection()
         cursor = conn.cursor()
         
         cursor.execute('''
-        SELECT code, system_admin_username, backup_filename, created_date, used
+        SELECT RestoreCodes.id, RestoreCodes.admin_id, RestoreCodes.backup_filename, Backups.filename,
+               RestoreCodes.created_date, RestoreCodes.expires, RestoreCodes.used
         FROM RestoreCodes
-        ORDER BY created_date DESC
+        LEFT JOIN Backups ON Backups.id = RestoreCodes.backup_id
+        ORDER BY RestoreCodes.expires DESC
         ''')
         
         results = cursor.fetchall()
@@ -341,26 +831,16 @@ def list_restore_codes():
             return
         
         print("\n=== RESTORE CODES ===")
-        print(f"{'Code':<10} {'Admin':<15} {'Backup':<20} {'Created':<20} {'Used':<5}")
-        print("-" * 80)
-        
-        for code, admin, backup, created, used in results:
-            try:
-                decrypted_code = decrypt_data(code)
-                decrypted_admin = decrypt_data(admin)
-                decrypted_backup = decrypt_data(backup)
-                decrypted_created = decrypt_data(created)
-                decrypted_used = decrypt_data(str(used))
-                is_used = decrypted_used == "1" or decrypted_used == "True"
-            except:
-                decrypted_code = code
-                decrypted_admin = admin
-                decrypted_backup = backup
-                decrypted_created = created
-                is_used = used == 1 or used == "1"
-            
-            status = "Yes" if is_used else "No"
-            print(f"{decrypted_code:<10} {decrypted_admin:<15} {decrypted_backup:<20} {decrypted_created:<20} {status:<5}")
+        print(f"{'ID':<5} {'Admin':<15} {'Backup':<32} {'Created':<20} {'Expires':<17} {'Used':<5}")
+        print("-" * 100)
+        
+        for code_id, admin_id, backup, catalog_backup, created, expires, used in results:
+            admin = lookup_user(admin_id)
+            admin_name = admin[0] if admin else "(deleted)"
+            backup_name = os.path.basename(catalog_backup or decrypt_data(backup))
+            expires_str = datetime.fromtimestamp(expires).strftime('%Y-%m-%d %H:%M')
+            status = "Yes" if used else "No"
+            print(f"{code_id:<5} {admin_name[:15]:<15} {backup_name[:32]:<32} {decrypt_data(created):<20} {expires_str:<17} {status:<5}")
         
     except Exception as e:
         print(f"Error listing restore codes: {e}")
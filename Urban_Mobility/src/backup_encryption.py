@@ -0,0 +1,165 @@
+import io
+import os
+import struct
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+ARCHIVE_MAGIC = b'UMBK1\n'
+ARCHIVE_CHUNK_SIZE = 1024 * 1024
+ARCHIVE_TAG_SIZE = 16
+WRAP_NONCE_SIZE = 12
+WRAPPED_KEY_SIZE = 32 + ARCHIVE_TAG_SIZE
+NONCE_PREFIX_SIZE = 4
+ARCHIVE_HEADER_SIZE = len(ARCHIVE_MAGIC) + 4 + WRAP_NONCE_SIZE + WRAPPED_KEY_SIZE + NONCE_PREFIX_SIZE
+
+backup_key = None
+
+def get_backup_key_file():
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    return os.environ.get('UM_BACKUP_KEY_FILE', os.path.join(script_dir, 'backup.key'))
+
+def get_backup_key():
+    global backup_key
+    if backup_key is None:
+        key_file = get_backup_key_file()
+        if os.path.exists(key_file):
+            with open(key_file, 'rb') as f:
+                backup_key = f.read()
+        else:
+            backup_key = AESGCM.generate_key(bit_length=256)
+            fd = os.open(key_file, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+            with os.fdopen(fd, 'wb') as f:
+                f.write(backup_key)
+    return backup_key
+
+def is_encrypted_archive(path):
+    with open(path, 'rb') as f:
+        return f.read(len(ARCHIVE_MAGIC)) == ARCHIVE_MAGIC
+
+def chunk_nonce(nonce_prefix, index):
+    return nonce_prefix + struct.pack('>Q', index)
+
+def chunk_aad(header, index, final):
+    return header + struct.pack('>Q?', index, final)
+
+class EncryptedArchiveWriter(io.RawIOBase):
+
+    def __init__(self, path, chunk_size=ARCHIVE_CHUNK_SIZE):
+        self.file = open(path, 'wb')
+        self.chunk_size = chunk_size
+        self.buffer = bytearray()
+        self.index = 0
+        self.position = 0
+
+        data_key = AESGCM.generate_key(bit_length=256)
+        wrap_nonce = os.urandom(WRAP_NONCE_SIZE)
+        self.nonce_prefix = os.urandom(NONCE_PREFIX_SIZE)
+        wrapped_key = AESGCM(get_backup_key()).encrypt(wrap_nonce, data_key, ARCHIVE_MAGIC)
+        self.header = ARCHIVE_MAGIC + struct.pack('>I', chunk_size) + wrap_nonce + wrapped_key + self.nonce_prefix
+        self.cipher = AESGCM(data_key)
+        self.file.write(self.header)
+
+    def writable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def write(self, data):
+        self.buffer += data
+        self.position += len(data)
+        while len(self.buffer) > self.chunk_size:
+            self.write_chunk(bytes(self.buffer[:self.chunk_size]), False)
+            del self.buffer[:self.chunk_size]
+        return len(data)
+
+    def write_chunk(self, chunk, final):
+        self.file.write(self.cipher.encrypt(chunk_nonce(self.nonce_prefix, self.index), chunk, chunk_aad(self.header, self.index, final)))
+        self.index += 1
+
+    def close(self):
+        if not self.closed:
+            self.write_chunk(bytes(self.buffer), True)
+            self.buffer = bytearray()
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.file.close()
+        super().close()
+
+class EncryptedArchiveReader(io.RawIOBase):
+
+    def __init__(self, path):
+        self.file = open(path, 'rb')
+        self.header = self.file.read(ARCHIVE_HEADER_SIZE)
+        if len(self.header) != ARCHIVE_HEADER_SIZE or not self.header.startswith(ARCHIVE_MAGIC):
+            self.file.close()
+            raise ValueError(f"{path} is not an encrypted backup archive")
+
+        offset = len(ARCHIVE_MAGIC)
+        self.chunk_size = struct.unpack('>I', self.header[offset:offset + 4])[0]
+        offset += 4
+        wrap_nonce = self.header[offset:offset + WRAP_NONCE_SIZE]
+        offset += WRAP_NONCE_SIZE
+        wrapped_key = self.header[offset:offset + WRAPPED_KEY_SIZE]
+        self.nonce_prefix = self.header[offset + WRAPPED_KEY_SIZE:]
+
+        try:
+            self.cipher = AESGCM(AESGCM(get_backup_key()).decrypt(wrap_nonce, wrapped_key, ARCHIVE_MAGIC))
+        except InvalidTag:
+            self.file.close()
+            raise ValueError(f"{path} was encrypted with a different backup key")
+
+        body_size = os.path.getsize(path) - ARCHIVE_HEADER_SIZE
+        encrypted_chunk_size = self.chunk_size + ARCHIVE_TAG_SIZE
+        self.chunk_count = max(1, -(-body_size // encrypted_chunk_size))
+        self.size = body_size - self.chunk_count * ARCHIVE_TAG_SIZE
+        self.position = 0
+        self.chunk_index = None
+        self.chunk = b''
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.position
+        elif whence == io.SEEK_END:
+            offset += self.size
+        if offset < 0:
+            raise ValueError("Negative seek position")
+        self.position = offset
+        return self.position
+
+    def load_chunk(self, index):
+        if self.chunk_index == index:
+            return
+        self.file.seek(ARCHIVE_HEADER_SIZE + index * (self.chunk_size + ARCHIVE_TAG_SIZE))
+        encrypted_chunk = self.file.read(self.chunk_size + ARCHIVE_TAG_SIZE)
+        final = index == self.chunk_count - 1
+        try:
+            self.chunk = self.cipher.decrypt(chunk_nonce(self.nonce_prefix, index), encrypted_chunk, chunk_aad(self.header, index, final))
+        except InvalidTag:
+            raise ValueError(f"Backup archive chunk {index} failed verification")
+        self.chunk_index = index
+
+    def readinto(self, buffer):
+        if self.position >= self.size:
+            return 0
+        index = self.position // self.chunk_size
+        self.load_chunk(index)
+        start = self.position - index * self.chunk_size
+        length = min(len(buffer), len(self.chunk) - start)
+        buffer[:length] = self.chunk[start:start + length]
+        self.position += length
+        return length
+
+    def close(self):
+        if not self.closed:
+            self.file.close()
+        super().close()
@@ -0,0 +1,283 @@
+import json
+import os
+import threading
+from datetime import datetime, timedelta
+from database import get_connection, close_connection
+from backup import create_backup, delete_backup, is_archive_backup, list_backups, load_backup_policy, resolve_backup_chain
+from backup_store import create_store_backup, prune_backup_store
+from system_logging import audit_thread_output
+from wal_archive import WAL_ARCHIVE_INTERVAL, prune_wal_archive, start_wal_archiver
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+backup_schedule_file = 'backup_schedule.json'
+scheduler_lock_file = 'backup_scheduler.lock'
+SCHEDULER_TICK = 30
+SCHEDULER_NICE = 19
+CRON_SEARCH_MINUTES = 366 * 24 * 60
+CRON_FIELD_RANGES = [(0, 59), (0, 23), (1, 31), (1, 12), (0, 7)]
+DEFAULT_BACKUP_SCHEDULE = {
+    'enabled': False,
+    'schedules': [
+        {'name': 'hourly', 'interval_minutes': 60, 'type': 'incremental'},
+        {'name': 'nightly', 'cron': '0 2 * * *', 'type': 'full'}
+    ],
+    'retention': {'hourly': 24, 'daily': 7, 'weekly': 4},
+    'wal_archive': {'enabled': True, 'interval_seconds': WAL_ARCHIVE_INTERVAL}
+}
+
+scheduler_stop = threading.Event()
+scheduler_thread = None
+
+def load_backup_schedule():
+    config = json.loads(json.dumps(DEFAULT_BACKUP_SCHEDULE))
+    try:
+        with open(backup_schedule_file, 'r') as f:
+            user_config = json.load(f)
+    except FileNotFoundError:
+        return config
+    except Exception as e:
+        print(f"Error reading backup schedule, using defaults: {e}")
+        return config
+
+    for key, value in user_config.items():
+        if isinstance(value, dict) and isinstance(config.get(key), dict):
+            config[key].update(value)
+        else:
+            config[key] = value
+    return config
+
+def parse_cron_field(field, low, high):
+    values = set()
+    for part in field.split(','):
+        step = 1
+        has_step = '/' in part
+        if has_step:
+            part, step = part.split('/')
+            step = int(step)
+        if part == '*':
+            start, end = low, high
+        elif '-' in part:
+            start, end = map(int, part.split('-'))
+        else:
+            start = int(part)
+            end = high if has_step else start
+        if start < low or end > high or step < 1:
+            raise ValueError(f"Cron field {field} is outside {low}-{high}")
+        values.update(range(start, end + 1, step))
+    return values
+
+def parse_cron(expression):
+    fields = expression.split()
+    if len(fields) != 5:
+        raise ValueError(f"Cron expression must have 5 fields: {expression}")
+    minutes, hours, days, months, weekdays = [parse_cron_field(field, low, high)
+                                              for field, (low, high) in zip(fields, CRON_FIELD_RANGES)]
+    weekdays = {weekday % 7 for weekday in weekdays}
+    either_day = not fields[2].startswith('*') and not fields[4].startswith('*')
+    return minutes, hours, days, months, weekdays, either_day
+
+def cron_matches(cron, moment):
+    minutes, hours, days, months, weekdays, either_day = cron
+    if moment.minute not in minutes or moment.hour not in hours or moment.month not in months:
+        return False
+    day_matches = moment.day in days
+    weekday_matches = moment.isoweekday() % 7 in weekdays
+    if either_day:
+        return day_matches or weekday_matches
+    return day_matches and weekday_matches
+
+def next_cron_time(cron, after):
+    moment = after.replace(second=0, microsecond=0) + timedelta(minutes=1)
+    for _ in range(CRON_SEARCH_MINUTES):
+        if cron_matches(cron, moment):
+            return moment
+        moment += timedelta(minutes=1)
+    return None
+
+def get_last_run(schedule_name):
+    conn = get_connection()
+    try:
+        row = conn.execute('SELECT MAX(created) FROM Backups WHERE origin = ?', (f"schedule:{schedule_name}",)).fetchone()
+    finally:
+        close_connection(conn)
+    return datetime.fromtimestamp(row[0]) if row and row[0] else None
+
+def get_next_run(schedule, last_run, now):
+    if 'cron' in schedule:
+        return next_cron_time(parse_cron(schedule['cron']), last_run or now)
+    if last_run is None:
+        return now
+    return last_run + timedelta(minutes=schedule['interval_minutes'])
+
+def run_scheduled_backup(schedule):
+    origin = f"schedule:{schedule['name']}"
+    backup_type = schedule.get('type', 'incremental')
+    if backup_type == 'store':
+        return create_store_backup(origin=origin)
+    policy = dict(load_backup_policy(), **schedule.get('policy', {}))
+    return create_backup(incremental=backup_type == 'incremental', origin=origin, policy=policy)
+
+def get_tier_bucket(tier, moment):
+    if tier == 'hourly':
+        return moment.strftime('%Y%m%d%H')
+    if tier == 'daily':
+        return moment.strftime('%Y%m%d')
+    if tier == 'weekly':
+        return moment.isocalendar()[:2]
+    raise ValueError(f"Unknown retention tier: {tier}")
+
+def select_retained_backups(backups, retention):
+    retained = set()
+    for tier, count in retention.items():
+        buckets = set()
+        for backup_filename, created in backups:
+            bucket = get_tier_bucket(tier, datetime.fromtimestamp(created))
+            if bucket in buckets:
+                continue
+            if len(buckets) >= count:
+                break
+            buckets.add(bucket)
+            retained.add(backup_filename)
+    return retained
+
+def get_backup_ancestors(backup_files):
+    ancestors = set()
+    for backup_filename in backup_files:
+        if is_archive_backup(backup_filename) and os.path.exists(backup_filename):
+            try:
+                ancestors.update(chain_filename for chain_filename, _ in resolve_backup_chain(backup_filename))
+            except ValueError:
+                pass
+    return ancestors
+
+def apply_backup_retention(retention=None):
+    retention = retention or load_backup_schedule()['retention']
+    if not retention:
+        return []
+
+    conn = get_connection()
+    try:
+        backups = conn.execute("SELECT filename, created FROM Backups WHERE origin LIKE 'schedule:%' ORDER BY created DESC").fetchall()
+    finally:
+        close_connection(conn)
+
+    retained = select_retained_backups(backups, retention)
+    scheduled = {backup_filename for backup_filename, _ in backups}
+    unscheduled = [backup_filename for backup_filename in list_backups() if backup_filename not in scheduled]
+    retained |= get_backup_ancestors(list(retained) + unscheduled)
+    removed = [backup_filename for backup_filename, _ in backups if backup_filename not in retained]
+    for backup_filename in removed:
+        delete_backup(backup_filename)
+    if any(not is_archive_backup(backup_filename) for backup_filename in removed):
+        prune_backup_store()
+    prune_wal_archive()
+
+    if removed:
+        print(f"Backup retention removed {len(removed)} backups, kept {len(retained)}")
+    return removed
+
+def lower_thread_priority():
+    try:
+        os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), SCHEDULER_NICE)
+    except (AttributeError, OSError):
+        pass
+
+def acquire_scheduler_lock():
+    lock_handle = open(scheduler_lock_file, 'a')
+    if fcntl is not None:
+        try:
+            fcntl.flock(lock_handle.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_handle.close()
+            return None
+    return lock_handle
+
+def backup_scheduler_loop():
+    lock_handle = acquire_scheduler_lock()
+    while lock_handle is None:
+        if scheduler_stop.wait(SCHEDULER_TICK):
+            return
+        lock_handle = acquire_scheduler_lock()
+
+    try:
+        lower_thread_priority()
+        config = load_backup_schedule()
+        now = datetime.now()
+        next_runs = {schedule['name']: get_next_run(schedule, get_last_run(schedule['name']), now)
+                     for schedule in config['schedules']}
+
+        while not scheduler_stop.is_set():
+            for schedule in config['schedules']:
+                now = datetime.now()
+                next_run = next_runs[schedule['name']]
+                if next_run is None or next_run > now:
+                    continue
+                try:
+                    run_scheduled_backup(schedule)
+                    apply_backup_retention(config.get('retention'))
+                except Exception as e:
+                    print(f"Error running scheduled backup {schedule['name']}: {e}")
+                next_runs[schedule['name']] = get_next_run(schedule, datetime.now(), datetime.now())
+            scheduler_stop.wait(SCHEDULER_TICK)
+    finally:
+        lock_handle.close()
+
+def run_backup_scheduler_thread():
+    with audit_thread_output('backup_scheduler'):
+        backup_scheduler_loop()
+
+def start_wal_archiving(config):
+    wal_archive = config.get('wal_archive', DEFAULT_BACKUP_SCHEDULE['wal_archive'])
+    if wal_archive.get('enabled', True):
+        start_wal_archiver(wal_archive.get('interval_seconds', WAL_ARCHIVE_INTERVAL))
+
+def start_backup_scheduler():
+    global scheduler_thread
+    config = load_backup_schedule()
+    if not config.get('enabled', False):
+        return
+    start_wal_archiving(config)
+    if scheduler_thread is None or not scheduler_thread.is_alive():
+        scheduler_stop.clear()
+        scheduler_thread = threading.Thread(target=run_backup_scheduler_thread, name="backup-scheduler", daemon=True)
+        scheduler_thread.start()
+
+def stop_backup_scheduler():
+    scheduler_stop.set()
+
+def display_backup_runs(limit=20):
+    conn = get_connection()
+    try:
+        runs = conn.execute('''
+            SELECT filename, created, size, duration, type, origin
+            FROM Backups
+            ORDER BY created DESC
+            LIMIT ?
+        ''', (limit,)).fetchall()
+    finally:
+        close_connection(conn)
+
+    if not runs:
+        print("No backups recorded")
+        return
+
+    print("\n=== BACKUP RUNS ===")
+    print(f"{'Created':<20} {'Type':<12} {'Origin':<18} {'Size':>12} {'Duration':>9}  File")
+    print("-" * 110)
+    for filename, created, size, duration, backup_type, origin in runs:
+        created_str = datetime.fromtimestamp(created).strftime('%Y-%m-%d %H:%M:%S')
+        print(f"{created_str:<20} {backup_type:<12} {origin[:18]:<18} {size:>12} {duration:>8.1f}s  {filename}")
+
+if __name__ == '__main__':
+    from database import initialize_db
+    initialize_db()
+    start_wal_archiving(load_backup_schedule())
+    print("Backup scheduler running. Press Ctrl+C to stop.")
+    try:
+        backup_scheduler_loop()
+    except KeyboardInterrupt:
+        stop_backup_scheduler()
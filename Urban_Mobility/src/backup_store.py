@@ -0,0 +1,193 @@
+import base64
+import hashlib
+import hmac
+import json
+import os
+import tempfile
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+from datetime import datetime
+import encryption
+from backup import collect_backup_files, get_page_size, hash_file, record_backup
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+BACKUP_STORE_DIR = 'backup_store'
+BACKUP_STORE_CHUNKS = os.path.join(BACKUP_STORE_DIR, 'chunks')
+BACKUP_STORE_MANIFESTS = os.path.join(BACKUP_STORE_DIR, 'manifests')
+STORE_MIN_CHUNK_SIZE = 16 * 1024
+STORE_MAX_CHUNK_SIZE = 256 * 1024
+STORE_BOUNDARY_DIVISOR = 16
+STORE_STORED_FILES = ('urban_mobility.db', 'encrypted_logs.txt')
+store_lock_file = os.path.join(BACKUP_STORE_DIR, 'store.lock')
+
+store_write_lock = threading.RLock()
+
+@contextmanager
+def backup_store_lock():
+    with store_write_lock:
+        if fcntl is None:
+            yield
+            return
+
+        os.makedirs(BACKUP_STORE_DIR, exist_ok=True)
+        with open(store_lock_file, 'a') as lock_handle:
+            fcntl.flock(lock_handle.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_handle.fileno(), fcntl.LOCK_UN)
+
+def chunk_address(chunk):
+    return encryption.keyed_hash("store_chunk", chunk)
+
+def chunk_path(address):
+    return os.path.join(BACKUP_STORE_CHUNKS, address[:2], address)
+
+def iter_units(path, name):
+    with open(path, 'rb') as f:
+        if name == 'urban_mobility.db':
+            page_size = get_page_size(path)
+            yield from iter(lambda: f.read(page_size), b'')
+        else:
+            yield from f
+
+def iter_chunks(path, name):
+    chunk = bytearray()
+    for unit in iter_units(path, name):
+        chunk += unit
+        if len(chunk) < STORE_MIN_CHUNK_SIZE:
+            continue
+        fingerprint = int.from_bytes(hashlib.blake2b(unit, digest_size=4).digest(), 'big')
+        if fingerprint % STORE_BOUNDARY_DIVISOR == 0 or len(chunk) >= STORE_MAX_CHUNK_SIZE:
+            yield bytes(chunk)
+            chunk = bytearray()
+    if chunk:
+        yield bytes(chunk)
+
+def store_chunk(chunk):
+    address = chunk_address(chunk)
+    path = chunk_path(address)
+    if os.path.exists(path):
+        return address, 0
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+    with os.fdopen(fd, 'wb') as f:
+        f.write(base64.urlsafe_b64decode(encryption.cipher_suite.encrypt(zlib.compress(chunk))))
+    os.replace(temp_path, path)
+    return address, os.path.getsize(path)
+
+def load_chunk(address):
+    with open(chunk_path(address), 'rb') as f:
+        chunk = zlib.decompress(encryption.cipher_suite.decrypt(base64.urlsafe_b64encode(f.read())))
+    if not (hmac.compare_digest(chunk_address(chunk), address) or hmac.compare_digest(encryption.legacy_keyed_hash(chunk), address)):
+        raise ValueError(f"Backup store chunk {address} is corrupt")
+    return chunk
+
+def new_store_manifest_path():
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    manifest_path = os.path.join(BACKUP_STORE_MANIFESTS, f"backup_{timestamp}.json")
+    suffix = 1
+    while os.path.exists(manifest_path):
+        manifest_path = os.path.join(BACKUP_STORE_MANIFESTS, f"backup_{timestamp}_{suffix:03d}.json")
+        suffix += 1
+    return manifest_path
+
+def is_store_backup(backup_filename):
+    return backup_filename.endswith('.json')
+
+def read_store_manifest(manifest_path):
+    with open(manifest_path, 'r') as f:
+        return json.load(f)
+
+def list_store_backups():
+    if not os.path.isdir(BACKUP_STORE_MANIFESTS):
+        return []
+    return [os.path.join(BACKUP_STORE_MANIFESTS, file) for file in os.listdir(BACKUP_STORE_MANIFESTS)
+            if file.startswith('backup_') and file.endswith('.json')]
+
+def create_store_backup(origin='manual'):
+    try:
+        started = time.time()
+        manifest = {
+            'type': 'store',
+            'created': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            'files': {}
+        }
+        total_bytes = new_bytes = stored_bytes = 0
+
+        with backup_store_lock():
+            os.makedirs(BACKUP_STORE_MANIFESTS, exist_ok=True)
+            manifest_path = new_store_manifest_path()
+            with tempfile.TemporaryDirectory(prefix='.snapshot_', dir='.') as snapshot_dir:
+                files, _ = collect_backup_files(snapshot_dir)
+                for name in STORE_STORED_FILES:
+                    if name not in files:
+                        continue
+
+                    chunks = []
+                    for chunk in iter_chunks(files[name], name):
+                        address, chunk_size = store_chunk(chunk)
+                        chunks.append(address)
+                        total_bytes += len(chunk)
+                        if chunk_size:
+                            new_bytes += len(chunk)
+                            stored_bytes += chunk_size
+
+                    manifest['files'][name] = {
+                        'size': os.path.getsize(files[name]),
+                        'sha256': hash_file(files[name]),
+                        'chunks': chunks
+                    }
+
+            temp_path = manifest_path + '.tmp'
+            with open(temp_path, 'w') as f:
+                json.dump(manifest, f)
+            os.replace(temp_path, manifest_path)
+        record_backup(manifest_path, manifest, started, origin, stored_bytes + os.path.getsize(manifest_path))
+
+        print(f"Deduplicated backup created successfully: {manifest_path}")
+        print(f"Stored {new_bytes} new bytes of {total_bytes} ({total_bytes - new_bytes} deduplicated)")
+        return manifest_path
+    except Exception as e:
+        print(f"Error creating deduplicated backup: {e}")
+        return None
+
+def extract_store_backup(manifest_path, target_dir):
+    manifest = read_store_manifest(manifest_path)
+    for name, info in manifest['files'].items():
+        path = os.path.join(target_dir, name)
+        digest = hashlib.sha256()
+        with open(path, 'wb') as f:
+            for address in info['chunks']:
+                chunk = load_chunk(address)
+                digest.update(chunk)
+                f.write(chunk)
+        if digest.hexdigest() != info['sha256']:
+            raise ValueError(f"Checksum mismatch for {name} after restoring {manifest_path}")
+
+def prune_backup_store():
+    with backup_store_lock():
+        referenced = set()
+        for manifest_path in list_store_backups():
+            for info in read_store_manifest(manifest_path)['files'].values():
+                referenced.update(info['chunks'])
+
+        removed = freed = 0
+        if os.path.isdir(BACKUP_STORE_CHUNKS):
+            for prefix in os.listdir(BACKUP_STORE_CHUNKS):
+                for address in os.listdir(os.path.join(BACKUP_STORE_CHUNKS, prefix)):
+                    if address not in referenced:
+                        path = os.path.join(BACKUP_STORE_CHUNKS, prefix, address)
+                        freed += os.path.getsize(path)
+                        os.remove(path)
+                        removed += 1
+
+    print(f"Removed {removed} unreferenced chunks ({freed} bytes)")
+    return removed
@@ -0,0 +1,98 @@
+import atexit
+import os
+import shutil
+import sqlite3
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+DATABASE_MB = 256
+ROW_SIZE = 4000
+WRITE_INTERVAL = 0.005
+BASELINE_SECONDS = 3
+
+def build_database(database_path):
+    conn = sqlite3.connect(database_path)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('CREATE TABLE Filler (id INTEGER PRIMARY KEY, payload BLOB)')
+    conn.execute('CREATE TABLE Writes (id INTEGER PRIMARY KEY, written REAL)')
+    rows = DATABASE_MB * 1024 * 1024 // ROW_SIZE
+    conn.executemany('INSERT INTO Filler (payload) VALUES (?)', ((os.urandom(ROW_SIZE),) for _ in range(rows)))
+    conn.commit()
+    conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+    conn.close()
+
+def run_writer(database_path, stop, latencies):
+    conn = sqlite3.connect(database_path, timeout=30.0)
+    while not stop.is_set():
+        started = time.perf_counter()
+        conn.execute('INSERT INTO Writes (written) VALUES (?)', (time.time(),))
+        conn.commit()
+        latencies.append(time.perf_counter() - started)
+        time.sleep(WRITE_INTERVAL)
+    conn.close()
+
+def measure_writes(database_path, action):
+    stop = threading.Event()
+    latencies = []
+    writer = threading.Thread(target=run_writer, args=(database_path, stop, latencies))
+    writer.start()
+    started = time.perf_counter()
+    try:
+        result = action()
+    finally:
+        stop.set()
+        writer.join()
+    return result, time.perf_counter() - started, latencies
+
+def describe(label, elapsed, latencies):
+    ordered = sorted(latencies)
+    p99 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))]
+    print(f"{label:<22} {len(ordered):>6} writes  p50 {statistics.median(ordered) * 1e3:6.2f} ms  "
+          f"p99 {p99 * 1e3:6.2f} ms  max {ordered[-1] * 1e3:7.2f} ms  {elapsed:6.2f} s")
+
+def check_snapshot(snapshot_path, committed_before):
+    conn = sqlite3.connect(snapshot_path)
+    try:
+        if conn.execute('PRAGMA quick_check').fetchone()[0] != 'ok':
+            raise SystemExit("FAIL: snapshot failed PRAGMA quick_check")
+        if conn.execute('SELECT COUNT(*) FROM Writes').fetchone()[0] < committed_before:
+            raise SystemExit("FAIL: snapshot is missing writes committed before it started")
+    finally:
+        conn.close()
+
+def count_writes(database_path):
+    conn = sqlite3.connect(database_path)
+    try:
+        return conn.execute('SELECT COUNT(*) FROM Writes').fetchone()[0]
+    finally:
+        conn.close()
+
+def run_benchmark():
+    from backup import snapshot_database
+
+    database_path = 'urban_mobility.db'
+    build_database(database_path)
+    print(f"Database: {os.path.getsize(database_path) / 1024 / 1024:.0f} MB, writer committing every {WRITE_INTERVAL * 1e3:.0f} ms")
+
+    _, elapsed, latencies = measure_writes(database_path, lambda: time.sleep(BASELINE_SECONDS))
+    describe("no backup", elapsed, latencies)
+
+    committed_before = count_writes(database_path)
+    snapshot_path = 'snapshot.db'
+    _, elapsed, latencies = measure_writes(database_path, lambda: snapshot_database(database_path, snapshot_path))
+    describe("snapshot_database", elapsed, latencies)
+    check_snapshot(snapshot_path, committed_before)
+
+    _, elapsed, latencies = measure_writes(database_path, lambda: time.sleep(BASELINE_SECONDS))
+    describe("after snapshot", elapsed, latencies)
+    print("Snapshot passed PRAGMA quick_check")
+
+if __name__ == '__main__':
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    work_dir = tempfile.mkdtemp(prefix='backup_benchmark_')
+    atexit.register(shutil.rmtree, work_dir, True)
+    os.chdir(work_dir)
+    run_benchmark()
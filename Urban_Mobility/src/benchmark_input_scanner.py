@@ -0,0 +1,95 @@
+import os
+import random
+import re
+import sys
+import timeit
+
+ROUNDS = 20
+
+BENIGN_INPUTS = [
+    ("first_name", "Anne-Marie"), ("last_name", "O'Neill"), ("name", "Jan de Vries"),
+    ("email", "j.devries@example.com"), ("phone", "12345678"), ("zip_code", "3011AB"),
+    ("driving_license", "AB1234567"), ("serial_number", "SCT2024X0001"),
+    ("street_name", "Coolsingel"), ("city", "Rotterdam"), ("choice", "3"),
+    ("description", "Scooter returned with a scratched mudguard near the station entrance, " * 3),
+]
+
+MALICIOUS_INPUTS = [
+    ("first_name", "<script>alert(1)</script>"), ("email", "x@example.com' OR '1'='1"),
+    ("city", "<IFRAME src=javascript:alert(1)>"), ("street_name", "img onerror=alert(1)"),
+    ("zip_code", "../../etc/passwd"), ("serial_number", "%2E%2E%2Fsecret"),
+    ("phone", "1234\\x00"), ("description", "payload%00.txt"), ("name", "a\x00b"),
+    ("driving_license", 'AB"1234567'),
+]
+
+def legacy_detect_suspicious_input(input_value, field_name="unknown"):
+    if "\x00" in input_value:
+        return True
+
+    always_suspicious_patterns = [
+        r"(<script|<iframe|<object|<embed|javascript:)",
+        r"(onload|onerror|onclick|onfocus)",
+        r"(\.\./|\.\.\\|%2e%2e)",
+        r"(\\x00|\\0|%00|\\u0000)",
+    ]
+
+    for pattern in always_suspicious_patterns:
+        if re.search(pattern, input_value, re.IGNORECASE):
+            return True
+
+    if "'" in input_value or '"' in input_value:
+        if field_name in ['first_name', 'last_name', 'name']:
+            return False
+        return field_name in ['email', 'phone', 'zip_code', 'driving_license', 'serial_number']
+
+    return False
+
+def build_corpus(size=2000):
+    corpus = []
+    for i in range(size):
+        field_name, value = random.choice(MALICIOUS_INPUTS if i % 10 == 0 else BENIGN_INPUTS)
+        corpus.append((value + str(i % 50), field_name))
+    return corpus
+
+def run_benchmark():
+    import system_logging
+    from system_logging import detect_suspicious_input, scan_suspicious_input
+
+    corpus = build_corpus()
+    for value, field_name in corpus:
+        if legacy_detect_suspicious_input(value, field_name) != detect_suspicious_input(value, field_name):
+            raise SystemExit(f"FAIL: verdicts differ for {field_name}={value!r}")
+    print(f"Corpus: {len(corpus)} inputs ({sum(1 for i in range(len(corpus)) if i % 10 == 0)} malicious), verdicts identical")
+
+    uncached_scan = scan_suspicious_input.__wrapped__
+
+    def legacy_pass():
+        for value, field_name in corpus:
+            legacy_detect_suspicious_input(value, field_name)
+            legacy_detect_suspicious_input(value, field_name)
+
+    def compiled_pass():
+        for value, field_name in corpus:
+            uncached_scan(value, field_name)
+            uncached_scan(value, field_name)
+
+    def cached_pass():
+        scan_suspicious_input.cache_clear()
+        for value, field_name in corpus:
+            detect_suspicious_input(value, field_name)
+            system_logging.scan_suspicious_input(value, field_name)
+
+    calls = len(corpus) * 2 * ROUNDS
+    results = [
+        ("legacy: four re.search calls", min(timeit.repeat(legacy_pass, number=ROUNDS, repeat=3))),
+        ("compiled alternation", min(timeit.repeat(compiled_pass, number=ROUNDS, repeat=3))),
+        ("compiled + per-input cache", min(timeit.repeat(cached_pass, number=ROUNDS, repeat=3))),
+    ]
+    baseline = results[0][1]
+    for label, elapsed in results:
+        print(f"{label:<30} {elapsed / calls * 1e6:7.2f} us/call  {baseline / elapsed:5.1f}x")
+
+if __name__ == '__main__':
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    random.seed(26)
+    run_benchmark()
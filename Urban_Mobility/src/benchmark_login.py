@@ -0,0 +1,78 @@
+import atexit
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+USER_COUNTS = (10, 1000, 100000)
+LOGINS_PER_SIZE = 20
+BENCHMARK_PASSWORD = 'Benchmark-Password-1!'
+
+def add_users(start, end, password_hash):
+    from database import get_connection, close_connection
+    from encryption import encrypt_data, blind_index
+    rows = []
+    for i in range(start, end):
+        username = f"bench{i:06d}"
+        rows.append((encrypt_data(username), password_hash, encrypt_data('service_engineer'), encrypt_data("0"), blind_index(username)))
+
+    conn = get_connection()
+    try:
+        conn.executemany('''
+            INSERT INTO Users (username, password_hash, role, temp_password, username_index)
+            VALUES (?, ?, ?, ?, ?)
+        ''', rows)
+        conn.commit()
+    finally:
+        close_connection(conn)
+
+def time_login(username, password):
+    import rate_limiting
+    from authentication import authenticate_user
+    from session_management import terminate_session
+    rate_limiting.buckets.clear()
+    rate_limiting.failed_attempts.clear()
+
+    started = time.perf_counter()
+    result = authenticate_user(username, password)
+    elapsed = time.perf_counter() - started
+    if result[0]:
+        terminate_session(username)
+    return elapsed * 1000, result[0] is not None
+
+def run_benchmark():
+    from database import initialize_db
+    import authentication
+    initialize_db()
+
+    authentication.bcrypt_rounds = authentication.MIN_BCRYPT_ROUNDS
+    password_hash = authentication.hash_password(BENCHMARK_PASSWORD)
+    print(f"bcrypt rounds: {authentication.bcrypt_rounds}, {LOGINS_PER_SIZE} logins per case")
+    print(f"{'users':>8} {'valid login':>14} {'wrong password':>16} {'unknown user':>14}")
+
+    populated = 0
+    for user_count in USER_COUNTS:
+        add_users(populated, user_count, password_hash)
+        populated = user_count
+
+        valid, wrong, unknown = [], [], []
+        for _ in range(LOGINS_PER_SIZE):
+            username = f"bench{random.randrange(user_count):06d}"
+            elapsed, ok = time_login(username, BENCHMARK_PASSWORD)
+            if not ok:
+                raise SystemExit(f"FAIL: login for {username} was rejected")
+            valid.append(elapsed)
+            wrong.append(time_login(username, 'wrong-password')[0])
+            unknown.append(time_login(f"missing{random.randrange(10 ** 6)}", BENCHMARK_PASSWORD)[0])
+
+        print(f"{user_count:>8} {statistics.median(valid):>11.1f} ms {statistics.median(wrong):>13.1f} ms {statistics.median(unknown):>11.1f} ms")
+
+if __name__ == '__main__':
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    work_dir = tempfile.mkdtemp(prefix='login_benchmark_')
+    atexit.register(shutil.rmtree, work_dir, True)
+    os.chdir(work_dir)
+    run_benchmark()
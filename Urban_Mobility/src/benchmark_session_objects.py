@@ -0,0 +1,78 @@
+import os
+import secrets
+import sys
+import timeit
+import tracemalloc
+from datetime import datetime
+
+SESSION_COUNTS = (10000, 100000)
+CALLS = 200000
+SESSION_TIMEOUT = 1800
+MAX_SESSION_DURATION = 7200
+
+class LegacySession:
+
+    def __init__(self, username, role):
+        self.username = username
+        self.role = role
+        self.session_id = secrets.token_urlsafe(32)
+        self.login_time = datetime.now()
+        self.last_activity = datetime.now()
+        self.is_active = True
+        self.invalid_attempts = 0
+        self.suspicious_activity = 0
+
+    def is_expired(self):
+        if (datetime.now() - self.last_activity).seconds > SESSION_TIMEOUT:
+            return True, "Session expired due to inactivity"
+        if (datetime.now() - self.login_time).seconds > MAX_SESSION_DURATION:
+            return True, "Session expired due to maximum duration"
+        return False, "Session valid"
+
+    def get_session_info(self):
+        time_remaining = SESSION_TIMEOUT - (datetime.now() - self.last_activity).seconds
+        max_time_remaining = MAX_SESSION_DURATION - (datetime.now() - self.login_time).seconds
+
+        return {
+            'username': self.username,
+            'role': self.role,
+            'session_id': self.session_id[:8] + "...",
+            'login_time': self.login_time,
+            'last_activity': self.last_activity,
+            'time_remaining': max(0, time_remaining),
+            'max_time_remaining': max(0, max_time_remaining),
+            'invalid_attempts': self.invalid_attempts,
+            'suspicious_activity': self.suspicious_activity
+        }
+
+def measure_memory(session_class, count):
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    sessions = [session_class(f"user{i:06d}", 'service_engineer') for i in range(count)]
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    used = sum(stat.size_diff for stat in after.compare_to(before, 'filename'))
+    return used / count, sessions
+
+def measure_latency(sessions, method):
+    calls = [getattr(sessions[i % len(sessions)], method) for i in range(1000)]
+
+    def run():
+        for call in calls:
+            call()
+
+    return min(timeit.repeat(run, number=CALLS // len(calls), repeat=3)) / CALLS * 1e6
+
+def run_benchmark():
+    from session_management import Session
+    print(f"{'sessions':>9} {'class':<8} {'bytes/session':>14} {'is_expired':>12} {'get_session_info':>18}")
+    for count in SESSION_COUNTS:
+        for label, session_class in (('legacy', LegacySession), ('current', Session)):
+            bytes_per_session, sessions = measure_memory(session_class, count)
+            is_expired = measure_latency(sessions, 'is_expired')
+            session_info = measure_latency(sessions, 'get_session_info')
+            print(f"{count:>9} {label:<8} {bytes_per_session:>14.0f} {is_expired:>9.3f} us {session_info:>15.3f} us")
+
+if __name__ == '__main__':
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    run_benchmark()
@@ -0,0 +1,85 @@
+import os
+import random
+import sys
+import time
+
+SESSION_COUNT = 100000
+EXPIRED_FRACTION = 0.01
+LOOKUPS = 200000
+
+def per_op(started, count):
+    return (time.perf_counter() - started) / count * 1e6
+
+def run_benchmark():
+    from session_management import Session, SessionStore, SESSION_TIMEOUT
+
+    store = SessionStore()
+    sessions = [Session(f"user{i:06d}", 'service_engineer') for i in range(SESSION_COUNT)]
+    started = time.perf_counter()
+    for session in sessions:
+        store.add(session)
+    add_cost = per_op(started, SESSION_COUNT)
+
+    ids = [random.choice(sessions).session_id for _ in range(LOOKUPS)]
+    names = [random.choice(sessions).username for _ in range(LOOKUPS)]
+    started = time.perf_counter()
+    for session_id in ids:
+        store.get_by_id(session_id)
+    id_cost = per_op(started, LOOKUPS)
+    started = time.perf_counter()
+    for username in names:
+        store.get_by_username(username)
+    name_cost = per_op(started, LOOKUPS)
+
+    touched = random.sample(sessions, SESSION_COUNT // 10)
+    started = time.perf_counter()
+    for session in touched:
+        store.touch(session)
+    touch_cost = per_op(started, len(touched))
+
+    started = time.perf_counter()
+    for _ in range(LOOKUPS):
+        store.first_active()
+    first_active_cost = per_op(started, LOOKUPS)
+
+    started = time.perf_counter()
+    store.pop_expired()
+    idle_sweep_cost = per_op(started, 1)
+
+    idle_since = time.monotonic() - SESSION_TIMEOUT - 1
+    expiring = random.sample(sessions, int(SESSION_COUNT * EXPIRED_FRACTION))
+    with store.lock:
+        for session in expiring:
+            session.update_activity(idle_since)
+            store.schedule(session)
+    started = time.perf_counter()
+    expired = store.pop_expired()
+    sweep_cost = per_op(started, 1)
+
+    now = time.monotonic()
+    started = time.perf_counter()
+    scanned = [session for session in store.by_id.values() if session.is_expired(now)[0]]
+    scan_cost = per_op(started, 1)
+    if len(expired) != len(expiring) or len(scanned) != len(expiring):
+        raise SystemExit(f"FAIL: sweep found {len(expired)} expired sessions, expected {len(expiring)}")
+
+    started = time.perf_counter()
+    for session in expired:
+        store.remove(session)
+    remove_cost = per_op(started, len(expired))
+
+    print(f"Sessions: {SESSION_COUNT}, expired in sweep: {len(expired)}")
+    print(f"add                          {add_cost:10.2f} us/op")
+    print(f"get_by_id                    {id_cost:10.2f} us/op")
+    print(f"get_by_username              {name_cost:10.2f} us/op")
+    print(f"touch                        {touch_cost:10.2f} us/op")
+    print(f"first_active                 {first_active_cost:10.2f} us/op")
+    print(f"remove                       {remove_cost:10.2f} us/op")
+    print(f"sweep, nothing expired       {idle_sweep_cost:10.2f} us")
+    print(f"{f'sweep, {len(expired)} expired':<28} {sweep_cost:10.2f} us")
+    print(f"full is_expired scan         {scan_cost:10.2f} us")
+
+if __name__ == '__main__':
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    random.seed(35)
+    run_benchmark()
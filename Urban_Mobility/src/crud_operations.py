@@ -1,29 +1,15 @@
+import os
 import sqlite3
+import time
 from datetime import datetime
 from database import get_connection, close_connection
-from encryption import encrypt_data, decrypt_data
+from encryption import encrypt_data, decrypt_data, blind_index
 from system_logging import log_action
-from session_management import get_current_user_id
+from session_management import notify_account_changed, get_authorization_context, lookup_user, get_role_counts
 
 def count_users_by_role(target_role):
     try:
-        conn = get_connection()
-        cursor = conn.cursor()
-        cursor.execute('SELECT id, role FROM Users')
-        all_users = cursor.fetchall()
-        close_connection(conn)
-        
-        count = 0
-        for user_id, role in all_users:
-            try:
-                decrypted_role = decrypt_data(role)
-                if decrypted_role == target_role:
-                    count += 1
-            except:
-                if role == target_role:
-                    count += 1
-        
-        return count
+        return get_role_counts().get(target_role, 0)
     except Exception as e:
         print(f"Error counting users by role: {e}")
         return 0
@@ -38,19 +24,11 @@ def create_user(user_data, current_user):
             
         cursor = conn.cursor()
 
-        cursor.execute('SELECT id, username FROM Users')
-        all_users = cursor.fetchall()
-        
-        for existing_id, existing_username in all_users:
-            try:
-                decrypted_username = decrypt_data(existing_username)
-                if decrypted_username.lower() == user_data['username'].lower():
-                    print(f"ERROR: Username '{user_data['username']}' is already taken.")
-                    return False
-            except:
-                if existing_username.lower() == user_data['username'].lower():
-                    print(f"ERROR: Username '{user_data['username']}' is already taken.")
-                    return False
+        username_index = blind_index(user_data['username'])
+        cursor.execute('SELECT id FROM Users WHERE username_index = ?', (username_index,))
+        if cursor.fetchone():
+            print(f"ERROR: Username '{user_data['username']}' is already taken.")
+            return False
         
         encrypted_username = encrypt_data(user_data['username'])
         encrypted_first_name = encrypt_data(user_data['first_name'])
@@ -60,8 +38,8 @@ def create_user(user_data, current_user):
         encrypted_temp_password = encrypt_data("0")
         
         cursor.execute('''
-            INSERT INTO Users (username, password_hash, first_name, last_name, role, registration_date, temp_password)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
+            INSERT INTO Users (username, password_hash, first_name, last_name, role, registration_date, temp_password, username_index)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
         ''', (
             encrypted_username,
             user_data['password_hash'],
@@ -69,10 +47,12 @@ def create_user(user_data, current_user):
             encrypted_last_name,
             encrypted_role,
             encrypted_registration_date,
-            encrypted_temp_password
+            encrypted_temp_password,
+            username_index
         ))
         
         conn.commit()
+        notify_account_changed()
         
         log_action(current_user, f"Created new {user_data['role']} user: {user_data['username']}")
         
@@ -252,27 +232,22 @@ def list_service_engineers(current_user):
         print(f"Error listing service engineers: {e}")
 
 def delete_user_by_id(user_id, current_user, allowed_role=None):
+    conn = None
     try:
-        conn = get_connection()
-        cursor = conn.cursor()
+        context = get_authorization_context(current_user)
+        if not context:
+            print("ERROR: No active session found.")
+            return False
         
-        cursor.execute('SELECT username, role FROM Users WHERE id = ?', (user_id,))
-        user_info = cursor.fetchone()
+        user_info = context.get_user(user_id)
         
         if not user_info:
             print(f"No user found with ID {user_id}")
             return False
         
-        username, role = user_info
+        decrypted_username, decrypted_role = user_info
         
-        try:
-            decrypted_username = decrypt_data(username)
-            decrypted_role = decrypt_data(role)
-        except:
-            decrypted_username = username
-            decrypted_role = role
-        
-        if decrypted_username == 'super_admin' or username == 'super_admin':
+        if decrypted_username == 'super_admin':
             print(f"No user found with ID {user_id}")
             log_action(current_user, f"Attempted to delete super_admin - BLOCKED")
             return False
@@ -282,27 +257,18 @@ def delete_user_by_id(user_id, current_user, allowed_role=None):
             log_action(current_user, f"Attempted to delete {decrypted_role} user {decrypted_username} - BLOCKED (wrong role)")
             return False
         
-        if current_user != 'super_admin' and decrypted_role == 'System Admin':
-            current_user_id = get_current_user_id(current_user)
-            if user_id != current_user_id:
-                try:
-                    decrypted_username = decrypt_data(username)
-                except:
-                    decrypted_username = username
-                
-                print(f"No user found with ID {user_id}")
-                log_action(current_user, f"Attempted to delete System Admin {decrypted_username} - BLOCKED (insufficient privileges)")
-                return False
+        if not context.can_manage_user(user_id):
+            print(f"No user found with ID {user_id}")
+            log_action(current_user, f"Attempted to delete {decrypted_role} {decrypted_username} - BLOCKED (insufficient privileges)")
+            return False
         
+        conn = get_connection()
+        cursor = conn.cursor()
         cursor.execute('DELETE FROM Users WHERE id = ?', (user_id,))
         
         if cursor.rowcount > 0:
-            try:
-                decrypted_username = decrypt_data(username)
-            except:
-                decrypted_username = username
-            
             conn.commit()
+            notify_account_changed()
             log_action(current_user, f"Deleted {decrypted_role} user: {decrypted_username}")
             print(f"User {decrypted_username} ({decrypted_role}) deleted successfully!")
             return True
@@ -318,74 +284,49 @@ def delete_user_by_id(user_id, current_user, allowed_role=None):
 
 def validate_user_exists_with_role(user_id, required_role):
     try:
-        conn = get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('SELECT username, role FROM Users WHERE id = ?', (user_id,))
-        user_info = cursor.fetchone()
-        
-        if not user_info:
-            print(f"No user found with ID {user_id}")
-            return False, None, None
-        
-        username, role = user_info
-        try:
-            decrypted_role = decrypt_data(role)
-        except:
-            decrypted_role = role
+        user_info = lookup_user(user_id)
         
-        if decrypted_role != required_role:
+        if not user_info or user_info[1] != required_role:
             print(f"No user found with ID {user_id}")
             return False, None, None
         
-        return True, username, decrypted_role
+        return True, user_info[0], user_info[1]
         
     except Exception as e:
         print(f"Error validating user: {e}")
         return False, None, None
-    finally:
-        close_connection(conn)
 
 def update_user_by_id(user_id, update_data, current_user, role):
     from database import get_connection, close_connection
-    from encryption import encrypt_data, decrypt_data
+    from encryption import encrypt_data, decrypt_data, blind_index
     
     try:
+        context = get_authorization_context(current_user)
+        if not context:
+            print("ERROR: No active session found.")
+            return False, None
+        
         conn = get_connection()
         cursor = conn.cursor()
         
-        cursor.execute('SELECT id, username, role FROM Users WHERE id = ?', (user_id,))
-        user = cursor.fetchone()
+        user = context.get_user(user_id)
         
-        if not user:
+        if not user or user[1] != role:
             print(f"No user found with ID {user_id}")
             return False, None
         
-        try:
-            decrypted_user_role = decrypt_data(user[2])
-        except:
-            decrypted_user_role = user[2]
-        
-        if decrypted_user_role != role:
+        if not context.can_manage_user(user_id):
             print(f"No user found with ID {user_id}")
+            log_action(current_user, f"Attempted to update {user[1]} {user[0]} - BLOCKED (insufficient privileges)")
             return False, None
         
         if 'username' in update_data:
             new_username = update_data['username']
             
-            cursor.execute('SELECT id, username FROM Users WHERE id != ?', (user_id,))
-            all_users = cursor.fetchall()
-            
-            for existing_id, existing_username in all_users:
-                try:
-                    decrypted_username = decrypt_data(existing_username)
-                    if decrypted_username.lower() == new_username.lower():
-                        print(f"ERROR: Username '{new_username}' is already taken.")
-                        return False, None
-                except:
-                    if existing_username.lower() == new_username.lower():
-                        print(f"ERROR: Username '{new_username}' is already taken.")
-                        return False, None
+            cursor.execute('SELECT id FROM Users WHERE username_index = ? AND id != ?', (blind_index(new_username), user_id))
+            if cursor.fetchone():
+                print(f"ERROR: Username '{new_username}' is already taken.")
+                return False, None
         
         set_clauses = []
         values = []
@@ -394,6 +335,8 @@ def update_user_by_id(user_id, update_data, current_user, role):
             if field == 'username':
                 set_clauses.append('username = ?')
                 values.append(encrypt_data(value))
+                set_clauses.append('username_index = ?')
+                values.append(blind_index(value))
             elif field == 'first_name':
                 set_clauses.append('first_name = ?')
                 values.append(encrypt_data(value))
@@ -410,6 +353,7 @@ def update_user_by_id(user_id, update_data, current_user, role):
         
         cursor.execute(query, values)
         conn.commit()
+        notify_account_changed()
         
         new_username = None
         if 'username' in update_data:
@@ -457,19 +401,13 @@ def reset_user_password(user_id, current_user):
         conn = get_connection()
         cursor = conn.cursor()
 
-        cursor.execute('SELECT username, role FROM Users WHERE id = ?', (user_id,))
-        user_info = cursor.fetchone()
+        user_info = lookup_user(user_id)
         
         if not user_info:
             print(f"No user found with ID {user_id}")
             return False
         
-        username, role = user_info
-        
-        try:
-            decrypted_role = decrypt_data(role)
-        except:
-            decrypted_role = role
+        decrypted_username, decrypted_role = user_info
         
         temp_password = generate_temporary_password()
         
@@ -486,11 +424,6 @@ def reset_user_password(user_id, current_user):
         if cursor.rowcount > 0:
             conn.commit()
             
-            try:
-                decrypted_username = decrypt_data(username)
-            except:
-                decrypted_username = username
-            
             log_action(current_user, f"Reset password for {decrypted_role}: {decrypted_username}")
             
             print(f"Password reset successfully for {decrypted_username} ({decrypted_role})")
@@ -507,6 +440,91 @@ def reset_user_password(user_id, current_user):
     finally:
         close_connection(conn)
 
+def bulk_reset_passwords(target_role, current_user, credentials_file=None):
+    from authentication import hash_passwords
+    
+    conn = None
+    try:
+        start = time.perf_counter()
+        conn = get_connection()
+        cursor = conn.cursor()
+        cursor.execute('SELECT id, username, role FROM Users')
+        
+        targets = []
+        for user_id, username, role in cursor.fetchall():
+            decrypted_username = decrypt_data(username) or username
+            if (decrypt_data(role) or role) == target_role and decrypted_username != 'super_admin':
+                targets.append((user_id, decrypted_username))
+        
+        if not targets:
+            print(f"No {target_role} users found")
+            return None
+        
+        temp_passwords = [generate_temporary_password() for _ in targets]
+        selected = time.perf_counter()
+        
+        hashed_passwords = hash_passwords(temp_passwords)
+        hashed = time.perf_counter()
+        
+        encrypted_temp_password = encrypt_data("1")
+        cursor.executemany('''
+            UPDATE Users 
+            SET password_hash = ?, temp_password = ?
+            WHERE id = ?
+        ''', [(hashed_password, encrypted_temp_password, user_id)
+              for hashed_password, (user_id, _) in zip(hashed_passwords, targets)])
+        conn.commit()
+        notify_account_changed()
+        written = time.perf_counter()
+        
+        if credentials_file is None:
+            credentials_file = f"password_reset_{datetime.now().strftime('%Y%m%d_%H%M%S')}.enc"
+        credentials = "\n".join(f"{username},{temp_password}" for (_, username), temp_password in zip(targets, temp_passwords))
+        fd = os.open(credentials_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w') as f:
+            f.write(encrypt_data(credentials))
+        finished = time.perf_counter()
+        
+        log_action(current_user, f"Bulk reset passwords for {len(targets)} {target_role} users", f"Credentials file: {credentials_file}")
+        
+        print(f"Reset {len(targets)} {target_role} passwords in {finished - start:.2f}s")
+        print(f"  Select and generate: {selected - start:.2f}s")
+        print(f"  Hash:                {hashed - selected:.2f}s")
+        print(f"  Update:              {written - hashed:.2f}s")
+        print(f"  Write credentials:   {finished - written:.2f}s")
+        print(f" Users must change password on next login!")
+        return credentials_file
+        
+    except Exception as e:
+        if conn:
+            conn.rollback()
+        print(f"ERROR resetting passwords: {e}")
+        return None
+    finally:
+        close_connection(conn)
+
+def read_reset_credentials(credentials_file):
+    with open(credentials_file, 'r') as f:
+        credentials = decrypt_data(f.read())
+    return [tuple(line.split(',', 1)) for line in credentials.splitlines() if line]
+
+def list_reset_credential_files():
+    return sorted((name for name in os.listdir('.') if name.startswith('password_reset_') and name.endswith('.enc')), reverse=True)
+
+def export_reset_credentials(credentials_file, current_user):
+    try:
+        credentials = read_reset_credentials(credentials_file)
+        export_file = credentials_file[:-len('.enc')] + '.csv'
+        fd = os.open(export_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w') as f:
+            f.write("username,temporary_password\n")
+            f.writelines(f"{username},{temp_password}\n" for username, temp_password in credentials)
+        log_action(current_user, "Exported bulk reset credentials", f"File: {credentials_file}, export: {export_file}")
+        return export_file
+    except Exception as e:
+        print(f"ERROR exporting reset credentials: {e}")
+        return None
+
 def update_user_password(username, new_password_hash, current_user):
     try:
         conn = get_connection()
@@ -1,6 +1,12 @@
 import sqlite3
 import os
-from encryption import encrypt_data, decrypt_data
+import time
+from encryption import encrypt_data, decrypt_data, blind_index
+
+RESTORE_CODE_TTL = 24 * 60 * 60
+BLIND_INDEX_VERSION = 2
+
+wal_autocheckpoint = None
 
 def initialize_db(): 
     db_path = 'urban_mobility.db'
@@ -20,7 +26,8 @@ def initialize_db():
         last_name TEXT,
         role TEXT NOT NULL,
         registration_date TEXT,
-        temp_password BOOLEAN DEFAULT 0
+        temp_password BOOLEAN DEFAULT 0,
+        username_index TEXT
     )
     ''')
     
@@ -76,22 +83,14 @@ def initialize_db():
     )
     ''')
 
+    migrate_database(cursor)
+    conn.commit()
+
     from encryption import encrypt_data
     from datetime import datetime
     
-    cursor.execute('SELECT username FROM Users')
-    all_usernames = cursor.fetchall()
-    admin_already_exists = False
-    for (username,) in all_usernames:
-        try:
-            decrypted = decrypt_data(username)
-            if decrypted == 'super_admin':
-                admin_already_exists = True
-                break
-        except:
-            if username == 'super_admin':
-                admin_already_exists = True
-                break
+    cursor.execute('SELECT id FROM Users WHERE username_index = ?', (blind_index('super_admin'),))
+    admin_already_exists = cursor.fetchone() is not None
 
     if not admin_already_exists:
         import bcrypt
@@ -106,9 +105,9 @@ def initialize_db():
         encrypted_temp_password = encrypt_data("0")
         
         cursor.execute('''
-        INSERT INTO Users (username, password_hash, role, first_name, last_name, registration_date, temp_password)
-        VALUES (?, ?, ?, ?, ?, ?, ?)
-        ''', (encrypted_username, super_admin_password, encrypted_role, encrypted_first_name, encrypted_last_name, encrypted_registration_date, encrypted_temp_password))
+        INSERT INTO Users (username, password_hash, role, first_name, last_name, registration_date, temp_password, username_index)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (encrypted_username, super_admin_password, encrypted_role, encrypted_first_name, encrypted_last_name, encrypted_registration_date, encrypted_temp_password, blind_index('super_admin')))
         
         conn.commit()
     
@@ -119,18 +118,197 @@ def initialize_db():
         if not admin_already_exists:
             print("Super Admin account created")
 
+def migrate_database(cursor):
+    cursor.execute('PRAGMA journal_mode=WAL')
+
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS Sessions (
+        session_id TEXT PRIMARY KEY,
+        username_index TEXT NOT NULL,
+        username TEXT NOT NULL,
+        role TEXT NOT NULL,
+        login_time REAL NOT NULL,
+        last_activity REAL NOT NULL,
+        expires REAL NOT NULL
+    )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_sessions_expires ON Sessions(expires)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_sessions_username_index ON Sessions(username_index)')
+
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS SessionState (
+        key TEXT PRIMARY KEY,
+        value INTEGER NOT NULL
+    )
+    ''')
+
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS LoginThrottle (
+        bucket_key TEXT PRIMARY KEY,
+        tokens REAL NOT NULL,
+        updated REAL NOT NULL,
+        failed_attempts INTEGER DEFAULT 0
+    )
+    ''')
+    cursor.execute('PRAGMA table_info(LoginThrottle)')
+    if 'last_failure' not in [column[1] for column in cursor.fetchall()]:
+        cursor.execute('ALTER TABLE LoginThrottle ADD COLUMN last_failure REAL')
+
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS ApiTokens (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        token_index TEXT UNIQUE NOT NULL,
+        token_hash TEXT NOT NULL,
+        salt TEXT NOT NULL,
+        name TEXT NOT NULL,
+        scopes TEXT NOT NULL,
+        issued_by TEXT NOT NULL,
+        created REAL NOT NULL,
+        expires REAL NOT NULL,
+        revoked BOOLEAN DEFAULT 0
+    )
+    ''')
+
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS Backups (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        filename TEXT UNIQUE NOT NULL,
+        created REAL NOT NULL,
+        size INTEGER NOT NULL,
+        duration REAL NOT NULL,
+        type TEXT NOT NULL,
+        origin TEXT NOT NULL
+    )
+    ''')
+    cursor.execute('PRAGMA table_info(Backups)')
+    backup_columns = [column[1] for column in cursor.fetchall()]
+    for column in ('sha256', 'parent', 'contents'):
+        if column not in backup_columns:
+            cursor.execute(f'ALTER TABLE Backups ADD COLUMN {column} TEXT')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_backups_created ON Backups(created)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_backups_origin ON Backups(origin, created)')
+
+    cursor.execute('PRAGMA table_info(RestoreCodes)')
+    restore_code_columns = [column[1] for column in cursor.fetchall()]
+    if 'backup_id' not in restore_code_columns:
+        cursor.execute('ALTER TABLE RestoreCodes ADD COLUMN backup_id INTEGER REFERENCES Backups(id)')
+
+    cursor.execute('PRAGMA table_info(Users)')
+    user_columns = [column[1] for column in cursor.fetchall()]
+    if 'username_index' not in user_columns:
+        cursor.execute('ALTER TABLE Users ADD COLUMN username_index TEXT')
+    migrate_blind_indexes(cursor, 'expires' in restore_code_columns)
+    cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_users_username_index ON Users(username_index)')
+
+    cursor.execute("INSERT OR IGNORE INTO SessionState (key, value) VALUES ('accounts', random())")
+    for event in ('INSERT', 'DELETE', 'UPDATE OF username, username_index, role'):
+        trigger_name = 'users_' + event.split()[0].lower() + '_generation'
+        cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS {trigger_name} AFTER {event} ON Users
+        BEGIN
+            UPDATE SessionState SET value = random() WHERE key = 'accounts';
+        END
+        ''')
+
+    if 'expires' not in restore_code_columns:
+        cursor.execute('ALTER TABLE RestoreCodes ADD COLUMN admin_id INTEGER REFERENCES Users(id)')
+        cursor.execute('ALTER TABLE RestoreCodes ADD COLUMN expires REAL')
+        migrate_restore_codes(cursor)
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_restore_codes_admin ON RestoreCodes(admin_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_restore_codes_expires ON RestoreCodes(expires)')
+
+def migrate_username_indexes(cursor, reindex_all):
+    if reindex_all:
+        cursor.execute('UPDATE Users SET username_index = NULL')
+    cursor.execute('SELECT id, username FROM Users WHERE username_index IS NULL')
+    accounts = {}
+    for user_id, username in cursor.fetchall():
+        decrypted_username = decrypt_data(username) or username
+        accounts.setdefault(blind_index(decrypted_username), []).append((user_id, decrypted_username))
+    
+    collisions = []
+    for username_index, users in accounts.items():
+        cursor.execute('SELECT id, username FROM Users WHERE username_index = ?', (username_index,))
+        users = [(user_id, decrypt_data(username) or username) for user_id, username in cursor.fetchall()] + users
+        if len(users) > 1:
+            collisions.append(users)
+            continue
+        cursor.execute('UPDATE Users SET username_index = ? WHERE id = ?', (username_index, users[0][0]))
+    
+    if collisions:
+        print("WARNING: These accounts have usernames that differ only in case:")
+        for users in collisions:
+            print("  " + ", ".join(f"{username} (ID {user_id})" for user_id, username in users))
+        print("They cannot log in until a Super Admin renames all but one account in each group and the application is restarted.")
+    return collisions
+
+def migrate_blind_indexes(cursor, restore_codes_hashed):
+    cursor.execute("SELECT value FROM SessionState WHERE key = 'blind_index_version'")
+    row = cursor.fetchone()
+    upgrading = row is None or row[0] < BLIND_INDEX_VERSION
+    migrate_username_indexes(cursor, upgrading)
+    if not upgrading:
+        return
+    
+    cursor.execute('SELECT session_id, username FROM Sessions')
+    for session_id, username in cursor.fetchall():
+        cursor.execute('UPDATE Sessions SET username_index = ? WHERE session_id = ?', (blind_index(decrypt_data(username) or username), session_id))
+    if restore_codes_hashed:
+        cursor.execute('DELETE FROM RestoreCodes WHERE used = 0')
+        if cursor.rowcount > 0:
+            print(f"{cursor.rowcount} outstanding restore codes were invalidated by the key upgrade; issue new ones")
+    cursor.execute('''
+    INSERT INTO SessionState (key, value) VALUES ('blind_index_version', ?)
+    ON CONFLICT(key) DO UPDATE SET value = excluded.value
+    ''', (BLIND_INDEX_VERSION,))
+
+def migrate_restore_codes(cursor):
+    expires = time.time() + RESTORE_CODE_TTL
+    cursor.execute('SELECT id, code, system_admin_username, used FROM RestoreCodes')
+    for code_id, code, admin_username, used in cursor.fetchall():
+        cursor.execute('SELECT id FROM Users WHERE username_index = ?', (blind_index(decrypt_data(admin_username)),))
+        admin = cursor.fetchone()
+        cursor.execute('''
+        UPDATE RestoreCodes SET code = ?, used = ?, admin_id = ?, expires = ? WHERE id = ?
+        ''', (
+            blind_index(decrypt_data(code), "restore_code"),
+            1 if decrypt_data(str(used)) in ("1", "True") else 0,
+            admin[0] if admin else None,
+            expires,
+            code_id
+        ))
+
+def upgrade_database():
+    conn = get_connection()
+    if not conn:
+        return False
+    try:
+        migrate_database(conn.cursor())
+        conn.commit()
+        return True
+    except sqlite3.Error as e:
+        print(f"Database upgrade error: {e}")
+        return False
+    finally:
+        close_connection(conn)
+
+def get_database_path():
+    if os.path.exists('src/urban_mobility.db'):
+        return 'src/urban_mobility.db'
+    elif os.path.exists('urban_mobility.db'):
+        return 'urban_mobility.db'
+    return 'src/urban_mobility.db'
+
+def set_wal_autocheckpoint(pages):
+    global wal_autocheckpoint
+    wal_autocheckpoint = pages
+
 def get_connection():
     try:
-        import os
-        if os.path.exists('src/urban_mobility.db'):
-            db_path = 'src/urban_mobility.db'
-        elif os.path.exists('urban_mobility.db'):
-            db_path = 'urban_mobility.db'
-        else:
-            db_path = 'src/urban_mobility.db' 
-        
-        conn = sqlite3.connect(db_path, timeout=30.0)
+        conn = sqlite3.connect(get_database_path(), timeout=30.0)
         conn.execute('PRAGMA busy_timeout=30000')
+        if wal_autocheckpoint is not None:
+            conn.execute(f'PRAGMA wal_autocheckpoint={int(wal_autocheckpoint)}')
         return conn
     except sqlite3.OperationalError as e:
         print(f"Database connection error: {e}")
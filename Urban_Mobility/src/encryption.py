@@ -1,5 +1,9 @@
 from cryptography.fernet import Fernet
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
 import base64
+import hashlib
+import hmac
 import os
 
 def get_or_create_key():
@@ -17,6 +21,31 @@ def get_or_create_key():
 
 key = get_or_create_key()
 cipher_suite = Fernet(key)
+subkeys = {}
+
+def reload_key():
+    global key, cipher_suite
+    current_key = get_or_create_key()
+    if current_key == key:
+        return False
+    key = current_key
+    cipher_suite = Fernet(key)
+    subkeys.clear()
+    return True
+
+def derive_subkey(purpose):
+    current_key = key
+    subkey = subkeys.get((current_key, purpose))
+    if subkey is None:
+        hkdf = HKDF(algorithm=hashes.SHA256(), length=32, salt=None, info=f"urban_mobility:{purpose}".encode('utf-8'))
+        subkey = subkeys[(current_key, purpose)] = hkdf.derive(base64.urlsafe_b64decode(current_key))
+    return subkey
+
+def keyed_hash(purpose, message):
+    return hmac.new(derive_subkey(purpose), message, hashlib.sha256).hexdigest()
+
+def legacy_keyed_hash(message):
+    return hmac.new(key, message, hashlib.sha256).hexdigest()
 
 def encrypt_data(data):
     if not data:
@@ -50,3 +79,11 @@ def encrypt_log_entry(log_entry):
 
 def decrypt_log_entry(encrypted_log):
     return decrypt_data(encrypted_log)
+
+def blind_index(value, purpose="username", fold_case=True):
+    value = str(value).lower() if fold_case else str(value)
+    return keyed_hash(f"blind_index:{purpose}", value.encode('utf-8'))
+
+def legacy_blind_index(value, purpose="username", fold_case=True):
+    value = str(value).lower() if fold_case else str(value)
+    return legacy_keyed_hash(f"{purpose}:{value}".encode('utf-8'))
@@ -1,16 +1,20 @@
 import sys
-from system_logging import log_action
+from system_logging import log_action, get_audit_logger
 from datetime import datetime
 
+error_logger = get_audit_logger('errors')
+
 def handle_exception(username, context, exception, show_details=False):
     error_type = type(exception).__name__
     error_message = str(exception)
 
-    log_action(
-        username, 
-        f"System error in {context}", 
-        f"Type: {error_type}, Message: {error_message}", 
-        suspicious=False
+    error_logger.error(
+        "System error in %s", context,
+        extra={
+            'username': username,
+            'additional_info': f"Type: {error_type}, Message: {error_message}",
+            'suspicious': False
+        }
     )
     
     print("\n" + "="*60)
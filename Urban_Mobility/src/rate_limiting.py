@@ -0,0 +1,180 @@
+import atexit
+import threading
+import time
+from database import get_connection, close_connection
+from encryption import blind_index
+
+USER_BUCKET_CAPACITY = 5
+USER_REFILL_PER_SECOND = 1 / 60
+GLOBAL_BUCKET_CAPACITY = 60
+GLOBAL_REFILL_PER_SECOND = 1
+PERSIST_INTERVAL = 30
+FAILED_ATTEMPT_WINDOW = 15 * 60
+THROTTLE_IDLE_SECONDS = USER_BUCKET_CAPACITY / USER_REFILL_PER_SECOND
+GLOBAL_BUCKET_KEY = "*"
+
+class TokenBucket:
+
+    __slots__ = ('capacity', 'refill_rate', 'tokens', 'updated')
+
+    def __init__(self, capacity, refill_rate, tokens=None, updated=None):
+        self.capacity = capacity
+        self.refill_rate = refill_rate
+        self.tokens = capacity if tokens is None else tokens
+        self.updated = time.time() if updated is None else updated
+
+    def refill(self, now):
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.refill_rate)
+            self.updated = now
+
+    def has_token(self, now):
+        self.refill(now)
+        return self.tokens >= 1
+
+    def consume(self, now):
+        if self.has_token(now):
+            self.tokens -= 1
+            return True
+        return False
+
+    def reset(self, now):
+        self.tokens = self.capacity
+        self.updated = now
+
+buckets = {}
+failed_attempts = {}
+throttled_attempts = {}
+dirty_keys = set()
+throttle_lock = threading.Lock()
+state_loaded = False
+last_persisted = 0.0
+
+def new_bucket(key, tokens=None, updated=None):
+    if key == GLOBAL_BUCKET_KEY:
+        return TokenBucket(GLOBAL_BUCKET_CAPACITY, GLOBAL_REFILL_PER_SECOND, tokens, updated)
+    return TokenBucket(USER_BUCKET_CAPACITY, USER_REFILL_PER_SECOND, tokens, updated)
+
+def load_throttle_state():
+    global state_loaded, last_persisted
+    state_loaded = True
+    last_persisted = time.time()
+
+    conn = get_connection()
+    if not conn:
+        return
+    try:
+        cursor = conn.cursor()
+        cursor.execute('SELECT bucket_key, tokens, updated, failed_attempts, last_failure FROM LoginThrottle')
+        for bucket_key, tokens, updated, failures, last_failure in cursor.fetchall():
+            buckets[bucket_key] = new_bucket(bucket_key, tokens, updated)
+            if failures:
+                failed_attempts[bucket_key] = (failures, last_failure or updated)
+    except Exception as e:
+        print(f"Error loading login throttle state: {e}")
+    finally:
+        close_connection(conn)
+
+def expire_failed_attempts(key, now):
+    entry = failed_attempts.get(key)
+    if entry and now - entry[1] >= FAILED_ATTEMPT_WINDOW:
+        del failed_attempts[key]
+        return None
+    return entry
+
+def persist_throttle_state():
+    global last_persisted
+    now = last_persisted = time.time()
+
+    with throttle_lock:
+        for key in list(failed_attempts):
+            expire_failed_attempts(key, now)
+        for key in list(buckets):
+            bucket = buckets[key]
+            bucket.refill(now)
+            if bucket.tokens >= bucket.capacity and key not in failed_attempts:
+                del buckets[key]
+                throttled_attempts.pop(key, None)
+        rows = []
+        for key in dirty_keys:
+            if key not in buckets and key not in failed_attempts:
+                continue
+            bucket = buckets.get(key) or new_bucket(key, updated=now)
+            failures, last_failure = failed_attempts.get(key, (0, None))
+            rows.append((key, bucket.tokens, bucket.updated, failures, last_failure))
+        dirty_keys.clear()
+
+    conn = get_connection()
+    if not conn:
+        return
+    try:
+        cursor = conn.cursor()
+        cursor.executemany('''
+            INSERT INTO LoginThrottle (bucket_key, tokens, updated, failed_attempts, last_failure)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(bucket_key) DO UPDATE SET tokens = excluded.tokens, updated = excluded.updated,
+                failed_attempts = excluded.failed_attempts, last_failure = excluded.last_failure
+        ''', rows)
+        cursor.execute('''
+            DELETE FROM LoginThrottle
+            WHERE updated < ? AND (last_failure IS NULL OR last_failure < ?)
+        ''', (now - THROTTLE_IDLE_SECONDS, now - FAILED_ATTEMPT_WINDOW))
+        conn.commit()
+    except Exception as e:
+        print(f"Error saving login throttle state: {e}")
+    finally:
+        close_connection(conn)
+
+def persist_throttle_state_if_due(now):
+    if now - last_persisted >= PERSIST_INTERVAL:
+        persist_throttle_state()
+
+def allow_login_attempt(username):
+    if not state_loaded:
+        load_throttle_state()
+
+    now = time.time()
+    user_key = blind_index(username)
+
+    with throttle_lock:
+        global_bucket = buckets.get(GLOBAL_BUCKET_KEY)
+        if global_bucket is None:
+            global_bucket = buckets[GLOBAL_BUCKET_KEY] = new_bucket(GLOBAL_BUCKET_KEY)
+        user_bucket = buckets.get(user_key)
+        if user_bucket is None:
+            user_bucket = buckets[user_key] = new_bucket(user_key)
+
+        allowed = user_bucket.has_token(now) and global_bucket.has_token(now)
+        dirty_keys.update((user_key, GLOBAL_BUCKET_KEY))
+        if allowed:
+            user_bucket.consume(now)
+            global_bucket.consume(now)
+            throttled_attempts.pop(user_key, None)
+            throttled_count = 0
+        else:
+            throttled_count = throttled_attempts[user_key] = throttled_attempts.get(user_key, 0) + 1
+
+    persist_throttle_state_if_due(now)
+    return allowed, throttled_count
+
+def record_login_result(username, success):
+    now = time.time()
+    user_key = blind_index(username)
+
+    with throttle_lock:
+        dirty_keys.add(user_key)
+        if success:
+            failed_attempts.pop(user_key, None)
+            if user_key in buckets:
+                buckets[user_key].reset(now)
+            return 0
+
+        failures, _ = expire_failed_attempts(user_key, now) or (0, now)
+        failed_attempts[user_key] = (failures + 1, now)
+        return failures + 1
+
+def shutdown_throttle():
+    if state_loaded:
+        persist_throttle_state()
+
+atexit.register(shutdown_throttle)
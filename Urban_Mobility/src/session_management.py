@@ -1,39 +1,115 @@
 import time
+import heapq
 import secrets
 import hashlib
-from datetime import datetime, timedelta
+import os
+import threading
+from datetime import datetime
 from system_logging import log_action
 
 SESSION_TIMEOUT = 1800
 MAX_SESSION_DURATION = 7200
 MAX_INVALID_ATTEMPTS = 5
+SWEEP_INTERVAL = 30
+SESSION_PERSIST_INTERVAL = 60
+SESSION_EXPIRY_GRACE = 30
+ACCOUNT_GENERATION_TTL = 1.0
+SESSION_BACKEND = os.environ.get('UM_SESSION_BACKEND', 'memory')
+WALL_CLOCK_OFFSET = time.time() - time.monotonic()
+MANAGED_ROLES = {
+    'Super Admin': ('System Admin', 'Service Engineer'),
+    'System Admin': ('Service Engineer',)
+}
 
-sessions = {}
+user_cache = {}
+role_counts = None
+user_cache_generation = None
+account_generation_cache = None
+
+class AuthorizationContext:
+    
+    __slots__ = ('user_id', 'username', 'role')
+    
+    def __init__(self, user_id, username, role):
+        self.user_id = user_id
+        self.username = username
+        self.role = role
+    
+    def has_role(self, *roles):
+        return self.role in roles
+    
+    def is_self(self, user_id):
+        return self.user_id is not None and self.user_id == user_id
+    
+    def get_user(self, user_id):
+        return lookup_user(user_id)
+    
+    def get_user_role(self, user_id):
+        user = lookup_user(user_id)
+        return user[1] if user else None
+    
+    def can_manage_user(self, user_id):
+        return self.is_self(user_id) or self.get_user_role(user_id) in MANAGED_ROLES.get(self.role, ())
 
 class Session:
     
+    __slots__ = (
+        'username', 'role', 'session_id', 'login_monotonic', 'last_activity_monotonic', 'idle_deadline', 'persisted_activity',
+        'invalid_attempts', 'suspicious_activity', 'validated_generation', 'synced_generation', 'authorization'
+    )
+    
     def __init__(self, username, role):
         self.username = username
         self.role = role
         self.session_id = self._generate_session_id()
-        self.login_time = datetime.now()
-        self.last_activity = datetime.now()
-        self.is_active = True
+        self.login_monotonic = time.monotonic()
         self.invalid_attempts = 0
         self.suspicious_activity = 0
+        self.validated_generation = None
+        self.synced_generation = None
+        self.authorization = None
+        self.update_activity(self.login_monotonic)
+        self.persisted_activity = self.last_activity_monotonic
     
     def _generate_session_id(self):
         return secrets.token_urlsafe(32)
     
-    def update_activity(self):
-        self.last_activity = datetime.now()
+    def update_activity(self, now=None):
+        self.last_activity_monotonic = now or time.monotonic()
+        self.idle_deadline = min(self.last_activity_monotonic + SESSION_TIMEOUT, self.absolute_deadline)
+    
+    def expiry_deadline(self):
+        return self.idle_deadline
+    
+    @property
+    def absolute_deadline(self):
+        return self.login_monotonic + MAX_SESSION_DURATION
+    
+    @property
+    def login_timestamp(self):
+        return self.wall_time(self.login_monotonic)
+    
+    @property
+    def login_time(self):
+        return datetime.fromtimestamp(self.login_timestamp)
     
-    def is_expired(self):
-        if (datetime.now() - self.last_activity).seconds > SESSION_TIMEOUT:
-            return True, "Session expired due to inactivity"
-        if (datetime.now() - self.login_time).seconds > MAX_SESSION_DURATION:
+    def wall_time(self, monotonic_value):
+        return WALL_CLOCK_OFFSET + monotonic_value
+    
+    @property
+    def last_activity(self):
+        return datetime.fromtimestamp(self.wall_time(self.last_activity_monotonic))
+    
+    def duration(self):
+        return int(time.monotonic() - self.login_monotonic)
+    
+    def is_expired(self, now=None):
+        now = now or time.monotonic()
+        if now < self.idle_deadline:
+            return False, "Session valid"
+        if now >= self.absolute_deadline:
             return True, "Session expired due to maximum duration"
-        return False, "Session valid"
+        return True, "Session expired due to inactivity"
     
     def add_invalid_attempt(self):
         self.invalid_attempts += 1
@@ -48,71 +124,315 @@ class Session:
         return False, f"Suspicious activity {self.suspicious_activity}/3"
     
     def get_session_info(self):
-        time_remaining = SESSION_TIMEOUT - (datetime.now() - self.last_activity).seconds
-        max_time_remaining = MAX_SESSION_DURATION - (datetime.now() - self.login_time).seconds
+        now = time.monotonic()
+        login_monotonic = self.login_monotonic
+        time_remaining = self.idle_deadline - now
+        max_time_remaining = login_monotonic + MAX_SESSION_DURATION - now
         
         return {
             'username': self.username,
             'role': self.role,
             'session_id': self.session_id[:8] + "...",
-            'login_time': self.login_time,
-            'last_activity': self.last_activity,
-            'time_remaining': max(0, time_remaining),
-            'max_time_remaining': max(0, max_time_remaining),
+            'login_time': datetime.fromtimestamp(WALL_CLOCK_OFFSET + login_monotonic),
+            'last_activity': datetime.fromtimestamp(WALL_CLOCK_OFFSET + self.last_activity_monotonic),
+            'time_remaining': int(time_remaining) if time_remaining > 0 else 0,
+            'max_time_remaining': int(max_time_remaining) if max_time_remaining > 0 else 0,
             'invalid_attempts': self.invalid_attempts,
             'suspicious_activity': self.suspicious_activity
         }
 
-def create_session(username, role):
-    if username in sessions:
+class SessionStore:
+    
+    def __init__(self):
+        self.by_id = {}
+        self.by_username = {}
+        self.expiry_heap = []
+        self.lock = threading.RLock()
+    
+    def __len__(self):
+        return len(self.by_id)
+    
+    def add(self, session):
+        with self.lock:
+            self.by_id[session.session_id] = session
+            self.by_username[session.username] = session
+            self.schedule(session)
+    
+    def schedule(self, session):
+        heapq.heappush(self.expiry_heap, (session.expiry_deadline(), session.session_id))
+        if len(self.expiry_heap) > 4 * len(self.by_id) + 64:
+            self.expiry_heap = [(active.expiry_deadline(), session_id) for session_id, active in self.by_id.items()]
+            heapq.heapify(self.expiry_heap)
+    
+    def touch(self, session):
+        with self.lock:
+            session.update_activity()
+            if session.session_id in self.by_id:
+                self.schedule(session)
+    
+    def get_by_id(self, session_id):
+        return self.by_id.get(session_id)
+    
+    def get_by_username(self, username):
+        return self.by_username.get(username)
+    
+    def forget(self, session):
+        with self.lock:
+            self.by_id.pop(session.session_id, None)
+            if self.by_username.get(session.username) is session:
+                del self.by_username[session.username]
+    
+    def remove(self, session):
+        self.forget(session)
+    
+    def rename(self, old_username, new_username):
+        with self.lock:
+            session = self.by_username.pop(old_username, None)
+            if session:
+                session.username = new_username
+                self.by_username[new_username] = session
+            return session
+    
+    def pop_expired(self, now=None):
+        now = now or time.monotonic()
+        expired = {}
+        with self.lock:
+            while self.expiry_heap and self.expiry_heap[0][0] <= now:
+                deadline, session_id = heapq.heappop(self.expiry_heap)
+                session = self.by_id.get(session_id)
+                if session and session.expiry_deadline() <= now:
+                    expired[session_id] = session
+        return list(expired.values())
+    
+    def first_active(self):
+        with self.lock:
+            return next(iter(self.by_id.values()), None)
+    
+    def sync(self, session):
+        return True, False
+    
+    def bump_generation(self):
+        pass
+    
+    def republish(self):
+        pass
+    
+    def remove_remote(self, session_id):
+        return None
+    
+    def list_active(self):
+        with self.lock:
+            return [
+                {'session_id': session.session_id, 'username': session.username, 'role': session.role,
+                 'login_time': session.login_time, 'last_activity': session.last_activity}
+                for session in self.by_id.values()
+            ]
+
+class SqliteSessionStore(SessionStore):
+    
+    def __init__(self):
+        super().__init__()
+        self.last_cleanup = 0.0
+    
+    def execute(self, query, params=(), fetch=False):
+        from database import get_connection, close_connection
+        conn = get_connection()
+        try:
+            cursor = conn.cursor()
+            cursor.execute(query, params)
+            if fetch:
+                return cursor.fetchall()
+            conn.commit()
+            return cursor.rowcount
+        finally:
+            close_connection(conn)
+    
+    def read_generation(self):
+        rows = self.execute("SELECT value FROM SessionState WHERE key = 'generation'", fetch=True)
+        return rows[0][0] if rows else 0
+    
+    def bump_generation(self):
+        self.execute("INSERT INTO SessionState (key, value) VALUES ('generation', 1) ON CONFLICT(key) DO UPDATE SET value = value + 1")
+    
+    def persist(self, session):
+        from encryption import encrypt_data, blind_index
+        session.persisted_activity = session.last_activity_monotonic
+        self.execute('''
+            INSERT OR REPLACE INTO Sessions (session_id, username_index, username, role, login_time, last_activity, expires)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', (
+            session.session_id,
+            blind_index(session.username),
+            encrypt_data(session.username),
+            encrypt_data(session.role),
+            session.login_timestamp,
+            session.wall_time(session.last_activity_monotonic),
+            session.wall_time(session.idle_deadline)
+        ))
+    
+    def add(self, session):
+        super().add(session)
+        self.persist(session)
+        self.bump_generation()
+    
+    def touch(self, session):
+        super().touch(session)
+        if session.last_activity_monotonic - session.persisted_activity >= SESSION_PERSIST_INTERVAL:
+            self.execute('UPDATE Sessions SET last_activity = ?, expires = ? WHERE session_id = ?', (
+                session.wall_time(session.last_activity_monotonic), session.wall_time(session.idle_deadline), session.session_id
+            ))
+            session.persisted_activity = session.last_activity_monotonic
+    
+    def remove(self, session):
+        self.forget(session)
+        self.execute('DELETE FROM Sessions WHERE session_id = ?', (session.session_id,))
+        self.bump_generation()
+    
+    def republish(self):
+        with self.lock:
+            local_sessions = list(self.by_id.values())
+        for session in local_sessions:
+            self.persist(session)
+        self.bump_generation()
+    
+    def rename(self, old_username, new_username):
+        session = super().rename(old_username, new_username)
+        if session:
+            self.persist(session)
+            self.bump_generation()
+        return session
+    
+    def remove_remote(self, session_id):
+        from encryption import decrypt_data
+        rows = self.execute('SELECT username FROM Sessions WHERE session_id = ?', (session_id,), fetch=True)
+        if not rows:
+            return None
+        self.execute('DELETE FROM Sessions WHERE session_id = ?', (session_id,))
+        self.bump_generation()
+        return decrypt_data(rows[0][0])
+    
+    def sync(self, session):
+        generation = self.read_generation()
+        if generation == session.synced_generation:
+            return True, False
+        
+        rows = self.execute('SELECT 1 FROM Sessions WHERE session_id = ?', (session.session_id,), fetch=True)
+        session.synced_generation = generation
+        return bool(rows), True
+    
+    def pop_expired(self, now=None):
+        expired = super().pop_expired(now)
+        wall_now = time.time()
+        if wall_now - self.last_cleanup >= SWEEP_INTERVAL:
+            self.last_cleanup = wall_now
+            cutoff = wall_now - SESSION_PERSIST_INTERVAL - SESSION_EXPIRY_GRACE
+            if self.execute('DELETE FROM Sessions WHERE expires < ?', (cutoff,)):
+                self.bump_generation()
+        return expired
+    
+    def list_active(self):
+        from encryption import decrypt_data
+        rows = self.execute('''
+            SELECT session_id, username, role, login_time, last_activity
+            FROM Sessions
+            WHERE expires > ?
+            ORDER BY login_time
+        ''', (time.time(),), fetch=True)
+        return [
+            {'session_id': session_id, 'username': decrypt_data(username), 'role': decrypt_data(role),
+             'login_time': datetime.fromtimestamp(login_time), 'last_activity': datetime.fromtimestamp(last_activity)}
+            for session_id, username, role, login_time, last_activity in rows
+        ]
+
+def create_session_store():
+    if SESSION_BACKEND == 'sqlite':
+        return SqliteSessionStore()
+    return SessionStore()
+
+sessions = create_session_store()
+sweeper_stop = threading.Event()
+sweeper_thread = None
+
+def sweep_expired_sessions():
+    expired = sessions.pop_expired()
+    for session in expired:
+        _, reason = session.is_expired()
+        terminate_session_by_id(session.session_id, reason)
+    return len(expired)
+
+def session_sweeper_loop():
+    while not sweeper_stop.wait(SWEEP_INTERVAL):
+        try:
+            sweep_expired_sessions()
+        except Exception as e:
+            print(f"Error sweeping sessions: {e}")
+
+def start_session_sweeper():
+    global sweeper_thread
+    if sweeper_thread is None or not sweeper_thread.is_alive():
+        sweeper_stop.clear()
+        sweeper_thread = threading.Thread(target=session_sweeper_loop, name="session-sweeper", daemon=True)
+        sweeper_thread.start()
+
+def stop_session_sweeper():
+    sweeper_stop.set()
+
+def create_session(username, role, user_id=None):
+    if sessions.get_by_username(username):
         terminate_session(username, "New session created")
     
     session = Session(username, role)
-    sessions[session.session_id] = session
-    sessions[username] = session
+    session.authorization = AuthorizationContext(user_id or get_current_user_id(username), username, role)
+    sessions.add(session)
+    start_session_sweeper()
     
     log_action(username, "Session created", f"Session ID: {session.session_id[:16]}..., Login time: {session.login_time}, Role: {role}")
     return session
 
 def get_session_by_username(username):
-    return sessions.get(username)
+    return sessions.get_by_username(username)
 
 def get_session_by_id(session_id):
-    return sessions.get(session_id)
+    return sessions.get_by_id(session_id)
 
 def get_any_active_session():
-    for session in sessions.values():
-        if isinstance(session, Session):
-            is_expired, _ = session.is_expired()
-            if not is_expired:
-                return session
-    return None
+    sweep_expired_sessions()
+    return sessions.first_active()
 
 def check_session(username):
     session = get_session_by_username(username)
     if not session:
         return False, "No active session"
     
-    if not user_exists_in_database(username):
-        terminate_session(username, "User account no longer exists in database")
-        return False, "User account no longer exists in database"
+    still_active, shared_state_changed = sessions.sync(session)
+    if not still_active:
+        sessions.forget(session)
+        log_action(username, "Session terminated", "Reason: Session revoked by another process")
+        return False, "Session revoked by another process"
+    if shared_state_changed:
+        session.validated_generation = None
+    
+    current_generation = read_account_generation()
+    if current_generation is None or session.validated_generation != current_generation:
+        if not user_exists_in_database(username):
+            terminate_session(username, "User account no longer exists in database")
+            return False, "User account no longer exists in database"
+        session.validated_generation = current_generation
     
     is_expired, reason = session.is_expired()
     if is_expired:
         terminate_session(username, reason)
         return False, reason
     
-    session.update_activity()
+    sessions.touch(session)
     return True, "Session valid"
 
 def terminate_session(username, reason="User logout"):
-    if username in sessions:
-        session = sessions[username]
-        if session.session_id in sessions:
-            del sessions[session.session_id]
-        del sessions[username]
+    session = sessions.get_by_username(username)
+    if session:
+        sessions.remove(session)
         
-        duration = (datetime.now() - session.login_time).seconds
+        duration = session.duration()
         log_action(username, "Session terminated", f"Reason: {reason}, Duration: {duration}s, Invalid attempts: {session.invalid_attempts}, Suspicious activities: {session.suspicious_activity}")
         return True
     return False
@@ -121,14 +441,16 @@ def terminate_session_by_id(session_id, reason="Session terminated"):
     session = get_session_by_id(session_id)
     if session:
         username = session.username
-        if session.session_id in sessions:
-            del sessions[session.session_id]
-        if username in sessions:
-            del sessions[username]
+        sessions.remove(session)
         
-        duration = (datetime.now() - session.login_time).seconds
+        duration = session.duration()
         log_action(username, "Session terminated", f"Reason: {reason}, Duration: {duration}s")
         return True
+    
+    username = sessions.remove_remote(session_id)
+    if username:
+        log_action(username, "Session terminated", f"Reason: {reason}, Session ID: {session_id[:16]}...")
+        return True
     return False
 
 def get_session_info(username):
@@ -172,78 +494,145 @@ def handle_suspicious_activity(username, activity_description):
     
     return False, message
 
-def update_session_username(old_username, new_username):
-    if old_username in sessions:
-        session = sessions[old_username]
-        session.username = new_username
-        
-        sessions[new_username] = session
-        del sessions[old_username]
-        
-        log_action(new_username, "Username updated in session", f"Changed from {old_username} to {new_username}")
+def read_account_generation():
+    global account_generation_cache
+    now = time.monotonic()
+    cached = account_generation_cache
+    if cached and now - cached[1] < ACCOUNT_GENERATION_TTL:
+        return cached[0]
+    
+    from database import get_connection, close_connection
+    try:
+        conn = get_connection()
+        try:
+            row = conn.execute("SELECT value FROM SessionState WHERE key = 'accounts'").fetchone()
+        finally:
+            close_connection(conn)
+    except Exception as e:
+        print(f"Error reading account generation: {e}")
+        return None
+    account_generation_cache = (row[0], now) if row else None
+    return row[0] if row else None
+
+def invalidate_account_generation():
+    global account_generation_cache
+    account_generation_cache = None
+
+def notify_account_changed():
+    from database import get_connection, close_connection
+    try:
+        conn = get_connection()
+        try:
+            conn.execute("INSERT INTO SessionState (key, value) VALUES ('accounts', random()) ON CONFLICT(key) DO UPDATE SET value = random()")
+            conn.commit()
+        finally:
+            close_connection(conn)
+    except Exception as e:
+        print(f"Error updating account generation: {e}")
+    invalidate_account_generation()
+    sessions.bump_generation()
+
+def list_active_sessions():
+    return sessions.list_active()
+
+def republish_sessions():
+    invalidate_account_generation()
+    sessions.republish()
+
+def get_authorization_context(username):
+    session = get_session_by_username(username)
+    if session:
+        return session.authorization
+    return None
+
+def require_role(username, *roles):
+    context = get_authorization_context(username)
+    if context and context.has_role(*roles):
         return True
+    
+    log_action(username, "Unauthorized operation attempt - BLOCKED", f"Required role: {' or '.join(roles)}", suspicious=True)
     return False
 
+def refresh_user_cache():
+    global role_counts, user_cache_generation
+    current_generation = read_account_generation()
+    if current_generation is None or user_cache_generation != current_generation:
+        user_cache.clear()
+        role_counts = None
+        user_cache_generation = current_generation
 
-def user_exists_in_database(username):
+def lookup_user(user_id):
+    refresh_user_cache()
+    if user_id in user_cache:
+        return user_cache[user_id]
+    
+    from database import get_connection, close_connection
+    from encryption import decrypt_data
+    
+    conn = get_connection()
     try:
+        cursor = conn.cursor()
+        cursor.execute('SELECT username, role FROM Users WHERE id = ?', (user_id,))
+        row = cursor.fetchone()
+    finally:
+        close_connection(conn)
+    
+    user = None
+    if row:
+        username, role = row
+        user = (decrypt_data(username) or username, decrypt_data(role) or role)
+    user_cache[user_id] = user
+    return user
+
+def get_role_counts():
+    global role_counts
+    refresh_user_cache()
+    if role_counts is None:
         from database import get_connection, close_connection
         from encryption import decrypt_data
         
         conn = get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('SELECT username FROM Users')
-        all_usernames = cursor.fetchall()
-        
-        for (db_username,) in all_usernames:
-            try:
-                decrypted_username = decrypt_data(db_username)
-                if decrypted_username.lower() == username.lower():
-                    close_connection(conn)
-                    return True
-            except:
-                if db_username == 'super_admin' and username == 'super_admin':
-                    close_connection(conn)
-                    return True
-                if db_username.lower() == username.lower():
-                    close_connection(conn)
-                    return True
-        
-        close_connection(conn)
-        return False
+        try:
+            cursor = conn.cursor()
+            cursor.execute('SELECT role FROM Users')
+            roles = cursor.fetchall()
+        finally:
+            close_connection(conn)
         
-    except Exception as e:
-        print(f"Error checking if user exists: {e}")
-        return False
+        counts = {}
+        for (role,) in roles:
+            decrypted_role = decrypt_data(role) or role
+            counts[decrypted_role] = counts.get(decrypted_role, 0) + 1
+        role_counts = counts
+    return role_counts
+
+def update_session_username(old_username, new_username):
+    session = sessions.get_by_username(old_username)
+    if session and session.authorization:
+        session.authorization.username = new_username
+    if sessions.rename(old_username, new_username):
+        log_action(new_username, "Username updated in session", f"Changed from {old_username} to {new_username}")
+        return True
+    return False
+
+
+def user_exists_in_database(username):
+    return get_current_user_id(username) is not None
 
 def get_current_user_id(username):
     try:
         from database import get_connection, close_connection
-        from encryption import decrypt_data
+        from encryption import blind_index
         
         conn = get_connection()
         cursor = conn.cursor()
         
-        cursor.execute('SELECT id, username FROM Users')
-        all_users = cursor.fetchall()
-        
-        for existing_id, existing_username in all_users:
-            try:
-                decrypted_username = decrypt_data(existing_username)
-                if decrypted_username.lower() == username.lower():
-                    close_connection(conn)
-                    return existing_id
-            except:
-                if existing_username.lower() == username.lower():
-                    close_connection(conn)
-                    return existing_id
+        cursor.execute('SELECT id FROM Users WHERE username_index = ?', (blind_index(username),))
+        user = cursor.fetchone()
         
         close_connection(conn)
-        return None
+        return user[0] if user else None
         
     except Exception as e:
         print(f"Error getting user ID: {e}")
         return None
-
-
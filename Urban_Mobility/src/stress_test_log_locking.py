@@ -0,0 +1,70 @@
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+DEFAULT_PROCESSES = 8
+DEFAULT_ENTRIES_PER_PROCESS = 250
+
+def write_entries(worker, entries, start_event):
+    from system_logging import log_action
+    start_event.wait()
+    for i in range(entries):
+        log_action(f"worker{worker}", "Stress test entry", f"entry {i}")
+
+def read_log_numbers():
+    from system_logging import encrypted_log_file, split_log_line
+    from encryption import decrypt_log_entry
+    numbers = []
+    with open(encrypted_log_file, 'r', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                encrypted_entry, _ = split_log_line(line)
+                numbers.append(int(decrypt_log_entry(encrypted_entry).split()[1]))
+    return numbers
+
+def run_stress_test(processes, entries):
+    context = multiprocessing.get_context('spawn')
+    start_event = context.Event()
+    workers = [context.Process(target=write_entries, args=(worker, entries, start_event)) for worker in range(processes)]
+    for process in workers:
+        process.start()
+
+    time.sleep(1)
+    started = time.perf_counter()
+    start_event.set()
+    for process in workers:
+        process.join()
+    elapsed = time.perf_counter() - started
+
+    failed = [process.exitcode for process in workers if process.exitcode != 0]
+    if failed:
+        raise SystemExit(f"FAIL: {len(failed)} writer processes exited with errors")
+
+    numbers = read_log_numbers()
+    expected = processes * entries
+    duplicates = len(numbers) - len(set(numbers))
+    missing = sorted(set(range(1, expected + 1)) - set(numbers))
+    out_of_order = sum(1 for previous, current in zip(numbers, numbers[1:]) if current != previous + 1)
+
+    print(f"Writers: {processes} processes x {entries} entries")
+    print(f"Entries written: {len(numbers)} of {expected}")
+    print(f"Duplicates: {duplicates}, missing: {len(missing)}, out of order: {out_of_order}")
+    print(f"Throughput: {len(numbers) / elapsed:.0f} entries/s ({elapsed:.2f}s)")
+
+    from system_logging import verify_log_integrity
+    result = verify_log_integrity(full_scan=True)
+    print(f"Chain verification: {result['message']} ({result['entries_checked']} entries)")
+
+    if len(numbers) != expected or duplicates or missing or out_of_order or not result['valid']:
+        raise SystemExit("FAIL: log sequence numbers are not contiguous")
+    print("PASS")
+
+if __name__ == '__main__':
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    processes = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_PROCESSES
+    entries = int(sys.argv[2]) if len(sys.argv) > 2 else DEFAULT_ENTRIES_PER_PROCESS
+    with tempfile.TemporaryDirectory(prefix='log_stress_') as work_dir:
+        os.chdir(work_dir)
+        run_stress_test(processes, entries)
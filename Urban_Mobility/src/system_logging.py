@@ -1,59 +1,236 @@
 import logging
+import logging.handlers
+import atexit
+import queue
+import sys
+import threading
 from datetime import datetime
-from encryption import encrypt_log_entry, decrypt_log_entry
+import encryption
+from encryption import encrypt_log_entry, decrypt_log_entry, encrypt_data, decrypt_data
 import os
 import re
 import json
+import hashlib
+import hmac
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from functools import lru_cache
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
 
 encrypted_log_file = 'encrypted_logs.txt'
+log_index_file = 'encrypted_logs.idx'
+log_stats_file = 'log_stats.dat'
+log_stats_journal_file = 'log_stats.journal'
+log_lock_file = 'encrypted_logs.lock'
 
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(message)s',
-    handlers=[
-        logging.StreamHandler()
-    ]
-)
+LOG_CHAIN_GENESIS = "0" * 64
+LOG_CHAIN_HMAC_PREFIX = "h2:"
+LOG_CHAIN_LEGACY_HMAC_PREFIX = "h1:"
+LOG_CHECKPOINT_INTERVAL = 100
+LOG_STATS_COMPACT_BYTES = 256 * 1024
+
+AUDIT_LOGGER_NAME = 'urban_mobility.audit'
+
+log_write_lock = threading.RLock()
+
+@contextmanager
+def log_file_lock():
+    with log_write_lock:
+        if fcntl is None:
+            yield
+            return
+        
+        with open(log_lock_file, 'a') as lock_handle:
+            fcntl.flock(lock_handle.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_handle.fileno(), fcntl.LOCK_UN)
+
+def split_log_line(line):
+    parts = line.strip().split(' ')
+    if len(parts) == 2:
+        return parts[0], parts[1]
+    return parts[0], None
+
+def compute_chain_hash(previous_hash, encrypted_entry):
+    message = f"{previous_hash}{encrypted_entry}".encode('utf-8')
+    return LOG_CHAIN_HMAC_PREFIX + encryption.keyed_hash("log_chain", message)
+
+def compute_legacy_keyed_chain_hash(previous_hash, encrypted_entry):
+    message = f"{previous_hash}{encrypted_entry}".encode('utf-8')
+    return LOG_CHAIN_LEGACY_HMAC_PREFIX + encryption.legacy_keyed_hash(message)
+
+def compute_legacy_chain_hash(previous_hash, encrypted_entry):
+    return hashlib.sha256(f"{previous_hash}{encrypted_entry}".encode('utf-8')).hexdigest()
+
+def chain_hash_level(chain_hash):
+    if chain_hash.startswith(LOG_CHAIN_HMAC_PREFIX):
+        return 2
+    if chain_hash.startswith(LOG_CHAIN_LEGACY_HMAC_PREFIX):
+        return 1
+    return 0
+
+def read_last_log_line():
+    if not os.path.exists(encrypted_log_file):
+        return ""
+    
+    with open(encrypted_log_file, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        position = f.tell()
+        block = b""
+        while position > 0:
+            step = min(4096, position)
+            position -= step
+            f.seek(position)
+            block = f.read(step) + block
+            if b'\n' in block.rstrip(b'\r\n'):
+                break
+    
+    lines = block.rstrip(b'\r\n').split(b'\n')
+    return lines[-1].decode('utf-8').strip() if lines else ""
+
+def count_log_lines():
+    if not os.path.exists(encrypted_log_file):
+        return 0
+    with open(encrypted_log_file, 'r', encoding='utf-8') as f:
+        return sum(1 for line in f if line.strip())
 
 def get_next_log_number():
     try:
-        if not os.path.exists(encrypted_log_file):
+        last_line = read_last_log_line()
+        if not last_line:
             return 1
         
-        with open(encrypted_log_file, 'r', encoding='utf-8') as f:
-            lines = f.readlines()
-            if not lines:
-                return 1
-            
-            last_line = lines[-1].strip()
-            if last_line:
-                decrypted = decrypt_log_entry(last_line)
-                if decrypted and decrypted.startswith('No.'):
-                    try:
-                        last_number = int(decrypted.split()[0].split('.')[1])
-                        return last_number + 1
-                    except:
-                        return len(lines) + 1
-            return len(lines) + 1
+        encrypted_entry, _ = split_log_line(last_line)
+        decrypted = decrypt_log_entry(encrypted_entry)
+        if decrypted and decrypted.startswith('No.'):
+            try:
+                last_number = int(decrypted.split()[1])
+                return last_number + 1
+            except:
+                return count_log_lines() + 1
+        return count_log_lines() + 1
     except:
         return 1
 
+def get_last_chain_hash():
+    last_line = read_last_log_line()
+    if not last_line:
+        return LOG_CHAIN_GENESIS
+    _, chain_hash = split_log_line(last_line)
+    return chain_hash or LOG_CHAIN_GENESIS
+
 def log_action(username, action, additional_info="", suspicious=False):
     timestamp = datetime.now()
     date_str = timestamp.strftime("%d-%m-%Y")
     time_str = timestamp.strftime("%H:%M:%S")
     
-    log_number = get_next_log_number()
+    with log_file_lock():
+        log_number = get_next_log_number()
+        
+        log_entry = f"No. {log_number} {date_str} {time_str} {username} {action}"
+        if additional_info:
+            log_entry += f" {additional_info}"
+        log_entry += f" {'Yes' if suspicious else 'No'}"
+        
+        encrypted_entry = encrypt_log_entry(log_entry)
+        chain_hash = compute_chain_hash(get_last_chain_hash(), encrypted_entry)
+        
+        with open(encrypted_log_file, 'ab') as f:
+            f.write(f"{encrypted_entry} {chain_hash}\n".encode('utf-8'))
+            end_offset = f.tell()
+        
+        if log_number % LOG_CHECKPOINT_INTERVAL == 0:
+            add_log_checkpoint(log_number, end_offset, chain_hash)
+        
+        update_log_stats(log_number, date_str, username, categorize_log_entry(action, additional_info), suspicious)
+
+class EncryptedAuditHandler(logging.Handler):
     
-    log_entry = f"No. {log_number} {date_str} {time_str} {username} {action}"
-    if additional_info:
-        log_entry += f" {additional_info}"
-    log_entry += f" {'Yes' if suspicious else 'No'}"
+    def emit(self, record):
+        try:
+            username = getattr(record, 'username', 'system')
+            additional_info = getattr(record, 'additional_info', '')
+            suspicious = getattr(record, 'suspicious', False)
+            log_action(username, record.getMessage(), additional_info, suspicious)
+        except Exception:
+            self.handleError(record)
+
+audit_queue = queue.Queue(-1)
+audit_handler = EncryptedAuditHandler(logging.INFO)
+audit_listener = logging.handlers.QueueListener(audit_queue, audit_handler, respect_handler_level=True)
+
+audit_logger = logging.getLogger(AUDIT_LOGGER_NAME)
+audit_logger.setLevel(logging.INFO)
+audit_logger.addHandler(logging.handlers.QueueHandler(audit_queue))
+audit_logger.propagate = False
+
+def get_audit_logger(name=None):
+    if name:
+        return logging.getLogger(f"{AUDIT_LOGGER_NAME}.{name}")
+    return audit_logger
+
+class ThreadOutputRouter:
+    
+    def __init__(self, stream):
+        self.stream = stream
+        self.routes = {}
+        self.pending = {}
+    
+    def write(self, text):
+        thread_id = threading.get_ident()
+        logger = self.routes.get(thread_id)
+        if logger is None:
+            return self.stream.write(text)
+        
+        lines = (self.pending.pop(thread_id, "") + text).split("\n")
+        if lines[-1]:
+            self.pending[thread_id] = lines[-1]
+        for line in lines[:-1]:
+            if line.strip():
+                logger.info(line.strip())
+        return len(text)
     
-    encrypted_entry = encrypt_log_entry(log_entry)
+    def flush(self):
+        self.stream.flush()
     
-    with open(encrypted_log_file, 'a', encoding='utf-8') as f:
-        f.write(encrypted_entry + '\n')
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+@contextmanager
+def audit_thread_output(name):
+    if not isinstance(sys.stdout, ThreadOutputRouter):
+        sys.stdout = ThreadOutputRouter(sys.stdout)
+    router = sys.stdout
+    thread_id = threading.get_ident()
+    router.routes[thread_id] = get_audit_logger(name)
+    try:
+        yield
+    finally:
+        router.routes.pop(thread_id, None)
+        router.pending.pop(thread_id, None)
+
+audit_listener_running = False
+
+def start_audit_logging():
+    global audit_listener_running
+    if not audit_listener_running:
+        audit_listener.start()
+        audit_listener_running = True
+
+def stop_audit_logging():
+    global audit_listener_running
+    if audit_listener_running:
+        audit_listener.stop()
+        audit_listener_running = False
+
+start_audit_logging()
+atexit.register(stop_audit_logging)
 
 def log_login_attempt(username, success=True, password_attempts=1):
     if success:
@@ -71,6 +248,319 @@ def log_login_attempt(username, success=True, password_attempts=1):
 def log_suspicious_activity(username, activity, details=""):
     log_action(username, f"Suspicious activity: {activity}", details, True)
 
+def categorize_log_entry(action, additional_info=""):
+    # Live entries and rebuilt ones must see the same text, so categorize the
+    # whitespace-normalised description exactly as it is stored in the log
+    description = " ".join(f"{action} {additional_info}".split())
+    if "Unsuccessful login" in description:
+        return "failed_login"
+    if "Logged in" in description:
+        return "login"
+    if "Input validation failed" in description:
+        return "validation_failure"
+    if "Session" in description:
+        return "session"
+    if "backup" in description.lower() or "restore" in description.lower():
+        return "backup"
+    if "Suspicious activity" in description:
+        return "suspicious_activity"
+    return "other"
+
+def empty_log_stats():
+    return {'entries': 0, 'last_entry': 0, 'days': {}, 'users': {}, 'categories': {}}
+
+def load_log_stats():
+    stats = empty_log_stats()
+    if os.path.exists(log_stats_file):
+        try:
+            with open(log_stats_file, 'r', encoding='utf-8') as f:
+                stats.update(json.loads(decrypt_data(f.read().strip())))
+        except:
+            stats = empty_log_stats()
+    
+    if os.path.exists(log_stats_journal_file):
+        with open(log_stats_journal_file, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    log_number, date_str, username, category, suspicious = json.loads(decrypt_data(line.strip()))
+                except:
+                    continue
+                if log_number > stats['last_entry']:
+                    add_to_log_stats(stats, date_str, username, category, suspicious)
+                    stats['last_entry'] = log_number
+    return stats
+
+def save_log_stats(stats):
+    temp_file = log_stats_file + '.tmp'
+    with open(temp_file, 'w', encoding='utf-8') as f:
+        f.write(encrypt_data(json.dumps(stats)))
+    os.replace(temp_file, log_stats_file)
+    if os.path.exists(log_stats_journal_file):
+        os.remove(log_stats_journal_file)
+
+def add_to_log_stats(stats, date_str, username, category, suspicious):
+    stats['entries'] += 1
+    
+    day = stats['days'].setdefault(date_str, {'total': 0, 'suspicious': 0, 'failed_login': 0})
+    day['total'] += 1
+    if suspicious:
+        day['suspicious'] += 1
+    if category == "failed_login":
+        day['failed_login'] += 1
+    
+    user = stats['users'].setdefault(username, {'total': 0, 'suspicious': 0})
+    user['total'] += 1
+    if suspicious:
+        user['suspicious'] += 1
+    
+    stats['categories'][category] = stats['categories'].get(category, 0) + 1
+
+def update_log_stats(log_number, date_str, username, category, suspicious):
+    try:
+        with open(log_stats_journal_file, 'a', encoding='utf-8') as f:
+            f.write(encrypt_data(json.dumps([log_number, date_str, username, category, suspicious])) + "\n")
+            journal_size = f.tell()
+        if journal_size >= LOG_STATS_COMPACT_BYTES:
+            save_log_stats(load_log_stats())
+    except Exception as e:
+        print(f"Error updating log statistics: {e}")
+
+def rebuild_log_stats():
+    with log_file_lock():
+        logs = get_logs()
+        if isinstance(logs, str):
+            logs = []
+        
+        stats = empty_log_stats()
+        for log in reversed(logs):
+            parts = log.split()
+            if len(parts) < 6 or parts[0] != "No.":
+                continue
+            date_str = parts[2]
+            username = parts[4]
+            suspicious = parts[-1] == "Yes"
+            add_to_log_stats(stats, date_str, username, categorize_log_entry(" ".join(parts[5:-1])), suspicious)
+            if parts[1].isdigit():
+                stats['last_entry'] = max(stats['last_entry'], int(parts[1]))
+        
+        save_log_stats(stats)
+        return stats
+
+def display_log_dashboard(days=7, top_users=5):
+    stats = load_log_stats()
+    
+    recent_days = sorted(stats['days'].items(), key=lambda item: datetime.strptime(item[0], "%d-%m-%Y"), reverse=True)[:days]
+    busiest_users = sorted(stats['users'].items(), key=lambda item: (item[1]['suspicious'], item[1]['total']), reverse=True)[:top_users]
+    
+    print("\n" + "=" * 60)
+    print("    ACTIVITY DASHBOARD")
+    print("=" * 60)
+    print(f"Total log entries: {stats['entries']}")
+    
+    print(f"\nLast {days} days with activity:")
+    print(f"{'Date':<12} {'Events':<10} {'Suspicious':<12} {'Failed logins':<14}")
+    print("-" * 60)
+    for date_str, day in recent_days:
+        print(f"{date_str:<12} {day['total']:<10} {day['suspicious']:<12} {day['failed_login']:<14}")
+    
+    print(f"\nTop {top_users} users by suspicious events:")
+    print(f"{'Username':<15} {'Events':<10} {'Suspicious':<12}")
+    print("-" * 60)
+    for username, user in busiest_users:
+        print(f"{username[:15]:<15} {user['total']:<10} {user['suspicious']:<12}")
+    
+    print("\nEvents by category:")
+    print("-" * 60)
+    for category, count in sorted(stats['categories'].items(), key=lambda item: item[1], reverse=True):
+        print(f"{category:<25} {count}")
+    print("=" * 60)
+
+def load_log_index():
+    default_index = {'checkpoints': [], 'verified': None}
+    if not os.path.exists(log_index_file):
+        return default_index
+    try:
+        with open(log_index_file, 'r') as f:
+            index = json.load(f)
+        index.setdefault('checkpoints', [])
+        index.setdefault('verified', None)
+        return index
+    except:
+        return default_index
+
+def save_log_index(index):
+    temp_file = log_index_file + '.tmp'
+    with open(temp_file, 'w') as f:
+        json.dump(index, f)
+    os.replace(temp_file, log_index_file)
+
+def reset_log_index():
+    if os.path.exists(log_index_file):
+        os.remove(log_index_file)
+
+def sign_log_checkpoint(entry_number, offset, chain_hash):
+    message = f"{entry_number}:{offset}:{chain_hash}".encode('utf-8')
+    return encryption.keyed_hash("log_checkpoint", message)
+
+def log_checkpoint_signature_valid(entry_number, offset, chain_hash, signature):
+    # Checkpoints written before per-purpose keys were signed with the raw key;
+    # they are re-signed the next time the log verifies cleanly
+    message = f"{entry_number}:{offset}:{chain_hash}".encode('utf-8')
+    return (hmac.compare_digest(sign_log_checkpoint(entry_number, offset, chain_hash), signature)
+            or hmac.compare_digest(encryption.legacy_keyed_hash(message), signature))
+
+def add_log_checkpoint(entry_number, offset, chain_hash):
+    try:
+        index = load_log_index()
+        index['checkpoints'].append({
+            'entry': entry_number,
+            'offset': offset,
+            'hash': chain_hash,
+            'signature': sign_log_checkpoint(entry_number, offset, chain_hash)
+        })
+        save_log_index(index)
+    except Exception as e:
+        print(f"Error writing log checkpoint: {e}")
+
+def read_log_hash_ending_at(offset):
+    if offset <= 0:
+        return LOG_CHAIN_GENESIS
+    
+    with open(encrypted_log_file, 'rb') as f:
+        start = max(0, offset - 4096)
+        f.seek(start)
+        block = f.read(offset - start)
+    
+    if not block.endswith(b'\n'):
+        return None
+    last_line = block.rstrip(b'\r\n').split(b'\n')[-1].decode('utf-8')
+    _, chain_hash = split_log_line(last_line)
+    return chain_hash
+
+def verify_log_segment(start_offset, end_offset, previous_hash, log_path=encrypted_log_file):
+    with open(log_path, 'rb') as f:
+        f.seek(start_offset)
+        data = f.read(end_offset - start_offset)
+    
+    checked = 0
+    position = start_offset
+    for raw_line in data.split(b'\n'):
+        line_offset = position
+        position += len(raw_line) + 1
+        line = raw_line.decode('utf-8').strip()
+        if not line:
+            continue
+        
+        encrypted_entry, stored_hash = split_log_line(line)
+        previous_level = chain_hash_level(previous_hash)
+        if stored_hash is None:
+            if previous_level:
+                return False, previous_hash, checked, f"Entry without chain hash at byte offset {line_offset}"
+            previous_hash = LOG_CHAIN_GENESIS
+            continue
+        
+        stored_level = chain_hash_level(stored_hash)
+        if stored_level < previous_level:
+            return False, previous_hash, checked, f"Downgraded chain hash at byte offset {line_offset}"
+        if stored_level == 2:
+            expected_hash = compute_chain_hash(previous_hash, encrypted_entry)
+        elif stored_level == 1:
+            expected_hash = compute_legacy_keyed_chain_hash(previous_hash, encrypted_entry)
+        else:
+            expected_hash = compute_legacy_chain_hash(previous_hash, encrypted_entry)
+        
+        if not hmac.compare_digest(expected_hash, stored_hash):
+            return False, previous_hash, checked, f"Hash chain broken at byte offset {line_offset}"
+        previous_hash = stored_hash
+        checked += 1
+    
+    return True, previous_hash, checked, ""
+
+def verify_log_integrity(full_scan=False):
+    try:
+        if not os.path.exists(encrypted_log_file):
+            return {'valid': True, 'entries_checked': 0, 'message': "No logs available"}
+        
+        file_size = os.path.getsize(encrypted_log_file)
+        index = load_log_index()
+        
+        for checkpoint in index['checkpoints']:
+            if not log_checkpoint_signature_valid(checkpoint['entry'], checkpoint['offset'], checkpoint['hash'], checkpoint.get('signature', '')):
+                return {'valid': False, 'entries_checked': 0, 'message': f"Checkpoint for entry {checkpoint['entry']} has an invalid signature"}
+            if checkpoint['offset'] > file_size:
+                return {'valid': False, 'entries_checked': 0, 'message': f"Log truncated before checkpoint entry {checkpoint['entry']}"}
+            if read_log_hash_ending_at(checkpoint['offset']) != checkpoint['hash']:
+                return {'valid': False, 'entries_checked': 0, 'message': f"Log modified at checkpoint entry {checkpoint['entry']}"}
+        
+        start_offset, start_hash = 0, LOG_CHAIN_GENESIS
+        verified = index.get('verified')
+        if verified:
+            if not log_checkpoint_signature_valid("verified", verified['offset'], verified['hash'], verified.get('signature', '')):
+                return {'valid': False, 'entries_checked': 0, 'message': "Verified log marker has an invalid signature"}
+            if verified['offset'] > file_size:
+                return {'valid': False, 'entries_checked': 0, 'message': f"Log truncated to {file_size} bytes after it was verified up to {verified['offset']}"}
+            if read_log_hash_ending_at(verified['offset']) != verified['hash']:
+                return {'valid': False, 'entries_checked': 0, 'message': f"Log modified before verified byte offset {verified['offset']}"}
+            if not full_scan:
+                start_offset, start_hash = verified['offset'], verified['hash']
+        
+        segments = []
+        segment_start, segment_hash = start_offset, start_hash
+        for checkpoint in index['checkpoints']:
+            if checkpoint['offset'] <= segment_start:
+                continue
+            segments.append((segment_start, checkpoint['offset'], segment_hash, checkpoint['hash']))
+            segment_start, segment_hash = checkpoint['offset'], checkpoint['hash']
+        if segment_start < file_size:
+            segments.append((segment_start, file_size, segment_hash, None))
+        
+        if len(segments) > 1:
+            with ProcessPoolExecutor() as executor:
+                results = list(executor.map(verify_log_segment, *zip(*[segment[:3] for segment in segments])))
+        else:
+            results = [verify_log_segment(*segment[:3]) for segment in segments]
+        
+        entries_checked = 0
+        last_hash = start_hash
+        for segment, (is_valid, last_hash, checked, message) in zip(segments, results):
+            entries_checked += checked
+            if not is_valid:
+                return {'valid': False, 'entries_checked': entries_checked, 'message': message}
+            if segment[3] is not None and last_hash != segment[3]:
+                return {'valid': False, 'entries_checked': entries_checked, 'message': f"Hash chain does not match checkpoint at byte offset {segment[1]}"}
+        
+        with log_file_lock():
+            index = load_log_index()
+            for checkpoint in index['checkpoints']:
+                if checkpoint['offset'] <= file_size and log_checkpoint_signature_valid(checkpoint['entry'], checkpoint['offset'], checkpoint['hash'], checkpoint.get('signature', '')):
+                    checkpoint['signature'] = sign_log_checkpoint(checkpoint['entry'], checkpoint['offset'], checkpoint['hash'])
+            index['verified'] = {
+                'offset': file_size,
+                'hash': last_hash,
+                'signature': sign_log_checkpoint("verified", file_size, last_hash)
+            }
+            save_log_index(index)
+        
+        return {'valid': True, 'entries_checked': entries_checked, 'message': "Log integrity verified"}
+    except Exception as e:
+        return {'valid': False, 'entries_checked': 0, 'message': f"Error verifying logs: {e}"}
+
+def display_log_integrity_report(username, full_scan=False):
+    result = verify_log_integrity(full_scan)
+    
+    if not result['valid']:
+        log_action(username, "Log integrity check failed", result['message'], suspicious=True)
+    
+    print("\n" + "=" * 60)
+    print("    LOG INTEGRITY CHECK")
+    print("=" * 60)
+    print(f"Mode: {'Full scan' if full_scan else 'Incremental'}")
+    print(f"Entries checked: {result['entries_checked']}")
+    print(f"Result: {'OK' if result['valid'] else 'FAILED'}")
+    print(f"Details: {result['message']}")
+    print("=" * 60)
+    return result['valid']
+
 
 
 
@@ -83,7 +573,8 @@ def get_logs():
         with open(encrypted_log_file, 'r', encoding='utf-8') as f:
             for line in f:
                 if line.strip():
-                    decrypted_log = decrypt_log_entry(line.strip())
+                    encrypted_entry, _ = split_log_line(line)
+                    decrypted_log = decrypt_log_entry(encrypted_entry)
                     if decrypted_log:
                         decrypted_logs.append(decrypted_log)
         
@@ -480,7 +971,8 @@ def get_current_username_from_session():
 def log_validation_failure(username, field_name, input_value, error_message, is_suspicious=False):
     truncated_input = input_value[:100] if len(input_value) > 100 else input_value
     
-    suspicious_flag = detect_suspicious_input(input_value, field_name)
+    matched_rule = scan_suspicious_input(input_value, field_name)
+    suspicious_flag = matched_rule is not None
     
     if "Max attempts" in error_message and "exceeded" in error_message:
         is_suspicious = True
@@ -489,36 +981,49 @@ def log_validation_failure(username, field_name, input_value, error_message, is_
         username = get_current_username_from_session()
     
     log_entry = f"Input validation failed - {error_message}"
+    if matched_rule:
+        log_entry += f" (rule: {matched_rule})"
     additional_info = f"Input: {truncated_input}"
     
     log_action(username, log_entry, additional_info, suspicious_flag or is_suspicious)
 
-def detect_suspicious_input(input_value, field_name="unknown"):
+SUSPICIOUS_INPUT_RULES = [
+    ("script_injection", r"<script|<iframe|<object|<embed|javascript:"),
+    ("event_handler", r"onload|onerror|onclick|onfocus"),
+    ("path_traversal", r"\.\./|\.\.\\|%2e%2e"),
+    ("null_byte", r"\\x00|\\0|%00|\\u0000"),
+]
+
+suspicious_input_pattern = re.compile(
+    "|".join(f"(?P<{name}>{pattern})" for name, pattern in SUSPICIOUS_INPUT_RULES),
+    re.IGNORECASE
+)
+
+QUOTE_ALLOWED_FIELDS = {'first_name', 'last_name', 'name'}
+QUOTE_FORBIDDEN_FIELDS = {'email', 'phone', 'zip_code', 'driving_license', 'serial_number'}
+
+def get_field_quote_policy(field_name):
+    if field_name in QUOTE_ALLOWED_FIELDS:
+        return False
+    return field_name in QUOTE_FORBIDDEN_FIELDS
+
+@lru_cache(maxsize=256)
+def scan_suspicious_input(input_value, field_name="unknown"):
     if "\x00" in input_value:
-        return True
+        return "raw_null_byte"
     
-    always_suspicious_patterns = [
-        r"(<script|<iframe|<object|<embed|javascript:)", 
-        r"(onload|onerror|onclick|onfocus)",
-        r"(\.\./|\.\.\\|%2e%2e)",
-        r"(\\x00|\\0|%00|\\u0000)",
-    ]
-    
-    for pattern in always_suspicious_patterns:
-        if re.search(pattern, input_value, re.IGNORECASE):
-            return True
+    match = suspicious_input_pattern.search(input_value)
+    if match:
+        return match.lastgroup
     
     if "'" in input_value or '"' in input_value:
-        if field_name in ['first_name', 'last_name', 'name']:
-            return False
-        
-        else:
-            if field_name in ['email', 'phone', 'zip_code', 'driving_license', 'serial_number']:
-                return True
-            
-            return False
+        if get_field_quote_policy(field_name):
+            return "quote_in_restricted_field"
     
-    return False
+    return None
+
+def detect_suspicious_input(input_value, field_name="unknown"):
+    return scan_suspicious_input(input_value, field_name) is not None
 
 def log_all_validation_attempts(username, field_name, input_value, is_valid, error_message=""):
     if username == "unknown":
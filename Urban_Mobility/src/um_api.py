@@ -0,0 +1,80 @@
+import os
+import sys
+from api_tokens import verify_api_token
+from crud_operations import list_scooters, list_travellers, update_scooter
+from system_logging import log_action, get_logs
+
+API_TOKEN_ENV = 'UM_API_TOKEN'
+API_SCOOTER_FIELDS = {'state_of_charge', 'latitude', 'longitude', 'mileage', 'out_of_service', 'last_maintenance_date'}
+
+def print_usage():
+    print(f"Usage: {API_TOKEN_ENV}=<token> python um_api.py <command>")
+    print("Commands:")
+    print("  scooters list                              (scooters:read)")
+    print("  scooters update <id> <field>=<value> ...   (scooters:write)")
+    print("  travellers list                            (travellers:read)")
+    print("  logs list [limit]                          (logs:read)")
+    print(f"Scooter fields: {', '.join(sorted(API_SCOOTER_FIELDS))}")
+
+def api_scooters_list(actor, args):
+    list_scooters()
+    return True
+
+def api_scooters_update(actor, args):
+    if len(args) < 2 or not args[0].isdigit():
+        print_usage()
+        return False
+
+    update_data = {}
+    for assignment in args[1:]:
+        field, _, value = assignment.partition('=')
+        if field not in API_SCOOTER_FIELDS or not value:
+            print(f"Invalid field assignment: {assignment}")
+            return False
+        update_data[field] = value
+    if not update_scooter(int(args[0]), update_data, actor):
+        return False
+    print(f"Scooter {args[0]} updated: {', '.join(update_data)}")
+    return True
+
+def api_travellers_list(actor, args):
+    log_action(actor, "Listed travellers through the API")
+    list_travellers()
+    return True
+
+def api_logs_list(actor, args):
+    limit = int(args[0]) if args and args[0].isdigit() else 50
+    logs = get_logs()
+    if isinstance(logs, str):
+        print(logs)
+        return False
+    for entry in logs[:limit]:
+        print(entry)
+    return True
+
+API_COMMANDS = {
+    ('scooters', 'list'): ('scooters:read', api_scooters_list),
+    ('scooters', 'update'): ('scooters:write', api_scooters_update),
+    ('travellers', 'list'): ('travellers:read', api_travellers_list),
+    ('logs', 'list'): ('logs:read', api_logs_list),
+}
+
+def run_api_command(token, argv):
+    command = API_COMMANDS.get(tuple(argv[:2]))
+    if command is None:
+        print_usage()
+        return 2
+
+    required_scope, handler = command
+    valid, result = verify_api_token(token, required_scope)
+    if not valid:
+        print(f"ERROR: {result}")
+        return 1
+    return 0 if handler(f"api_token:{result}", argv[2:]) else 1
+
+if __name__ == '__main__':
+    token = os.environ.get(API_TOKEN_ENV)
+    if not token:
+        print(f"ERROR: set {API_TOKEN_ENV} to an API token")
+        sys.exit(1)
+    sys.exit(run_api_command(token, sys.argv[1:]))
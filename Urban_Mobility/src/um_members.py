@@ -1,10 +1,11 @@
 import sys
 from database import initialize_db
-from authentication import login, change_password, logout_user
+from authentication import login, change_password, logout_user, calibrate_password_hashing_menu
 from session_management import check_session, display_session_info
 from error_handler import safe_execute
 from system_logging import log_action, get_unread_suspicious_count
-from backup import create_backup, generate_restore_code, restore_backup, list_backups, revoke_restore_code, list_restore_codes
+from backup_scheduler import start_backup_scheduler
+from backup import create_backup, generate_restore_code, restore_backup, list_backups, revoke_restore_code, list_restore_codes, reconcile_backup_catalog
 from crud_operations import *
 from input_validation import collector, validator
 
@@ -25,6 +26,8 @@ def main():
     print("=" * 60)
    
     initialize_db()
+    reconcile_backup_catalog(verify=False)
+    start_backup_scheduler()
     
     username, role = login()
     if not username:
@@ -88,10 +91,15 @@ def super_admin_menu(username):
         print("9.  List Restore Codes")
         print("10. View All Users")
         print("11. Restore Backup")
-        print("12. Logout")
+        print("12. Activity Dashboard")
+        print("13. Calibrate Password Hashing")
+        print("14. Manage API Tokens")
+        print("15. Active Sessions")
+        print("16. Point-in-Time Restore")
+        print("17. Logout")
         print("-" * 50)
         
-        choice = collector.get_menu_choice("Enter your choice (1-12): ", 12, username=username)
+        choice = collector.get_menu_choice("Enter your choice (1-17): ", 17, username=username)
         
         if choice is None:
             print("Menu input cancelled due to max attempts exceeded.")
@@ -108,7 +116,7 @@ def super_admin_menu(username):
         elif choice == 5:
             view_logs(username)
         elif choice == 6:
-            create_backup()
+            create_backup_menu(username)
         elif choice == 7:
             generate_restore_code_menu(username)
         elif choice == 8:
@@ -122,6 +130,18 @@ def super_admin_menu(username):
             if result == "force_logout":
                 return "logout"
         elif choice == 12:
+            activity_dashboard_menu(username)
+        elif choice == 13:
+            calibrate_password_hashing_menu(username)
+        elif choice == 14:
+            manage_api_tokens(username)
+        elif choice == 15:
+            active_sessions_menu(username)
+        elif choice == 16:
+            result = point_in_time_restore_menu(username)
+            if result == "force_logout":
+                return "logout"
+        elif choice == 17:
             if logout_user(username):
                 print("Successfully logged out.")
                 return "logout"
@@ -176,7 +196,7 @@ def system_admin_menu(username):
         elif choice == 7:
             view_logs(username)
         elif choice == 8:
-            create_backup()
+            create_backup_menu(username)
         elif choice == 9:
             result = restore_backup_menu(username)
             if result == "force_logout":
@@ -248,7 +268,7 @@ def manage_system_admins(username):
         elif choice == 2:
             update_system_admin_menu(username)
         elif choice == 3:
-            delete_system_admin()
+            delete_system_admin(username)
         elif choice == 4:
             reset_system_admin_password_menu()
         elif choice == 5:
@@ -256,6 +276,111 @@ def manage_system_admins(username):
         else:
             print("Invalid choice. Please try again.")
 
+def active_sessions_menu(username):
+    from session_management import list_active_sessions, terminate_session_by_id
+    
+    active_sessions = list_active_sessions()
+    
+    print("\n" + "=" * 80)
+    print("    ACTIVE SESSIONS")
+    print("=" * 80)
+    if not active_sessions:
+        print("No active sessions.")
+        return
+    
+    print(f"{'No.':<4} {'Username':<15} {'Role':<18} {'Login time':<20} {'Last activity':<20}")
+    print("-" * 80)
+    for i, info in enumerate(active_sessions, 1):
+        print(f"{i:<4} {info['username']:<15} {info['role']:<18} {info['login_time'].strftime('%Y-%m-%d %H:%M:%S'):<20} {info['last_activity'].strftime('%Y-%m-%d %H:%M:%S'):<20}")
+    print("-" * 80)
+    
+    choice = collector.get_validated_input(
+        f"Select a session to terminate (1-{len(active_sessions)}), or 0 to go back: ",
+        lambda x: (True, "Valid") if x.isdigit() and 0 <= int(x) <= len(active_sessions) else (False, f"Please enter a number between 0 and {len(active_sessions)}"),
+        f"Please enter a number between 0 and {len(active_sessions)}",
+        username=username,
+        field_name="session_choice"
+    )
+    if not choice or choice == "0":
+        return
+    
+    selected = active_sessions[int(choice) - 1]
+    if selected['username'] == username:
+        print("Use Logout to end your own session.")
+        return
+    
+    if terminate_session_by_id(selected['session_id'], f"Terminated by {username}"):
+        print(f"Session for {selected['username']} terminated.")
+    else:
+        print("Session no longer exists.")
+
+def manage_api_tokens(username):
+    from api_tokens import API_TOKEN_SCOPES, issue_api_token, list_api_tokens, revoke_api_token, purge_expired_api_tokens
+    from session_management import require_role
+    
+    if not require_role(username, "Super Admin"):
+        print("ERROR: Operation not permitted.")
+        return
+    
+    while True:
+        print("\n=== MANAGE API TOKENS ===")
+        print("1. Issue API Token")
+        print("2. List API Tokens")
+        print("3. Revoke API Token")
+        print("4. Purge Expired Tokens")
+        print("5. Back to Main Menu")
+        
+        choice = collector.get_menu_choice("Enter your choice (1-5): ", 5, username=username, field_name="api_token_menu_choice")
+        
+        if choice == 1:
+            name = collector.get_validated_input(
+                "Enter client name (e.g., Telemetry Feeder): ",
+                lambda x: (True, "Valid name") if 2 <= len(x) <= 30 and x.replace(' ', '').replace('-', '').isalnum() else (False, "Name must be 2-30 letters, digits, spaces or hyphens"),
+                "Name must be 2-30 letters, digits, spaces or hyphens",
+                username=username,
+                field_name="api_token_name"
+            )
+            if not name:
+                continue
+            
+            print(f"Available scopes: {', '.join(API_TOKEN_SCOPES)}")
+            scopes_input = input("Enter scopes separated by spaces: ")
+            scopes = scopes_input.split()
+            if not scopes or any(scope not in API_TOKEN_SCOPES for scope in scopes):
+                print(f"Scopes must be chosen from: {', '.join(API_TOKEN_SCOPES)}")
+                continue
+            
+            days = collector.get_validated_input(
+                "Valid for how many days (1-365): ",
+                lambda x: (True, "Valid") if x.isdigit() and 1 <= int(x) <= 365 else (False, "Please enter a number between 1 and 365"),
+                "Please enter a number between 1 and 365",
+                username=username,
+                field_name="api_token_days"
+            )
+            if not days:
+                continue
+            
+            result = issue_api_token(name, scopes, username, int(days))
+            if result:
+                token_id, token = result
+                print(f"\nAPI token {token_id} issued for {name}.")
+                print(f"Token: {token}")
+                print("Store this token now. It cannot be shown again.")
+        elif choice == 2:
+            list_api_tokens()
+        elif choice == 3:
+            token_id = get_validated_id("Enter API token ID to revoke: ", "API token", username)
+            if token_id:
+                revoke_api_token(int(token_id), username)
+        elif choice == 4:
+            removed = purge_expired_api_tokens()
+            log_action(username, "Purged expired API tokens", f"Removed: {removed}")
+            print(f"Removed {removed} expired API tokens.")
+        elif choice == 5:
+            break
+        else:
+            print("Invalid choice. Please try again.")
+
 def update_system_admin_menu(current_user):
     from crud_operations import list_system_admins, update_user_by_id
     from database import get_connection, close_connection
@@ -343,8 +468,7 @@ def update_system_admin_menu(current_user):
 
 def update_my_account_menu(current_user):
     from crud_operations import update_user_by_id
-    from database import get_connection, close_connection
-    from session_management import get_current_user_id
+    from session_management import get_authorization_context
     
     print("\n" + "=" * 60)
     print("    UPDATE MY ACCOUNT")
@@ -352,27 +476,14 @@ def update_my_account_menu(current_user):
     print("WARNING: This will update your account information!")
     print()
     
-    user_id = get_current_user_id(current_user)
+    context = get_authorization_context(current_user)
     
-    if not user_id:
+    if not context or not context.user_id:
         print("ERROR: Could not find your user account in session.")
         return current_user
     
-    from encryption import decrypt_data
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute('SELECT role FROM Users WHERE id = ?', (user_id,))
-    user_data = cursor.fetchone()
-    close_connection(conn)
-    
-    if not user_data:
-        print("ERROR: Could not find your user account in database.")
-        return current_user
-    
-    try:
-        user_role = decrypt_data(user_data[0])
-    except:
-        user_role = user_data[0]
+    user_id = context.user_id
+    user_role = context.role
     
     print("\n" + "=" * 50)
     print("    UPDATE MY ACCOUNT")
@@ -442,19 +553,25 @@ def manage_service_engineers(username):
         print("2. Update Service Engineer")
         print("3. Delete Service Engineer")
         print("4. Reset Password")
-        print("5. Back to Main Menu")
+        print("5. Reset All Passwords")
+        print("6. View Reset Credentials")
+        print("7. Back to Main Menu")
         
-        choice = collector.get_menu_choice("Enter your choice (1-5): ", 5, username=username)
+        choice = collector.get_menu_choice("Enter your choice (1-7): ", 7, username=username)
         
         if choice == 1:
             add_service_engineer(username)
         elif choice == 2:
             update_service_engineer_menu(username)
         elif choice == 3:
-            delete_service_engineer()
+            delete_service_engineer(username)
         elif choice == 4:
             reset_service_engineer_password_menu()
         elif choice == 5:
+            bulk_reset_service_engineer_passwords_menu(username)
+        elif choice == 6:
+            view_reset_credentials_menu(username)
+        elif choice == 7:
             break
         else:
             print("Invalid choice. Please try again.")
@@ -1593,9 +1710,8 @@ def list_service_engineers():
     list_users("super_admin")
 
 def delete_my_account_menu(current_user):
-    from database import get_connection, close_connection
     from crud_operations import delete_user_by_id
-    from session_management import get_current_user_id
+    from session_management import get_authorization_context
     
     print("\n" + "=" * 60)
     print("    DELETE MY ACCOUNT")
@@ -1604,29 +1720,16 @@ def delete_my_account_menu(current_user):
     print("You will be permanently removed from the system!")
     print()
 
-    user_id = get_current_user_id(current_user)
+    context = get_authorization_context(current_user)
     
-    if not user_id:
+    if not context or not context.user_id:
         print("ERROR: Could not find your user account.")
         return
     
-    from encryption import decrypt_data
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute('SELECT role FROM Users WHERE id = ?', (user_id,))
-    user_data = cursor.fetchone()
-    close_connection(conn)
-    
-    if not user_data:
-        print("ERROR: Could not find your user account in database.")
-        return
-    
-    try:
-        decrypted_role = decrypt_data(user_data[0])
-    except:
-        decrypted_role = user_data[0]
+    user_id = context.user_id
+    decrypted_role = context.role
     
-    if decrypted_role == "Super Admin":
+    if context.has_role("Super Admin"):
         print("ERROR: Operation not permitted.")
         print("This is a security measure to prevent system lockout.")
         return
@@ -1649,7 +1752,7 @@ def delete_my_account_menu(current_user):
     else:
         print("Failed to delete your account.")
 
-def delete_system_admin():
+def delete_system_admin(username):
     from database import get_connection, close_connection
     
     print("\n" + "=" * 60)
@@ -1668,7 +1771,7 @@ def delete_system_admin():
         return
     
     from crud_operations import list_system_admins
-    list_system_admins("super_admin")
+    list_system_admins(username)
     
     print("\nEnter the ID of the System Administrator to delete:")
     user_id = input("User ID: ")
@@ -1679,12 +1782,12 @@ def delete_system_admin():
     
     try:
         user_id = int(user_id)
-        delete_user_by_id(user_id, "super_admin", "System Admin")
+        delete_user_by_id(user_id, username, "System Admin")
     except ValueError:
         print("Invalid user ID. Please enter a number.")
         return
 
-def delete_service_engineer():
+def delete_service_engineer(username):
     from database import get_connection, close_connection
     
     print("\n" + "=" * 60)
@@ -1702,7 +1805,7 @@ def delete_service_engineer():
         return
     
     from crud_operations import list_service_engineers
-    list_service_engineers("super_admin")
+    list_service_engineers(username)
     
     print("\nEnter the ID of the Service Engineer to delete:")
     user_id = input("User ID: ")
@@ -1713,7 +1816,7 @@ def delete_service_engineer():
     
     try:
         user_id = int(user_id)
-        delete_user_by_id(user_id, "super_admin", "Service Engineer")
+        delete_user_by_id(user_id, username, "Service Engineer")
     except ValueError:
         print("Invalid user ID. Please enter a number.")
         return
@@ -1824,13 +1927,92 @@ def reset_service_engineer_password_menu():
         print("Invalid user ID. Please enter a number.")
         return
 
+def bulk_reset_service_engineer_passwords_menu(username):
+    from crud_operations import count_users_by_role, bulk_reset_passwords
+    
+    print("\n" + "=" * 60)
+    print("    RESET ALL SERVICE ENGINEER PASSWORDS")
+    print("=" * 60)
+    print("WARNING: Every Service Engineer will get a temporary password!")
+    print("All of them will be forced to change it on next login.")
+    print()
+    
+    count = count_users_by_role("Service Engineer")
+    
+    if count == 0:
+        print("No Service Engineers found in the system.")
+        print("   Cannot reset passwords when none exist.")
+        return
+    
+    confirm = input(f"Reset the passwords of {count} Service Engineers? (y/n): ")
+    if confirm.lower() != 'y':
+        print("Password reset cancelled.")
+        return
+    
+    credentials_file = bulk_reset_passwords("Service Engineer", username)
+    if credentials_file:
+        print(f"\nTemporary passwords written to {credentials_file} (encrypted)")
+        print("Use 'View Reset Credentials' to read or export them.")
+    else:
+        print("\nPassword reset failed.")
+
+def view_reset_credentials_menu(username):
+    from crud_operations import list_reset_credential_files, read_reset_credentials, export_reset_credentials
+    from system_logging import log_action
+    
+    print("\n" + "=" * 60)
+    print("    VIEW RESET CREDENTIALS")
+    print("=" * 60)
+    
+    credential_files = list_reset_credential_files()
+    if not credential_files:
+        print("No bulk reset credentials files found.")
+        return
+    
+    print("Available credentials files:")
+    print("-" * 60)
+    for i, credentials_file in enumerate(credential_files, 1):
+        print(f"{i}. {credentials_file}")
+    print("-" * 60)
+    
+    file_choice = collector.get_menu_choice(f"Select credentials file (1-{len(credential_files)}): ", len(credential_files), username=username, field_name="credentials_file_choice")
+    if not file_choice:
+        print("Cancelled.")
+        return
+    credentials_file = credential_files[file_choice - 1]
+    
+    print("\n1. Show temporary passwords")
+    print("2. Export to CSV file")
+    print("3. Cancel")
+    action = collector.get_menu_choice("Enter your choice (1-3): ", 3, username=username, field_name="credentials_action_choice")
+    
+    if action == 1:
+        try:
+            credentials = read_reset_credentials(credentials_file)
+        except Exception as e:
+            print(f"ERROR reading {credentials_file}: {e}")
+            return
+        log_action(username, "Viewed bulk reset credentials", f"File: {credentials_file}")
+        print(f"\n{'Username':<20} {'Temporary password':<20}")
+        print("-" * 41)
+        for reset_username, temp_password in credentials:
+            print(f"{reset_username:<20} {temp_password:<20}")
+        print(f"\n{len(credentials)} temporary passwords")
+    elif action == 2:
+        export_file = export_reset_credentials(credentials_file, username)
+        if export_file:
+            print(f"\nCredentials exported to {export_file} (plain text, owner-only permissions)")
+            print("Delete the export once the passwords have been handed out.")
+
 def view_logs(username):
     print("\n=== SYSTEM LOGS ===")
     print("1. View All Logs")
     print("2. View Suspicious Activities")
-    print("3. Back")
+    print("3. Verify Log Integrity")
+    print("4. Full Log Integrity Scan")
+    print("5. Back")
     
-    choice = collector.get_menu_choice("Enter your choice (1-3): ", 3, username=username, field_name="log_menu_choice")
+    choice = collector.get_menu_choice("Enter your choice (1-5): ", 5, username=username, field_name="log_menu_choice")
     
     if choice == 1:
         from system_logging import display_logs_paginated
@@ -1838,6 +2020,32 @@ def view_logs(username):
     elif choice == 2:
         from system_logging import display_suspicious_logs_paginated
         display_suspicious_logs_paginated(username)
+    elif choice == 3:
+        from system_logging import display_log_integrity_report
+        display_log_integrity_report(username)
+    elif choice == 4:
+        from system_logging import display_log_integrity_report
+        display_log_integrity_report(username, full_scan=True)
+
+def activity_dashboard_menu(username):
+    from system_logging import display_log_dashboard, rebuild_log_stats
+    
+    while True:
+        display_log_dashboard()
+        print("1. Refresh")
+        print("2. Rebuild Statistics From Log")
+        print("3. Back")
+        
+        choice = collector.get_menu_choice("Enter your choice (1-3): ", 3, username=username, field_name="dashboard_menu_choice")
+        
+        if choice == 1:
+            continue
+        elif choice == 2:
+            stats = rebuild_log_stats()
+            log_action(username, "Rebuilt log statistics", f"Entries: {stats['entries']}")
+            print(f"Statistics rebuilt from {stats['entries']} log entries.")
+        else:
+            return
 
 def generate_restore_code_menu(username):
     from crud_operations import list_system_admins
@@ -1959,6 +2167,102 @@ def revoke_restore_code_menu(username):
         return
     revoke_restore_code(code)
 
+SUPER_ADMIN_BACKUP_CHOICES = {4, 5, 7, 8, 9}
+
+def create_backup_menu(username):
+    from backup import compact_backup_chain, is_archive_backup
+    from session_management import require_role
+    from backup_store import create_store_backup, prune_backup_store
+    from backup_scheduler import apply_backup_retention, display_backup_runs
+    
+    print("\n=== CREATE BACKUP ===")
+    print("1. Full Backup")
+    print("2. Incremental Backup")
+    print("3. Deduplicated Backup")
+    print("4. Compact Latest Backup Chain")
+    print("5. Prune Backup Store")
+    print("6. View Backup Runs")
+    print("7. Apply Backup Retention")
+    print("8. Reconcile Backup Catalog")
+    print("9. Configure Backup Compression")
+    print("10. Back")
+    
+    choice = collector.get_menu_choice("Enter your choice (1-10): ", 10, username=username, field_name="backup_menu_choice")
+    
+    if choice in SUPER_ADMIN_BACKUP_CHOICES and not require_role(username, "Super Admin"):
+        print("ERROR: Operation not permitted.")
+        return
+    
+    if choice == 1:
+        backup_filename = create_backup()
+    elif choice == 2:
+        backup_filename = create_backup(incremental=True)
+    elif choice == 3:
+        backup_filename = create_store_backup()
+    elif choice == 4:
+        backup_files = [backup for backup in list_backups() if is_archive_backup(backup)]
+        if not backup_files:
+            print("No backup files found. Create a backup first.")
+            return
+        backup_filename = compact_backup_chain(backup_files[0])
+    elif choice == 5:
+        prune_backup_store()
+        return
+    elif choice == 6:
+        display_backup_runs()
+        return
+    elif choice == 7:
+        removed = apply_backup_retention()
+        log_action(username, "Applied backup retention", f"Removed {len(removed)} scheduled backups")
+        return
+    elif choice == 8:
+        added, missing, changed = reconcile_backup_catalog()
+        if not (added or missing or changed):
+            print("Backup catalog matches the backups on disk.")
+        log_action(username, "Reconciled backup catalog", f"Added: {added}, Missing: {len(missing)}, Changed: {len(changed)}", suspicious=bool(changed))
+        return
+    elif choice == 9:
+        configure_backup_compression_menu(username)
+        return
+    else:
+        return
+    
+    if backup_filename:
+        log_action(username, f"Created backup: {backup_filename}")
+
+def configure_backup_compression_menu(username):
+    from backup import BACKUP_CODECS, BACKUP_CODEC_LEVELS, DEFAULT_BACKUP_POLICY, describe_codec, load_backup_policy, save_backup_policy
+    
+    policy = load_backup_policy()
+    print("\n=== CONFIGURE BACKUP COMPRESSION ===")
+    print(f"Current codec: {describe_codec(policy['codec'], policy['level'])}")
+    print(f"Compact snapshots with VACUUM INTO: {'Yes' if policy['vacuum_snapshot'] else 'No'}")
+    
+    codec = input(f"Codec ({', '.join(BACKUP_CODECS)}) [{policy['codec']}]: ").strip().lower() or policy['codec']
+    if codec not in BACKUP_CODECS:
+        print(f"Unknown codec: {codec}")
+        return
+    
+    level = None
+    if codec in BACKUP_CODEC_LEVELS:
+        low, high = BACKUP_CODEC_LEVELS[codec]
+        default_level = min(max(policy['level'], low), high) if policy['level'] is not None else DEFAULT_BACKUP_POLICY['level']
+        level_input = input(f"Compression level ({low}-{high}) [{default_level}]: ").strip()
+        if not level_input:
+            level = default_level
+        elif level_input.isdigit() and low <= int(level_input) <= high:
+            level = int(level_input)
+        else:
+            print(f"Level must be a number between {low} and {high}.")
+            return
+    
+    vacuum_input = input("Compact full backup snapshots with VACUUM INTO? (y/n): ").strip().lower()
+    vacuum_snapshot = vacuum_input == 'y' if vacuum_input else policy['vacuum_snapshot']
+    
+    save_backup_policy({'vacuum_snapshot': vacuum_snapshot, 'codec': codec, 'level': level})
+    log_action(username, "Updated backup compression", f"Codec: {describe_codec(codec, level)}, Vacuum snapshot: {vacuum_snapshot}")
+    print("Backup compression policy updated.")
+
 def restore_backup_menu(username):
     code = collector.get_validated_input(
         "Enter restore code: ",
@@ -2091,5 +2395,54 @@ def restore_backup_direct_menu(username):
         else:
             print("\n❌ Restore failed.")
 
+def point_in_time_restore_menu(username):
+    from datetime import datetime
+    from wal_archive import get_recovery_window, restore_to_time
+    
+    print("\n" + "=" * 60)
+    print("    POINT-IN-TIME RESTORE")
+    print("=" * 60)
+    
+    window = get_recovery_window()
+    if window is None:
+        print("No base backup with WAL archiving found. Create a full backup first.")
+        return
+    
+    earliest, latest = window
+    print(f"Recoverable from: {datetime.fromtimestamp(earliest).strftime('%Y-%m-%d %H:%M:%S')}")
+    print(f"Archived up to:   {datetime.fromtimestamp(latest).strftime('%Y-%m-%d %H:%M:%S')}")
+    
+    target_input = input("Restore to (YYYY-MM-DD HH:MM:SS): ").strip()
+    try:
+        target_time = datetime.strptime(target_input, '%Y-%m-%d %H:%M:%S').timestamp()
+    except ValueError:
+        print("Invalid date and time.")
+        return
+    
+    print(f"WARNING: This will restore the database as of {target_input}")
+    print("This will overwrite the current database!")
+    confirm = input("Are you sure you want to continue? (y/n): ")
+    if confirm.lower() != 'y':
+        print("Restore cancelled.")
+        return
+    
+    result = restore_to_time(target_time, username)
+    
+    if result.get('success'):
+        if not result.get('user_exists_in_restored_db', False):
+            print(f"\n{'!' * 60}")
+            print("  WARNING: Your account does not exist in the restored database!")
+            print("  You will be logged out automatically.")
+            print(f"{'!' * 60}")
+            
+            from authentication import logout_user
+            if logout_user(username):
+                print("\nYou have been logged out successfully.")
+                return "force_logout"
+        else:
+            print("\n✅ Database restored successfully!")
+    else:
+        print(f"\n❌ Restore failed: {result.get('error', 'Unknown error')}")
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,407 @@
+import atexit
+import io
+import json
+import os
+import shutil
+import sqlite3
+import struct
+import tempfile
+import threading
+import time
+import uuid
+from datetime import datetime
+from database import close_connection, get_database_path, set_wal_autocheckpoint
+from backup_encryption import EncryptedArchiveReader, EncryptedArchiveWriter
+from system_logging import audit_thread_output
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+wal_archive_dir = 'wal_archive'
+wal_archive_state_file = os.path.join(wal_archive_dir, 'state.json')
+wal_archiver_lock_file = 'wal_archiver.lock'
+WAL_ARCHIVE_INTERVAL = 15
+WAL_SEGMENT_INDEX = 'segments.jsonl'
+WAL_HEADER_SIZE = 32
+WAL_FRAME_HEADER_SIZE = 24
+WAL_MAGIC = (0x377f0682, 0x377f0683)
+
+archive_lock = threading.RLock()
+archiver_stop = threading.Event()
+archiver_thread = None
+
+def read_wal_header(wal_file):
+    header = wal_file.read(WAL_HEADER_SIZE)
+    if len(header) < WAL_HEADER_SIZE:
+        return None
+    magic, version, page_size, checkpoint_seq, salt1, salt2 = struct.unpack('>6I', header[:24])
+    if magic not in WAL_MAGIC:
+        return None
+    return {
+        'page_size': 65536 if page_size == 1 else page_size,
+        'salts': [salt1, salt2]
+    }
+
+def new_wal_archive_state():
+    return {
+        'generation': uuid.uuid4().hex,
+        'sequence': 0,
+        'salts': None,
+        'offset': WAL_HEADER_SIZE,
+        'complete': False,
+        'archived': time.time()
+    }
+
+def load_wal_archive_state():
+    try:
+        with open(wal_archive_state_file, 'r') as f:
+            return json.load(f)
+    except:
+        return None
+
+def save_wal_archive_state(state):
+    os.makedirs(wal_archive_dir, exist_ok=True)
+    temp_path = wal_archive_state_file + '.tmp'
+    with open(temp_path, 'w') as f:
+        json.dump(state, f)
+    os.replace(temp_path, wal_archive_state_file)
+
+def get_wal_generation():
+    state = load_wal_archive_state()
+    return state['generation'] if state else None
+
+def reset_wal_archive():
+    if load_wal_archive_state() is None:
+        return None
+    with archive_lock:
+        state = new_wal_archive_state()
+        save_wal_archive_state(state)
+    return state['generation']
+
+def get_generation_dir(generation):
+    return os.path.join(wal_archive_dir, generation)
+
+def read_segment_index(generation):
+    index_path = os.path.join(get_generation_dir(generation), WAL_SEGMENT_INDEX)
+    if not os.path.exists(index_path):
+        return []
+    with open(index_path, 'r') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def append_segment_index(generation, segment):
+    with open(os.path.join(get_generation_dir(generation), WAL_SEGMENT_INDEX), 'a') as f:
+        f.write(json.dumps(segment) + '\n')
+        f.flush()
+        os.fsync(f.fileno())
+
+def copy_committed_frames(wal_file, header, state, segment_path, valid_frames):
+    frame_size = WAL_FRAME_HEADER_SIZE + header['page_size']
+    end_offset = WAL_HEADER_SIZE + valid_frames * frame_size
+    pending = []
+    frames = commits = 0
+
+    wal_file.seek(state['offset'])
+    with EncryptedArchiveWriter(segment_path) as segment:
+        while wal_file.tell() < end_offset:
+            frame = wal_file.read(frame_size)
+            if len(frame) < frame_size:
+                break
+            page_number, commit_size, salt1, salt2 = struct.unpack('>4I', frame[:16])
+            if [salt1, salt2] != header['salts']:
+                break
+
+            pending.append(frame)
+            if commit_size:
+                for pending_frame in pending:
+                    segment.write(pending_frame)
+                frames += len(pending)
+                commits += 1
+                pending = []
+                state['offset'] = wal_file.tell()
+    return frames, commits
+
+def archive_wal():
+    database_path = get_database_path()
+    if load_wal_archive_state() is None or not os.path.exists(database_path):
+        return None
+
+    with archive_lock:
+        database_inode = os.stat(database_path).st_ino
+        lock_conn = sqlite3.connect(database_path, timeout=30.0)
+        checkpoint_conn = sqlite3.connect(database_path, timeout=30.0)
+        try:
+            lock_conn.execute('PRAGMA wal_autocheckpoint=0')
+            checkpoint_conn.execute('PRAGMA wal_autocheckpoint=0')
+            lock_conn.execute('BEGIN IMMEDIATE')
+            try:
+                if os.stat(database_path).st_ino != database_inode:
+                    return None
+                busy, log_frames, checkpointed = checkpoint_conn.execute('PRAGMA wal_checkpoint(PASSIVE)').fetchone()
+                if busy or log_frames < 0:
+                    return None
+                state = load_wal_archive_state()
+                segment = archive_wal_frames(database_path + '-wal', state, log_frames)
+                state['complete'] = log_frames == checkpointed
+                save_wal_archive_state(state)
+            finally:
+                lock_conn.rollback()
+        finally:
+            close_connection(checkpoint_conn)
+            close_connection(lock_conn)
+    return segment
+
+def archive_wal_frames(wal_path, state, valid_frames):
+    if not valid_frames or not os.path.exists(wal_path):
+        return None
+
+    with open(wal_path, 'rb') as wal_file:
+        header = read_wal_header(wal_file)
+        if header is None:
+            return None
+
+        if header['salts'] != state['salts']:
+            continuous = state['salts'] is not None and state['complete'] and header['salts'][0] == (state['salts'][0] + 1) & 0xFFFFFFFF
+            if state['salts'] is not None and not continuous:
+                print("WAL archive gap detected, starting a new archive generation")
+                state.clear()
+                state.update(new_wal_archive_state())
+            state['salts'] = header['salts']
+            state['offset'] = WAL_HEADER_SIZE
+
+        generation_dir = get_generation_dir(state['generation'])
+        os.makedirs(generation_dir, exist_ok=True)
+        segment_file = f"{state['sequence'] + 1:08d}.wal.enc"
+        segment_path = os.path.join(generation_dir, segment_file)
+        frames, commits = copy_committed_frames(wal_file, header, state, segment_path + '.tmp', valid_frames)
+
+    if not frames:
+        os.remove(segment_path + '.tmp')
+        return None
+
+    os.replace(segment_path + '.tmp', segment_path)
+    archived = time.time()
+    segment = {
+        'sequence': state['sequence'] + 1,
+        'file': segment_file,
+        'page_size': header['page_size'],
+        'frames': frames,
+        'commits': commits,
+        'started': state['archived'],
+        'archived': archived
+    }
+    append_segment_index(state['generation'], segment)
+    state['sequence'] += 1
+    state['archived'] = archived
+    return segment
+
+def iter_segment_frames(generation, segment):
+    frame_size = WAL_FRAME_HEADER_SIZE + segment['page_size']
+    path = os.path.join(get_generation_dir(generation), segment['file'])
+    with EncryptedArchiveReader(path) as raw:
+        reader = io.BufferedReader(raw)
+        while True:
+            frame = reader.read(frame_size)
+            if not frame:
+                break
+            if len(frame) < frame_size:
+                raise ValueError(f"WAL segment {segment['file']} is truncated")
+            page_number, commit_size = struct.unpack('>2I', frame[:8])
+            yield page_number, commit_size, frame[WAL_FRAME_HEADER_SIZE:]
+
+def replay_wal_segments(database_path, generation, segments):
+    from backup import get_page_size
+    page_size = get_page_size(database_path)
+    database_pages = None
+
+    with open(database_path, 'r+b') as database:
+        for segment in segments:
+            if segment['page_size'] != page_size:
+                raise ValueError(f"WAL segment {segment['file']} has page size {segment['page_size']}, database has {page_size}")
+            for page_number, commit_size, page in iter_segment_frames(generation, segment):
+                database.seek((page_number - 1) * page_size)
+                database.write(page)
+                if commit_size:
+                    database_pages = commit_size
+        if database_pages is not None:
+            database.truncate(database_pages * page_size)
+        database.flush()
+        os.fsync(database.fileno())
+
+def find_recovery_base(target_time):
+    from backup import is_archive_backup, list_backups, read_backup_manifest
+
+    for backup_filename in list_backups():
+        if not is_archive_backup(backup_filename) or not os.path.exists(backup_filename):
+            continue
+        manifest = read_backup_manifest(backup_filename)
+        if not manifest or not manifest.get('wal_generation') or manifest.get('vacuumed'):
+            continue
+        if manifest['snapshot_time'] <= target_time:
+            return backup_filename, manifest
+    return None
+
+def restore_to_time(target_time, username):
+    from backup import extract_backup, install_staged_files, verify_staged_files
+    from system_logging import log_action
+
+    try:
+        archive_wal()
+        base = find_recovery_base(target_time)
+        if base is None:
+            print("No base backup with WAL archiving was taken before the requested time")
+            return {'success': False, 'error': 'No base backup before the requested time'}
+
+        backup_filename, manifest = base
+        generation = manifest['wal_generation']
+        segments = [segment for segment in read_segment_index(generation)
+                    if manifest['snapshot_time'] <= segment['archived'] <= target_time]
+        recovered_to = segments[-1]['archived'] if segments else manifest['snapshot_time']
+
+        with tempfile.TemporaryDirectory(prefix='.restore_', dir='.') as staging_dir:
+            extract_backup(backup_filename, staging_dir)
+            replay_wal_segments(os.path.join(staging_dir, 'urban_mobility.db'), generation, segments)
+            verify_staged_files(staging_dir)
+            install_staged_files(staging_dir)
+
+        recovered_str = datetime.fromtimestamp(recovered_to).strftime('%Y-%m-%d %H:%M:%S')
+        print(f"Database restored from {backup_filename} and {len(segments)} WAL segments")
+        print(f"Recovered to {recovered_str}")
+
+        from database import get_connection
+        from encryption import blind_index
+        conn = get_connection()
+        try:
+            current_user_exists = conn.execute('SELECT 1 FROM Users WHERE username_index = ?', (blind_index(username),)).fetchone() is not None
+        finally:
+            close_connection(conn)
+
+        if current_user_exists:
+            log_action(username, f"Restored database to point in time {recovered_str}", f"Base: {backup_filename}, WAL segments: {len(segments)}")
+
+        return {
+            'success': True,
+            'user_exists_in_restored_db': current_user_exists,
+            'username': username,
+            'recovered_to': recovered_to
+        }
+    except Exception as e:
+        print(f"Error restoring to point in time: {e}")
+        return {'success': False, 'error': str(e)}
+
+def get_recovery_window():
+    state = load_wal_archive_state()
+    if state is None:
+        return None
+    base = find_recovery_base(time.time())
+    if base is None:
+        return None
+    segments = read_segment_index(base[1]['wal_generation'])
+    return base[1]['snapshot_time'], segments[-1]['archived'] if segments else base[1]['snapshot_time']
+
+def prune_wal_archive():
+    from backup import is_archive_backup, list_backups, read_backup_manifest
+
+    oldest_bases = {}
+    for backup_filename in list_backups():
+        if not is_archive_backup(backup_filename) or not os.path.exists(backup_filename):
+            continue
+        manifest = read_backup_manifest(backup_filename)
+        if manifest and manifest.get('wal_generation') and not manifest.get('vacuumed'):
+            generation = manifest['wal_generation']
+            oldest_bases[generation] = min(oldest_bases.get(generation, manifest['snapshot_time']), manifest['snapshot_time'])
+
+    current_generation = get_wal_generation()
+    removed = 0
+    if not os.path.isdir(wal_archive_dir):
+        return removed
+
+    with archive_lock:
+        for generation in os.listdir(wal_archive_dir):
+            generation_dir = get_generation_dir(generation)
+            if not os.path.isdir(generation_dir):
+                continue
+            if generation not in oldest_bases and generation != current_generation:
+                removed += len(read_segment_index(generation))
+                shutil.rmtree(generation_dir)
+                continue
+
+            oldest_base = oldest_bases.get(generation, time.time())
+            segments = read_segment_index(generation)
+            kept = [segment for segment in segments if segment['archived'] >= oldest_base]
+            if len(kept) == len(segments):
+                continue
+            for segment in segments:
+                if segment['archived'] < oldest_base:
+                    os.remove(os.path.join(generation_dir, segment['file']))
+            index_path = os.path.join(generation_dir, WAL_SEGMENT_INDEX)
+            with open(index_path + '.tmp', 'w') as f:
+                f.writelines(json.dumps(segment) + '\n' for segment in kept)
+            os.replace(index_path + '.tmp', index_path)
+            removed += len(segments) - len(kept)
+
+    if removed:
+        print(f"Removed {removed} WAL segments no longer covered by a base backup")
+    return removed
+
+def acquire_archiver_lock():
+    lock_handle = open(wal_archiver_lock_file, 'a')
+    if fcntl is not None:
+        try:
+            fcntl.flock(lock_handle.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_handle.close()
+            return None
+    return lock_handle
+
+def wal_archiver_loop(interval=WAL_ARCHIVE_INTERVAL):
+    lock_handle = None
+    keepalive = None
+    keepalive_inode = None
+    try:
+        while not archiver_stop.is_set():
+            if lock_handle is None:
+                lock_handle = acquire_archiver_lock()
+            if lock_handle is not None:
+                database_inode = os.stat(get_database_path()).st_ino
+                if keepalive is None or keepalive_inode != database_inode:
+                    close_connection(keepalive)
+                    keepalive = sqlite3.connect(get_database_path(), timeout=30.0)
+                    keepalive_inode = database_inode
+                    keepalive.execute('PRAGMA wal_autocheckpoint=0')
+                    keepalive.execute('SELECT COUNT(*) FROM sqlite_master').fetchone()
+                try:
+                    archive_wal()
+                except Exception as e:
+                    print(f"Error archiving WAL frames: {e}")
+            archiver_stop.wait(interval)
+
+        if lock_handle is not None:
+            archive_wal()
+    finally:
+        close_connection(keepalive)
+        if lock_handle is not None:
+            lock_handle.close()
+
+def run_wal_archiver_thread(interval):
+    with audit_thread_output('wal_archive'):
+        wal_archiver_loop(interval)
+
+def start_wal_archiver(interval=WAL_ARCHIVE_INTERVAL):
+    global archiver_thread
+    set_wal_autocheckpoint(0)
+    if load_wal_archive_state() is None:
+        save_wal_archive_state(new_wal_archive_state())
+
+    if archiver_thread is None or not archiver_thread.is_alive():
+        archiver_stop.clear()
+        archiver_thread = threading.Thread(target=run_wal_archiver_thread, args=(interval,), name="wal-archiver", daemon=True)
+        archiver_thread.start()
+
+def stop_wal_archiver():
+    archiver_stop.set()
+    if archiver_thread is not None and archiver_thread.is_alive():
+        archiver_thread.join(timeout=30)
+
+atexit.register(stop_wal_archiver)